@@ -0,0 +1,131 @@
+"""
+Shared DataLoader factory for the training scripts
+AniLink: AI-Powered Health Intelligence Platform for Veterinary Services
+
+`make_loader` builds the train/val/test loaders of train_fmd_model_complete.py,
+train_cattle_detection_model.py and New_Model_Training/Data_AniLink/train_fmd_model.py:
+- one worker process per available core, leaving one for the training loop (--workers overrides)
+- persistent workers, so the processes (and their opened files / cache mappings) survive
+  between epochs instead of being started again every epoch
+- PREFETCH_FACTOR batches queued per worker
+- every worker seeds NumPy and `random` from its torch seed, so workers do not repeat each
+  other's augmentations
+- pinned memory only when CUDA is available (it only slows down CPU training)
+
+`TimedLoader` wraps a loader and splits each pass into time spent waiting for the next batch
+and time spent on everything else (forward, backward, metrics). A high data-wait share means
+the input pipeline, not the model, is the bottleneck.
+"""
+
+import os
+import random
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+PREFETCH_FACTOR = 4
+MAX_WORKERS = 8
+# Share of an epoch spent waiting on data above which the report suggests more workers
+DATA_WAIT_WARNING = 0.3
+
+
+def available_cores():
+    """Cores this process may run on (respects CPU affinity / container limits where exposed)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # Windows, macOS
+        return os.cpu_count() or 1
+
+
+def default_num_workers():
+    """One worker per core minus one for the training loop, at most MAX_WORKERS (0 on one core)"""
+    return max(0, min(MAX_WORKERS, available_cores() - 1))
+
+
+def seed_worker(worker_id):
+    # torch gives every worker its own seed (base seed + worker id) but leaves the NumPy and
+    # random state (used by albumentations) as copied from the parent, identical in every worker
+    seed = torch.initial_seed() % 2 ** 32
+    np.random.seed(seed)
+    random.seed(seed)
+
+
+def make_loader(dataset, batch_size, shuffle=False, num_workers=None, persistent=True,
+                seed=None, prefetch_factor=PREFETCH_FACTOR):
+    """
+    DataLoader with the shared worker settings. num_workers=None picks default_num_workers();
+    persistent=False for loaders iterated only once (test). A seed gives the loader its own
+    generator, so the shuffle order and worker seeds are reproducible.
+    """
+    if num_workers is None:
+        num_workers = default_num_workers()
+    generator = None
+    if seed is not None:
+        generator = torch.Generator()
+        generator.manual_seed(seed)
+    options = {}
+    if num_workers > 0:
+        options = {
+            'persistent_workers': persistent,
+            'prefetch_factor': prefetch_factor,
+            'worker_init_fn': seed_worker,
+        }
+    return DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=shuffle,
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(),
+        generator=generator,
+        **options
+    )
+
+
+class TimedLoader:
+    """
+    Iterates a loader while timing it: `data_wait` is the time spent blocked on the next batch,
+    `compute` the time between receiving a batch and asking for the next one. Both are reset at
+    the start of every pass, so after an epoch they describe that epoch.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.data_wait = 0.0
+        self.compute = 0.0
+        self.batches = 0
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __iter__(self):
+        self.data_wait = 0.0
+        self.compute = 0.0
+        self.batches = 0
+        batches = iter(self.loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = next(batches)
+            except StopIteration:
+                return
+            received = time.perf_counter()
+            self.data_wait += received - start
+            self.batches += 1
+            yield batch
+            self.compute += time.perf_counter() - received
+
+    @property
+    def wait_ratio(self):
+        """Share of the pass spent waiting for data (0 = never waited)"""
+        total = self.data_wait + self.compute
+        return self.data_wait / total if total > 0 else 0.0
+
+    def report(self):
+        workers = self.loader.num_workers
+        line = (f'Data loading: {self.data_wait:.1f}s waiting / {self.compute:.1f}s compute '
+                f'({self.wait_ratio:.0%} waiting on data, {workers} worker{"s" if workers != 1 else ""})')
+        if self.wait_ratio > DATA_WAIT_WARNING:
+            line += ' - input pipeline is the bottleneck: use the dataset cache or more workers'
+        return line
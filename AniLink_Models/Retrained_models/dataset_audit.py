@@ -0,0 +1,275 @@
+"""
+Parallel dataset audit for the training scripts
+AniLink: AI-Powered Health Intelligence Platform for Veterinary Services
+
+`audit_dataset` inspects every image of the train/val/test splits in a process pool, reading
+each file once: the bytes are hashed (MD5) and decoded from memory, which checks the image is
+readable (a full decode, stricter than Image.verify), gives its dimensions, and yields two
+64-bit perceptual hashes (dHash and pHash). JPEGs are decoded at reduced scale (Image.draft),
+which is all the 32x32 hashes need and several times faster than a full-size decode.
+
+Near-duplicates (resized, recompressed or lightly edited copies) are found with a multi-index
+hash table over the pHashes: each hash is cut into max_distance + 1 bit ranges, and two hashes
+within max_distance bits of each other agree exactly on at least one of them (pigeonhole), so
+only hashes sharing a bucket are compared, vectorized with NumPy. Exact and near-duplicates
+are merged into groups, and a group is reported as:
+- leakage when its images are in more than one split (the model is evaluated on images it
+  was trained on)
+- a label conflict when its images carry different labels
+
+Used by train_fmd_model_complete.py (STEP 2) and `--mode audit` of both training scripts, on
+the inspection results kept by the dataset manifest (dataset_manifest.py).
+"""
+
+import io
+import hashlib
+import json
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+# Hamming distance (of 64 bits) up to which two pHashes count as the same picture
+DEFAULT_MAX_DISTANCE = 6
+# Rows compared at once inside one bucket (bounds memory on very large buckets)
+_BLOCK = 2048
+
+
+# ============================================================================
+# PER-IMAGE INSPECTION (worker processes)
+# ============================================================================
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    return np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n))
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _pack_bits(bits):
+    """64 booleans -> hash as a 16-digit hex string"""
+    return np.packbits(bits.ravel()).tobytes().hex()
+
+
+def dhash(gray):
+    """Difference hash: is each pixel brighter than its right neighbour (9x8 grayscale)"""
+    pixels = np.asarray(gray.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    return _pack_bits(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(gray):
+    """Perceptual hash: sign of the lowest 8x8 DCT coefficients of the 32x32 image vs. their median"""
+    pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+    low = (_DCT_32 @ pixels @ _DCT_32.T)[:8, :8]
+    return _pack_bits(low > np.median(low))
+
+
+def inspect_image(path):
+    """Validity, size, format, dimensions, MD5, dHash and pHash of one image file (read once)"""
+    record = {'path': str(path), 'bytes': None, 'md5': None, 'valid': False, 'error': None,
+              'format': None, 'width': None, 'height': None, 'dhash': None, 'phash': None}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        record['bytes'] = len(data)
+        record['md5'] = hashlib.md5(data).hexdigest()
+        with Image.open(io.BytesIO(data)) as img:
+            record['format'] = img.format
+            record['width'], record['height'] = img.size
+            # JPEG: let the decoder scale down by up to 8x; the hashes only need 32x32
+            img.draft('L', (64, 64))
+            gray = img.convert('L')
+        record['dhash'] = dhash(gray)
+        record['phash'] = phash(gray)
+        record['valid'] = True
+    except Exception as e:
+        record['error'] = str(e) or type(e).__name__
+    return record
+
+
+def inspect_images(paths, workers=None, chunksize=64):
+    """inspect_image for many files in a process pool; records in the order of `paths`"""
+    paths = [str(path) for path in paths]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2 * chunksize:
+        return [inspect_image(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(inspect_image, paths, chunksize=chunksize))
+
+
+# ============================================================================
+# NEAR-DUPLICATE INDEX
+# ============================================================================
+
+def _popcount(x):
+    """Set bits of each uint64"""
+    if hasattr(np, 'bitwise_count'):  # NumPy >= 2.0
+        return np.bitwise_count(x)
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+class _DisjointSet:
+    def __init__(self, n):
+        self.parent = list(range(n))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        root_i, root_j = self.find(i), self.find(j)
+        if root_i != root_j:
+            self.parent[max(root_i, root_j)] = min(root_i, root_j)
+
+
+def near_duplicate_pairs(hashes, max_distance=DEFAULT_MAX_DISTANCE):
+    """
+    Index pairs (i < j) of 64-bit hashes (uint64 array) at most max_distance bits apart,
+    found through a multi-index hash table of max_distance + 1 bit ranges.
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    if len(hashes) < 2:
+        return set()
+    chunks = max_distance + 1
+    bounds = np.linspace(0, 64, chunks + 1).astype(int)
+    pairs = set()
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        keys = (hashes >> np.uint64(lo)) & np.uint64((1 << int(hi - lo)) - 1)
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            if end - start < 2:
+                continue
+            members = order[start:end]
+            bucket = hashes[members]
+            for row in range(0, len(members), _BLOCK):
+                block = bucket[row:row + _BLOCK]
+                distance = _popcount(block[:, None] ^ bucket[None, :])
+                i, j = np.nonzero(distance <= max_distance)
+                i = i + row
+                keep = i < j
+                for a, b in zip(members[i[keep]], members[j[keep]]):
+                    pairs.add((int(min(a, b)), int(max(a, b))))
+    return pairs
+
+
+# ============================================================================
+# AUDIT
+# ============================================================================
+
+def audit_dataset(samples, max_distance=DEFAULT_MAX_DISTANCE, workers=None, records=None):
+    """
+    Audit (path, split, label) samples. Returns a report dict: per-image records, corrupted
+    files, duplicate groups (exact and near), leakage and label conflicts. `records`
+    ({path: inspect_image result}, e.g. from the dataset manifest) saves reading those files.
+    """
+    start = time.time()
+    inspected = dict(records or {})
+    paths = [path for path in dict.fromkeys(str(path) for path, _, _ in samples) if path not in inspected]
+    for record in inspect_images(paths, workers=workers):
+        inspected[record['path']] = record
+
+    rows = []
+    for path, split, label in samples:
+        rows.append({**inspected[str(path)], 'split': split, 'label': label})
+    valid = [i for i, row in enumerate(rows) if row['valid']]
+
+    groups = _DisjointSet(len(rows))
+    by_md5 = defaultdict(list)
+    for i in valid:
+        by_md5[rows[i]['md5']].append(i)
+    # Identical pHashes (byte-identical copies, many blank frames) are joined directly; only
+    # distinct values go through the index, so one large cluster does not become millions of pairs
+    hashes = np.array([int(rows[i]['phash'], 16) for i in valid], dtype=np.uint64)
+    distinct, first, inverse = np.unique(hashes, return_index=True, return_inverse=True)
+    for position, value_index in enumerate(inverse.ravel()):
+        groups.union(valid[first[value_index]], valid[position])
+    for a, b in near_duplicate_pairs(distinct, max_distance):
+        groups.union(valid[first[a]], valid[first[b]])
+
+    members_of = defaultdict(list)
+    for i in valid:
+        members_of[groups.find(i)].append(i)
+    duplicate_groups, leakage, label_conflicts = [], [], []
+    for members in members_of.values():
+        if len(members) < 2:
+            continue
+        group = {
+            'paths': [rows[i]['path'] for i in members],
+            'splits': sorted({str(rows[i]['split']) for i in members}),
+            'labels': sorted({str(rows[i]['label']) for i in members}),
+            'exact': len({rows[i]['md5'] for i in members}) == 1,
+        }
+        duplicate_groups.append(group)
+        if len(group['splits']) > 1:
+            leakage.append(group)
+        if len(group['labels']) > 1:
+            label_conflicts.append(group)
+
+    # Exact copies beyond the first within a split (what clean_dataset used to report)
+    exact_duplicates = []
+    for members in by_md5.values():
+        seen = set()
+        for i in members:
+            if rows[i]['split'] in seen:
+                exact_duplicates.append(rows[i]['path'])
+            seen.add(rows[i]['split'])
+
+    return {
+        'max_distance': max_distance,
+        'seconds': round(time.time() - start, 1),
+        'inspected': len(paths),
+        'records': rows,
+        'corrupted': [row['path'] for row in rows if not row['valid']],
+        'exact_duplicates': exact_duplicates,
+        'duplicate_groups': duplicate_groups,
+        'leakage': leakage,
+        'label_conflicts': label_conflicts,
+    }
+
+
+def split_summary(report, split):
+    """Valid / corrupted / exact duplicate counts of one split"""
+    rows = [row for row in report['records'] if row['split'] == split]
+    corrupted = [row['path'] for row in rows if not row['valid']]
+    duplicates = set(report['exact_duplicates'])
+    return {
+        'valid': len(rows) - len(corrupted),
+        'corrupted': corrupted,
+        'duplicates': [row['path'] for row in rows if row['path'] in duplicates],
+    }
+
+
+def print_audit(report, limit=5):
+    rows = report['records']
+    print(f"Audited {len(rows):,} images in {report['seconds']}s ({report['inspected']:,} files read)")
+    for split in dict.fromkeys(row['split'] for row in rows):
+        summary = split_summary(report, split)
+        print(f"  {split}: {summary['valid']:,} valid, {len(summary['corrupted']):,} corrupted, "
+              f"{len(summary['duplicates']):,} exact duplicates")
+    near = sum(1 for group in report['duplicate_groups'] if not group['exact'])
+    print(f"  Duplicate groups: {len(report['duplicate_groups']):,} "
+          f"({near:,} with near-duplicates, pHash distance <= {report['max_distance']})")
+    for name, title in (('leakage', 'Cross-split leakage'), ('label_conflicts', 'Label conflicts')):
+        groups = report[name]
+        print(f"  {title}: {len(groups):,} groups")
+        for group in groups[:limit]:
+            print(f"    [{', '.join(group['splits'])} | labels {', '.join(group['labels'])}] "
+                  f"{' <-> '.join(group['paths'][:3])}{' ...' if len(group['paths']) > 3 else ''}")
+
+
+def save_report(report, path):
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"[OK] Audit report saved as '{path}'")
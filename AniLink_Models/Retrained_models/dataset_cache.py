@@ -0,0 +1,212 @@
+"""
+Preprocessed dataset cache for the training scripts
+AniLink: AI-Powered Health Intelligence Platform for Veterinary Services
+
+Opening, decoding and resizing every JPEG again on every epoch dominates CPU training time.
+`build_cache` decodes each image once to a fixed-size uint8 RGB array and stores the arrays in
+memory-mapped .npy shards (N x SIZE x SIZE x 3) next to an index.json with the labels, source
+paths and a fingerprint of the source files. `CachedImageDataset` reads samples straight from
+the shards (zero-copy views of the page cache) as uint8 CHW tensors, and `tensor_transforms`
+applies the same augmentation as the PIL pipeline on those tensors.
+
+The cache is rebuilt when the fingerprint (paths, labels, file sizes and mtimes, cache size)
+no longer matches, so adding or replacing images is picked up on the next run.
+
+Used by train_fmd_model_complete.py and train_cattle_detection_model.py (--cache-dir):
+    python train_fmd_model_complete.py --mode cache     # one-time build step
+    python train_fmd_model_complete.py --mode train     # builds on first use if missing
+"""
+
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+INDEX_FILE = 'index.json'
+CACHE_VERSION = 1
+
+
+# ============================================================================
+# BUILD
+# ============================================================================
+
+def source_fingerprint(images, labels, size):
+    """Hash of the source files (path, label, size, mtime) and the cache resolution"""
+    digest = hashlib.sha1(f'v{CACHE_VERSION}|{size}'.encode())
+    for path, label in zip(images, labels):
+        try:
+            stat = os.stat(path)
+            digest.update(f'{path}|{label}|{stat.st_size}|{stat.st_mtime_ns}\n'.encode())
+        except OSError:
+            digest.update(f'{path}|{label}|missing\n'.encode())
+    return digest.hexdigest()
+
+
+def _decode(args):
+    """Decode and resize one image (runs in a worker process); black image on failure"""
+    path, size = args
+    try:
+        with Image.open(path) as img:
+            # Same resize as transforms.Resize((size, size)) on the PIL image
+            array = np.asarray(img.convert('RGB').resize((size, size), Image.BILINEAR), dtype=np.uint8)
+        return array, None
+    except Exception as e:
+        return np.zeros((size, size, 3), dtype=np.uint8), str(e)
+
+
+def build_cache(images, labels, cache_dir, size=224, shard_size=2048, workers=None):
+    """
+    Decode `images` once into uint8 shards under cache_dir. Writes to a temporary directory
+    and swaps it in at the end, so an interrupted build never leaves a half-written cache.
+    """
+    fingerprint = source_fingerprint(images, labels, size)
+    tmp_dir = cache_dir.rstrip('/\\') + '.partial'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    workers = workers or os.cpu_count() or 1
+    shards, errors = [], {}
+    start = time.time()
+    print(f'Building dataset cache: {len(images):,} images -> {cache_dir} ({size}x{size}, {workers} workers)')
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        decoded = pool.map(_decode, [(path, size) for path in images], chunksize=32)
+        for shard_start in range(0, len(images), shard_size):
+            count = min(shard_size, len(images) - shard_start)
+            name = f'shard_{len(shards):05d}.npy'
+            shard = np.lib.format.open_memmap(
+                os.path.join(tmp_dir, name), mode='w+', dtype=np.uint8, shape=(count, size, size, 3)
+            )
+            for offset in range(count):
+                array, error = next(decoded)
+                shard[offset] = array
+                if error:
+                    errors[shard_start + offset] = error
+            shard.flush()
+            del shard
+            shards.append({'file': name, 'count': count})
+            print(f'  {shard_start + count:,}/{len(images):,} images')
+
+    for idx, error in errors.items():
+        print(f'  Error loading image {images[idx]}: {error} (cached as a black image)')
+    index = {
+        'version': CACHE_VERSION,
+        'size': size,
+        'fingerprint': fingerprint,
+        'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'shards': shards,
+        'labels': [int(label) for label in labels],
+        'images': [str(path) for path in images],
+        'errors': {str(idx): error for idx, error in errors.items()},
+    }
+    with open(os.path.join(tmp_dir, INDEX_FILE), 'w') as f:
+        json.dump(index, f)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.replace(tmp_dir, cache_dir)
+    total_mb = len(images) * size * size * 3 / 1e6
+    print(f'[OK] Dataset cache built in {time.time() - start:.1f}s ({total_mb:,.0f} MB, {len(errors)} unreadable)')
+    return index
+
+
+def load_index(cache_dir):
+    path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def ensure_cache(images, labels, cache_dir, size=224, workers=None):
+    """Build the cache unless an up-to-date one (same fingerprint) already exists"""
+    index = load_index(cache_dir)
+    if index is not None and index.get('fingerprint') == source_fingerprint(images, labels, size):
+        print(f'[OK] Using dataset cache {cache_dir} ({len(index["labels"]):,} images)')
+        return index
+    return build_cache(images, labels, cache_dir, size=size, workers=workers)
+
+
+# ============================================================================
+# DATASET
+# ============================================================================
+
+try:
+    import torch
+    from torch.utils.data import Dataset
+    from torchvision import transforms
+except ImportError:  # building the cache needs only NumPy and Pillow
+    torch = None
+    Dataset = object
+
+
+class CachedImageDataset(Dataset):
+    """Samples from a dataset cache as (uint8 CHW tensor, label), transformed on the tensor"""
+
+    def __init__(self, cache_dir, transform=None):
+        index = load_index(cache_dir)
+        if index is None:
+            raise FileNotFoundError(f'No dataset cache at {cache_dir} (build it with --mode cache)')
+        self.cache_dir = cache_dir
+        self.transform = transform
+        self.size = index['size']
+        self.images = index['images']
+        self.labels = index['labels']
+        self._files = [shard['file'] for shard in index['shards']]
+        self._starts = []
+        total = 0
+        for shard in index['shards']:
+            self._starts.append(total)
+            total += shard['count']
+        # Opened lazily, so DataLoader workers map the files themselves instead of pickling arrays
+        self._shards = None
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _shard(self, i):
+        if self._shards is None:
+            self._shards = [None] * len(self._files)
+        if self._shards[i] is None:
+            # Copy-on-write mapping: writable views for torch.from_numpy, the file is never modified
+            self._shards[i] = np.load(os.path.join(self.cache_dir, self._files[i]), mmap_mode='c')
+        return self._shards[i]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = None
+        return state
+
+    def __getitem__(self, idx):
+        shard = bisect.bisect_right(self._starts, idx) - 1
+        array = self._shard(shard)[idx - self._starts[shard]]
+        image = torch.from_numpy(array).permute(2, 0, 1)
+        if self.transform:
+            image = self.transform(image)
+        return image, self.labels[idx]
+
+
+def tensor_transforms(image_size, cache_size, train, mean, std):
+    """
+    Tensor equivalent of the scripts' PIL transforms: geometric and color augmentation run on
+    the uint8 image, then conversion to float in [0, 1] (as ToTensor) and normalization.
+    """
+    ops = []
+    if cache_size != image_size:
+        ops.append(transforms.Resize((image_size, image_size)))
+    if train:
+        ops += [
+            transforms.RandomHorizontalFlip(p=0.5),
+            transforms.RandomRotation(degrees=15),
+            transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.1),
+            transforms.RandomAffine(degrees=0, translate=(0.1, 0.1), scale=(0.9, 1.1)),
+        ]
+    ops += [
+        transforms.ConvertImageDtype(torch.float32),
+        transforms.Normalize(mean=mean, std=std),
+    ]
+    return transforms.Compose(ops)
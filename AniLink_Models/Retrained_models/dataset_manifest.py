@@ -0,0 +1,138 @@
+"""
+Incremental dataset manifest for the training scripts
+AniLink: AI-Powered Health Intelligence Platform for Veterinary Services
+
+A SQLite file with one row per image: path, label, size and mtime, and what dataset_audit's
+inspect_image found (validity, format, dimensions, MD5, dHash, pHash). `scan` lists the class
+folders (directory entries only) and inspects just the files whose size or mtime changed or
+that are new, in a process pool; rows of deleted files are removed. Adding 500 photos to a
+50k-image dataset reads those 500 files and stats the rest.
+
+The dataset classes, analyze_dataset and the dataset audit of the training scripts take their
+file lists, labels, dimensions and hashes from here instead of listing and opening every file
+on every run; New_Model_Training/Data_AniLink/train_fmd_model.py splits on the MD5s so copies
+of one image stay in the same split.
+"""
+
+import os
+import sqlite3
+import time
+
+from dataset_audit import inspect_images
+
+MANIFEST_VERSION = 1
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+_FIELDS = ('path', 'directory', 'label', 'size', 'mtime_ns', 'valid', 'error', 'format',
+           'width', 'height', 'md5', 'dhash', 'phash', 'inspected_at')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    label INTEGER,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    valid INTEGER NOT NULL,
+    error TEXT,
+    format TEXT,
+    width INTEGER,
+    height INTEGER,
+    md5 TEXT,
+    dhash TEXT,
+    phash TEXT,
+    inspected_at REAL
+);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+
+def _list_images(directory):
+    """(path, size, mtime_ns) of the images directly in `directory`"""
+    if not os.path.isdir(directory):
+        return []
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                stat = entry.stat()
+                files.append((os.path.join(directory, entry.name), stat.st_size, stat.st_mtime_ns))
+    return files
+
+
+class DatasetManifest:
+    """Per-file inspection results, kept up to date incrementally in a SQLite file"""
+
+    def __init__(self, db_path, workers=None):
+        db_path = str(db_path)
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.db_path = db_path
+        self.workers = workers
+        self._db = sqlite3.connect(db_path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(_SCHEMA)
+        version = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None or int(version['value']) != MANIFEST_VERSION:
+            # Written by another version of the inspection: start over
+            with self._db:
+                self._db.execute('DELETE FROM files')
+                self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)", (str(MANIFEST_VERSION),))
+
+    def close(self):
+        self._db.close()
+
+    def scan(self, class_dirs):
+        """
+        Bring the rows of `class_dirs` ({directory: label}) up to date and return them as dicts,
+        valid or not, per directory in the given order and sorted by path within each.
+        """
+        start = time.time()
+        stats = {'new': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        listed = {}
+        for directory, label in class_dirs.items():
+            directory = os.path.normpath(str(directory))
+            listed[directory] = (label, _list_images(directory))
+
+        stale, removed = [], []
+        for directory, (label, files) in listed.items():
+            known = {
+                row['path']: (row['size'], row['mtime_ns'])
+                for row in self._db.execute('SELECT path, size, mtime_ns FROM files WHERE directory = ?', (directory,))
+            }
+            for path, size, mtime_ns in files:
+                previous = known.pop(path, None)
+                if previous == (size, mtime_ns):
+                    stats['unchanged'] += 1
+                    continue
+                stats['new' if previous is None else 'changed'] += 1
+                stale.append((path, directory, label, size, mtime_ns))
+            removed.extend(known)
+        stats['removed'] = len(removed)
+
+        inspected = inspect_images([path for path, *_ in stale], workers=self.workers)
+        now = time.time()
+        with self._db:
+            self._db.executemany('DELETE FROM files WHERE path = ?', [(path,) for path in removed])
+            self._db.executemany(
+                f"INSERT OR REPLACE INTO files ({', '.join(_FIELDS)}) VALUES ({', '.join('?' * len(_FIELDS))})",
+                [
+                    (path, directory, label, size, mtime_ns, int(record['valid']), record['error'],
+                     record['format'], record['width'], record['height'], record['md5'],
+                     record['dhash'], record['phash'], now)
+                    for (path, directory, label, size, mtime_ns), record in zip(stale, inspected)
+                ],
+            )
+            # A folder mapped to another label only needs its rows relabelled
+            for directory, (label, _) in listed.items():
+                self._db.execute('UPDATE files SET label = ? WHERE directory = ? AND label IS NOT ?',
+                                 (label, directory, label))
+
+        if stale or removed:
+            print(f"[OK] Dataset manifest {self.db_path}: {stats['new']:,} new, {stats['changed']:,} changed, "
+                  f"{stats['removed']:,} removed, {stats['unchanged']:,} unchanged ({time.time() - start:.1f}s)")
+        records = []
+        for directory in listed:
+            rows = self._db.execute('SELECT * FROM files WHERE directory = ? ORDER BY path', (directory,))
+            records.extend({**dict(row), 'valid': bool(row['valid'])} for row in rows)
+        return records
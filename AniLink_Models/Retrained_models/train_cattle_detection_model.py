@@ -10,6 +10,7 @@ Usage:
     python train_cattle_detection_model.py --mode evaluate
     python train_cattle_detection_model.py --mode export
     python train_cattle_detection_model.py --mode all
+    python train_cattle_detection_model.py --mode cache    # decode images once (dataset_cache.py)
 """
 
 import os
@@ -30,7 +31,7 @@ warnings.filterwarnings('ignore')
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset
 from torchvision import transforms, models
 from sklearn.metrics import (
     accuracy_score, precision_score, recall_score, f1_score,
@@ -39,6 +40,11 @@ from sklearn.metrics import (
 from tqdm import tqdm
 import json
 
+from data_loading import TimedLoader, make_loader
+from dataset_audit import audit_dataset, print_audit, save_report
+from dataset_cache import CachedImageDataset, ensure_cache, tensor_transforms
+from dataset_manifest import DatasetManifest
+
 # Set style for professional plots
 plt.style.use('seaborn-v0_8-darkgrid')
 sns.set_palette("husl")
@@ -58,6 +64,20 @@ IMAGE_SIZE = 224
 MODEL_NAME = 'mobilenet_v2'  # Mobile-optimized for farmer's phone
 NUM_CLASSES = 2  # cattle (0) vs non_cattle (1)
 USE_PRETRAINED = True
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Preprocessed dataset cache (dataset_cache.py): every image is decoded and resized once into
+# memory-mapped uint8 shards instead of on every epoch. None (or --no-cache) reads the JPEGs.
+DATASET_CACHE_DIR = './dataset_cache/cattle_detection'
+DATASET_CACHE_SIZE = IMAGE_SIZE
+
+# Dataset manifest (dataset_manifest.py): size, mtime, validity, dimensions and hashes of every
+# image, so analysis, auditing and the datasets only inspect files added or changed since last run
+DATASET_MANIFEST_PATH = './dataset_cache/cattle_detection_manifest.sqlite'
+
+# DataLoader worker processes (data_loading.py); None = one per available core, minus one
+NUM_WORKERS = None
 
 # Hyperparameters
 HYPERPARAMS = {
@@ -91,22 +111,25 @@ os.makedirs(MODEL_SAVE_DIR, exist_ok=True)
 # DATA ANALYSIS FUNCTIONS
 # ============================================================================
 
+_manifest = None
+
+
+def split_records(data_dir):
+    """Manifest records (valid or not) of one split's class folders (cattle = 0, non_cattle = 1)"""
+    global _manifest
+    if _manifest is None:
+        _manifest = DatasetManifest(DATASET_MANIFEST_PATH)
+    return _manifest.scan({os.path.join(data_dir, 'cattle'): 0, os.path.join(data_dir, 'non_cattle'): 1})
+
+
 def analyze_dataset(data_dir, dataset_name):
     """Analyze dataset composition"""
     print(f"\n{dataset_name}:")
     print("-" * 80)
     
-    cattle_dir = Path(data_dir) / 'cattle'
-    non_cattle_dir = Path(data_dir) / 'non_cattle'
-    
-    cattle_count = 0
-    non_cattle_count = 0
-    
-    if cattle_dir.exists():
-        cattle_count = len(list(cattle_dir.glob('*.jpg'))) + len(list(cattle_dir.glob('*.png'))) + len(list(cattle_dir.glob('*.jpeg')))
-    
-    if non_cattle_dir.exists():
-        non_cattle_count = len(list(non_cattle_dir.glob('*.jpg'))) + len(list(non_cattle_dir.glob('*.png'))) + len(list(non_cattle_dir.glob('*.jpeg')))
+    labels = Counter(record['label'] for record in split_records(data_dir))
+    cattle_count = labels[0]
+    non_cattle_count = labels[1]
     
     total = cattle_count + non_cattle_count
     
@@ -173,31 +196,11 @@ class CattleDetectionDataset(Dataset):
         self.images = []
         self.labels = []
         
-        # Load cattle images (label 0)
-        cattle_dir = self.data_dir / 'cattle'
-        if cattle_dir.exists():
-            for img_path in cattle_dir.glob('*.jpg'):
-                self.images.append(str(img_path))
-                self.labels.append(0)
-            for img_path in cattle_dir.glob('*.png'):
-                self.images.append(str(img_path))
-                self.labels.append(0)
-            for img_path in cattle_dir.glob('*.jpeg'):
-                self.images.append(str(img_path))
-                self.labels.append(0)
-        
-        # Load non-cattle images (label 1)
-        non_cattle_dir = self.data_dir / 'non_cattle'
-        if non_cattle_dir.exists():
-            for img_path in non_cattle_dir.glob('*.jpg'):
-                self.images.append(str(img_path))
-                self.labels.append(1)
-            for img_path in non_cattle_dir.glob('*.png'):
-                self.images.append(str(img_path))
-                self.labels.append(1)
-            for img_path in non_cattle_dir.glob('*.jpeg'):
-                self.images.append(str(img_path))
-                self.labels.append(1)
+        # Readable cattle (label 0) and non-cattle (label 1) images, from the manifest
+        for record in split_records(data_dir):
+            if record['valid']:
+                self.images.append(record['path'])
+                self.labels.append(record['label'])
     
     def __len__(self):
         return len(self.images)
@@ -220,6 +223,48 @@ class CattleDetectionDataset(Dataset):
         return image, label
 
 
+def create_dataset(split, data_dir, transform, train=False):
+    """
+    Dataset for one split. With DATASET_CACHE_DIR, images come from the preprocessed cache
+    (built on first use, rebuilt when the files change) and `transform` is replaced by its
+    tensor equivalent; otherwise every image is decoded from disk on every access.
+    """
+    if not DATASET_CACHE_DIR:
+        return CattleDetectionDataset(data_dir, transform=transform)
+    source = CattleDetectionDataset(data_dir)
+    cache_dir = os.path.join(DATASET_CACHE_DIR, split)
+    ensure_cache(source.images, source.labels, cache_dir, size=DATASET_CACHE_SIZE)
+    return CachedImageDataset(
+        cache_dir,
+        transform=tensor_transforms(IMAGE_SIZE, DATASET_CACHE_SIZE, train, IMAGENET_MEAN, IMAGENET_STD),
+    )
+
+
+def build_dataset_caches():
+    """One-time build step: decode train/validation/test into the dataset cache"""
+    if not DATASET_CACHE_DIR:
+        print("[ERROR] Dataset cache disabled (--no-cache)")
+        return
+    for split, data_dir in (('train', TRAIN_DIR), ('validation', VAL_DIR), ('test', TEST_DIR)):
+        create_dataset(split, data_dir, None)
+
+
+def audit_splits(report_path='cattle_detection_dataset_audit.json'):
+    """
+    Check all splits (dataset_audit.py) on the manifest's inspection results: corrupted files,
+    exact and near-duplicates (perceptual hash), cross-split leakage and label conflicts
+    """
+    samples, records = [], {}
+    for split, data_dir in (('train', TRAIN_DIR), ('validation', VAL_DIR), ('test', TEST_DIR)):
+        for record in split_records(data_dir):
+            samples.append((record['path'], split, record['label']))
+            records[record['path']] = record
+    report = audit_dataset(samples, records=records)
+    print_audit(report)
+    save_report(report, report_path)
+    return report
+
+
 # ============================================================================
 # MODEL ARCHITECTURE
 # ============================================================================
@@ -545,42 +590,42 @@ def train_model():
     print("\n" + "=" * 80)
     print("STEP 3: DATASET CREATION")
     print("=" * 80)
-    train_dataset = CattleDetectionDataset(TRAIN_DIR, transform=train_transform)
-    val_dataset = CattleDetectionDataset(VAL_DIR, transform=val_transform)
-    test_dataset = CattleDetectionDataset(TEST_DIR, transform=val_transform)
+    train_dataset = create_dataset('train', TRAIN_DIR, train_transform, train=True)
+    val_dataset = create_dataset('validation', VAL_DIR, val_transform)
+    test_dataset = create_dataset('test', TEST_DIR, val_transform)
     
     print(f"Training samples: {len(train_dataset):,}")
     print(f"Validation samples: {len(val_dataset):,}")
     print(f"Test samples: {len(test_dataset):,}")
     
-    train_loader = DataLoader(
+    train_loader = make_loader(
         train_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=True,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS,
+        seed=RANDOM_SEED
     )
     
-    val_loader = DataLoader(
+    val_loader = make_loader(
         val_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=False,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS
     )
     
-    test_loader = DataLoader(
+    test_loader = make_loader(
         test_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=False,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS,
+        persistent=False
     )
     
     print(f"\nBatch size: {HYPERPARAMS['batch_size']}")
     print(f"Training batches: {len(train_loader)}")
     print(f"Validation batches: {len(val_loader)}")
     print(f"Test batches: {len(test_loader)}")
+    print(f"Data loader workers: {train_loader.num_workers}")
     
     # 4. Create model
     print("\n" + "=" * 80)
@@ -622,8 +667,10 @@ def train_model():
     
     history = {
         'train_loss': [], 'train_acc': [],
-        'val_loss': [], 'val_acc': [], 'val_precision': [], 'val_recall': [], 'val_f1': []
+        'val_loss': [], 'val_acc': [], 'val_precision': [], 'val_recall': [], 'val_f1': [],
+        'data_wait_ratio': []
     }
+    timed_train_loader = TimedLoader(train_loader)
     
     best_val_acc = 0.0
     best_epoch = 0
@@ -638,7 +685,7 @@ def train_model():
         print("-" * 80)
         
         # Train
-        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, device)
+        train_loss, train_acc = train_epoch(model, timed_train_loader, criterion, optimizer, device)
         
         # Validate
         val_loss, val_acc, val_precision, val_recall, val_f1 = validate_epoch(
@@ -657,12 +704,14 @@ def train_model():
         history['val_precision'].append(val_precision)
         history['val_recall'].append(val_recall)
         history['val_f1'].append(val_f1)
+        history['data_wait_ratio'].append(timed_train_loader.wait_ratio)
         
         # Print metrics
         print(f"Train Loss: {train_loss:.4f} | Train Acc: {train_acc:.4f}")
         print(f"Val Loss: {val_loss:.4f} | Val Acc: {val_acc:.4f}")
         print(f"Val Precision: {val_precision:.4f} | Val Recall: {val_recall:.4f} | Val F1: {val_f1:.4f}")
         print(f"Learning Rate: {current_lr:.6f}")
+        print(timed_train_loader.report())
         
         # Early stopping and model saving
         if val_acc > best_val_acc:
@@ -755,12 +804,13 @@ def evaluate_only():
         transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
     ])
     
-    test_dataset = CattleDetectionDataset(TEST_DIR, transform=val_transform)
-    test_loader = DataLoader(
+    test_dataset = create_dataset('test', TEST_DIR, val_transform)
+    test_loader = make_loader(
         test_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=False,
-        num_workers=0
+        num_workers=NUM_WORKERS,
+        persistent=False
     )
     
     # Evaluate
@@ -800,13 +850,36 @@ def export_only():
 # ============================================================================
 
 def main():
+    global DATASET_CACHE_DIR, NUM_WORKERS
     parser = argparse.ArgumentParser(description='Train Cattle Detection Model')
     parser.add_argument('--mode', type=str, default='all',
-                       choices=['train', 'evaluate', 'export', 'all'],
-                       help='Mode: train, evaluate, export, or all')
+                       choices=['train', 'evaluate', 'export', 'all', 'cache', 'audit'],
+                       help='Mode: train, evaluate, export, all, cache (build the dataset cache) '
+                            'or audit (check the splits for corrupted files, duplicates and leakage)')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                       help=f'Dataset cache directory (default: {DATASET_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Decode the images on every epoch instead of using the dataset cache')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='DataLoader worker processes (default: one per available core, minus one; 0 = none)')
     
     args = parser.parse_args()
     
+    if args.workers is not None:
+        NUM_WORKERS = args.workers
+    if args.no_cache:
+        DATASET_CACHE_DIR = None
+    elif args.cache_dir:
+        DATASET_CACHE_DIR = args.cache_dir
+    
+    if args.mode == 'cache':
+        build_dataset_caches()
+        return
+    
+    if args.mode == 'audit':
+        audit_splits()
+        return
+    
     if args.mode == 'train' or args.mode == 'all':
         train_model()
     
@@ -10,16 +10,16 @@ Usage:
     python train_fmd_model_complete.py --mode evaluate
     python train_fmd_model_complete.py --mode export
     python train_fmd_model_complete.py --mode all
+    python train_fmd_model_complete.py --mode cache    # decode images once (dataset_cache.py)
 """
 
 import os
 import sys
 import argparse
-import hashlib
 import numpy as np
 import pandas as pd
 from pathlib import Path
-from collections import Counter, defaultdict
+from collections import Counter
 from PIL import Image
 import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend for automation
@@ -32,7 +32,7 @@ warnings.filterwarnings('ignore')
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset
 from torchvision import transforms, models
 from sklearn.metrics import (
     accuracy_score, precision_score, recall_score, f1_score,
@@ -41,6 +41,11 @@ from sklearn.metrics import (
 from tqdm import tqdm
 import json
 
+from data_loading import TimedLoader, make_loader
+from dataset_audit import audit_dataset, print_audit, save_report
+from dataset_cache import CachedImageDataset, ensure_cache, tensor_transforms
+from dataset_manifest import DatasetManifest
+
 # Set style for professional plots
 plt.style.use('seaborn-v0_8-darkgrid')
 sns.set_palette("husl")
@@ -60,6 +65,20 @@ IMAGE_SIZE = 224
 MODEL_NAME = 'mobilenet_v2'  # Options: 'mobilenet_v2', 'efficientnet_b0', 'resnet50'
 NUM_CLASSES = 2
 USE_PRETRAINED = True
+IMAGENET_MEAN = [0.485, 0.456, 0.406]
+IMAGENET_STD = [0.229, 0.224, 0.225]
+
+# Preprocessed dataset cache (dataset_cache.py): every image is decoded and resized once into
+# memory-mapped uint8 shards instead of on every epoch. None (or --no-cache) reads the JPEGs.
+DATASET_CACHE_DIR = './dataset_cache/fmd'
+DATASET_CACHE_SIZE = IMAGE_SIZE
+
+# Dataset manifest (dataset_manifest.py): size, mtime, validity, dimensions and hashes of every
+# image, so analysis, auditing and the datasets only inspect files added or changed since last run
+DATASET_MANIFEST_PATH = './dataset_cache/fmd_manifest.sqlite'
+
+# DataLoader worker processes (data_loading.py); None = one per available core, minus one
+NUM_WORKERS = None
 
 # Hyperparameters
 HYPERPARAMS = {
@@ -93,6 +112,17 @@ os.makedirs(MODEL_SAVE_DIR, exist_ok=True)
 # DATA ANALYSIS FUNCTIONS
 # ============================================================================
 
+_manifest = None
+
+
+def split_records(data_dir):
+    """Manifest records (valid or not) of one split's class folders (0 = healthy, 1 = infected)"""
+    global _manifest
+    if _manifest is None:
+        _manifest = DatasetManifest(DATASET_MANIFEST_PATH)
+    return _manifest.scan({os.path.join(data_dir, str(label)): label for label in (0, 1)})
+
+
 def analyze_dataset(data_dir, dataset_name):
     """Analyze dataset composition"""
     print(f"\n{dataset_name}:")
@@ -101,26 +131,18 @@ def analyze_dataset(data_dir, dataset_name):
     class_counts = {}
     image_sizes = []
     file_extensions = Counter()
+    records = split_records(data_dir)
     
     for class_label in [0, 1]:
-        class_dir = os.path.join(data_dir, str(class_label))
-        if not os.path.exists(class_dir):
+        class_records = [record for record in records if record['label'] == class_label]
+        if not class_records:
             continue
         
-        count = 0
-        for filename in os.listdir(class_dir):
-            if filename.lower().endswith(('.jpg', '.jpeg', '.png', '.JPG')):
-                count += 1
-                file_ext = os.path.splitext(filename)[1].lower()
-                file_extensions[file_ext] += 1
-                
-                # Get image size
-                try:
-                    img_path = os.path.join(class_dir, filename)
-                    img = Image.open(img_path)
-                    image_sizes.append(img.size)
-                except Exception as e:
-                    pass
+        count = len(class_records)
+        for record in class_records:
+            file_extensions[os.path.splitext(record['path'])[1].lower()] += 1
+            if record['valid']:
+                image_sizes.append((record['width'], record['height']))
         
         class_counts[class_label] = count
         class_name = "Healthy" if class_label == 0 else "Infected"
@@ -170,74 +192,20 @@ def visualize_dataset_distribution(train_counts, val_counts, test_counts):
 # DATA CLEANING FUNCTIONS
 # ============================================================================
 
-def get_image_hash(image_path):
-    """Calculate MD5 hash of image file"""
-    hash_md5 = hashlib.md5()
-    try:
-        with open(image_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-    except:
-        return None
-
-
-def check_image_validity(image_path):
-    """Check if image can be opened and is valid"""
-    try:
-        img = Image.open(image_path)
-        img.verify()
-        return True
-    except:
-        return False
-
-
-def clean_dataset(data_dir, dataset_name):
-    """Analyze dataset for cleaning issues"""
-    print(f"\n{dataset_name} Cleaning Analysis:")
-    print("-" * 80)
-    
-    issues = {
-        'corrupted': [],
-        'duplicates': [],
-        'invalid_format': []
-    }
-    valid_images = 0
-    image_hashes = defaultdict(list)
-    
-    for class_label in [0, 1]:
-        class_dir = os.path.join(data_dir, str(class_label))
-        if not os.path.exists(class_dir):
-            continue
-        
-        for filename in os.listdir(class_dir):
-            if not filename.lower().endswith(('.jpg', '.jpeg', '.png', '.JPG')):
-                continue
-            
-            img_path = os.path.join(class_dir, filename)
-            
-            # Check validity
-            if not check_image_validity(img_path):
-                issues['corrupted'].append(img_path)
-                continue
-            
-            valid_images += 1
-            
-            # Check for duplicates
-            img_hash = get_image_hash(img_path)
-            if img_hash:
-                image_hashes[img_hash].append(img_path)
-    
-    # Find duplicates
-    for hash_val, paths in image_hashes.items():
-        if len(paths) > 1:
-            issues['duplicates'].extend(paths[1:])  # Keep first, mark others as duplicates
-    
-    print(f"  Valid images: {valid_images:,}")
-    print(f"  Corrupted images: {len(issues['corrupted']):,}")
-    print(f"  Duplicate images: {len(issues['duplicates']):,}")
-    
-    return issues, valid_images
+def audit_splits(report_path='dataset_audit.json'):
+    """
+    Check all splits (dataset_audit.py) on the manifest's inspection results: corrupted files,
+    exact and near-duplicates (perceptual hash), cross-split leakage and label conflicts
+    """
+    samples, records = [], {}
+    for split, data_dir in (('train', TRAIN_DIR), ('val', VAL_DIR), ('test', TEST_DIR)):
+        for record in split_records(data_dir):
+            samples.append((record['path'], split, record['label']))
+            records[record['path']] = record
+    report = audit_dataset(samples, records=records)
+    print_audit(report)
+    save_report(report, report_path)
+    return report
 
 
 # ============================================================================
@@ -253,15 +221,11 @@ class FMDDataset(Dataset):
         self.images = []
         self.labels = []
         
-        # Load images from class folders (0 = healthy, 1 = infected)
-        for class_label in [0, 1]:
-            class_dir = os.path.join(data_dir, str(class_label))
-            if os.path.exists(class_dir):
-                for img_name in os.listdir(class_dir):
-                    if img_name.lower().endswith(('.jpg', '.jpeg', '.png', '.JPG')):
-                        img_path = os.path.join(class_dir, img_name)
-                        self.images.append(img_path)
-                        self.labels.append(class_label)
+        # Readable images of the class folders (0 = healthy, 1 = infected), from the manifest
+        for record in split_records(data_dir):
+            if record['valid']:
+                self.images.append(record['path'])
+                self.labels.append(record['label'])
     
     def __len__(self):
         return len(self.images)
@@ -284,6 +248,32 @@ class FMDDataset(Dataset):
         return image, label
 
 
+def create_dataset(split, data_dir, transform, train=False):
+    """
+    Dataset for one split. With DATASET_CACHE_DIR, images come from the preprocessed cache
+    (built on first use, rebuilt when the files change) and `transform` is replaced by its
+    tensor equivalent; otherwise every image is decoded from disk on every access.
+    """
+    if not DATASET_CACHE_DIR:
+        return FMDDataset(data_dir, transform=transform)
+    source = FMDDataset(data_dir)
+    cache_dir = os.path.join(DATASET_CACHE_DIR, split)
+    ensure_cache(source.images, source.labels, cache_dir, size=DATASET_CACHE_SIZE)
+    return CachedImageDataset(
+        cache_dir,
+        transform=tensor_transforms(IMAGE_SIZE, DATASET_CACHE_SIZE, train, IMAGENET_MEAN, IMAGENET_STD),
+    )
+
+
+def build_dataset_caches():
+    """One-time build step: decode train/val/test into the dataset cache"""
+    if not DATASET_CACHE_DIR:
+        print("✗ Dataset cache disabled (--no-cache)")
+        return
+    for split, data_dir in (('train', TRAIN_DIR), ('val', VAL_DIR), ('test', TEST_DIR)):
+        create_dataset(split, data_dir, None)
+
+
 # ============================================================================
 # MODEL ARCHITECTURE
 # ============================================================================
@@ -823,15 +813,16 @@ def train_model():
     print("\n" + "=" * 80)
     print("STEP 2: DATA CLEANING")
     print("=" * 80)
-    train_issues, train_valid = clean_dataset(TRAIN_DIR, "Training Set")
-    val_issues, val_valid = clean_dataset(VAL_DIR, "Validation Set")
-    test_issues, test_valid = clean_dataset(TEST_DIR, "Test Set")
+    audit = audit_splits()
     
-    total_valid = train_valid + val_valid + test_valid
-    total_corrupted = len(train_issues['corrupted']) + len(val_issues['corrupted']) + len(test_issues['corrupted'])
+    total_corrupted = len(audit['corrupted'])
+    total_valid = len(audit['records']) - total_corrupted
     print(f"\nTotal valid images: {total_valid:,}")
     print(f"Total corrupted: {total_corrupted:,}")
     print(f"Data quality: {(total_valid/(total_valid+total_corrupted)*100):.1f}% valid")
+    if audit['leakage']:
+        print(f"⚠ {len(audit['leakage']):,} image groups appear in more than one split; "
+              f"validation/test accuracy will be optimistic (see dataset_audit.json)")
     
     # 3. Create transforms
     print("\n" + "=" * 80)
@@ -858,42 +849,42 @@ def train_model():
     print("\n" + "=" * 80)
     print("STEP 4: DATASET CREATION")
     print("=" * 80)
-    train_dataset = FMDDataset(TRAIN_DIR, transform=train_transform)
-    val_dataset = FMDDataset(VAL_DIR, transform=val_transform)
-    test_dataset = FMDDataset(TEST_DIR, transform=val_transform)
+    train_dataset = create_dataset('train', TRAIN_DIR, train_transform, train=True)
+    val_dataset = create_dataset('val', VAL_DIR, val_transform)
+    test_dataset = create_dataset('test', TEST_DIR, val_transform)
     
     print(f"Training samples: {len(train_dataset):,}")
     print(f"Validation samples: {len(val_dataset):,}")
     print(f"Test samples: {len(test_dataset):,}")
     
-    train_loader = DataLoader(
+    train_loader = make_loader(
         train_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=True,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS,
+        seed=RANDOM_SEED
     )
     
-    val_loader = DataLoader(
+    val_loader = make_loader(
         val_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=False,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS
     )
     
-    test_loader = DataLoader(
+    test_loader = make_loader(
         test_dataset,
         batch_size=HYPERPARAMS['batch_size'],
         shuffle=False,
-        num_workers=0,
-        pin_memory=True if torch.cuda.is_available() else False
+        num_workers=NUM_WORKERS,
+        persistent=False
     )
     
     print(f"\nBatch size: {HYPERPARAMS['batch_size']}")
     print(f"Training batches: {len(train_loader)}")
     print(f"Validation batches: {len(val_loader)}")
     print(f"Test batches: {len(test_loader)}")
+    print(f"Data loader workers: {train_loader.num_workers}")
     
     # 5. Create model
     print("\n" + "=" * 80)
@@ -935,8 +926,10 @@ def train_model():
     
     history = {
         'train_loss': [], 'train_acc': [],
-        'val_loss': [], 'val_acc': [], 'val_precision': [], 'val_recall': [], 'val_f1': []
+        'val_loss': [], 'val_acc': [], 'val_precision': [], 'val_recall': [], 'val_f1': [],
+        'data_wait_ratio': []
     }
+    timed_train_loader = TimedLoader(train_loader)
     
     best_val_acc = 0.0
     best_epoch = 0
@@ -949,7 +942,7 @@ def train_model():
         print('-' * 80)
         
         # Train
-        train_loss, train_acc = train_epoch(model, train_loader, criterion, optimizer, device)
+        train_loss, train_acc = train_epoch(model, timed_train_loader, criterion, optimizer, device)
         
         # Validate
         val_loss, val_acc, val_precision, val_recall, val_f1 = validate_epoch(
@@ -967,12 +960,14 @@ def train_model():
         history['val_precision'].append(val_precision)
         history['val_recall'].append(val_recall)
         history['val_f1'].append(val_f1)
+        history['data_wait_ratio'].append(timed_train_loader.wait_ratio)
         
         # Print metrics
         print(f'Train - Loss: {train_loss:.4f}, Acc: {train_acc:.4f}')
         print(f'Val   - Loss: {val_loss:.4f}, Acc: {val_acc:.4f}, '
               f'Precision: {val_precision:.4f}, Recall: {val_recall:.4f}, F1: {val_f1:.4f}')
         print(f'Learning Rate: {current_lr:.6f}')
+        print(timed_train_loader.report())
         
         # Check for improvement
         if val_acc > best_val_acc:
@@ -1053,15 +1048,38 @@ def train_model():
 
 def main():
     """Main function with command-line interface"""
+    global DATASET_CACHE_DIR, NUM_WORKERS
     parser = argparse.ArgumentParser(description='FMD Model Training Script')
     parser.add_argument('--mode', type=str, default='all',
-                       choices=['train', 'evaluate', 'export', 'all'],
-                       help='Mode: train, evaluate, export, or all')
+                       choices=['train', 'evaluate', 'export', 'all', 'cache', 'audit'],
+                       help='Mode: train, evaluate, export, all, cache (build the dataset cache) '
+                            'or audit (check the splits for corrupted files, duplicates and leakage)')
     parser.add_argument('--model-path', type=str, default=None,
                        help='Path to model checkpoint for evaluation/export')
+    parser.add_argument('--cache-dir', type=str, default=None,
+                       help=f'Dataset cache directory (default: {DATASET_CACHE_DIR})')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Decode the images on every epoch instead of using the dataset cache')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='DataLoader worker processes (default: one per available core, minus one; 0 = none)')
     
     args = parser.parse_args()
     
+    if args.workers is not None:
+        NUM_WORKERS = args.workers
+    if args.no_cache:
+        DATASET_CACHE_DIR = None
+    elif args.cache_dir:
+        DATASET_CACHE_DIR = args.cache_dir
+    
+    if args.mode == 'cache':
+        build_dataset_caches()
+        return
+    
+    if args.mode == 'audit':
+        audit_splits()
+        return
+    
     if args.mode == 'train' or args.mode == 'all':
         model, history, best_epoch, best_val_acc = train_model()
     
@@ -1092,8 +1110,8 @@ def main():
             transforms.ToTensor(),
             transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225])
         ])
-        test_dataset = FMDDataset(TEST_DIR, transform=val_transform)
-        test_loader = DataLoader(test_dataset, batch_size=HYPERPARAMS['batch_size'], shuffle=False)
+        test_dataset = create_dataset('test', TEST_DIR, val_transform)
+        test_loader = make_loader(test_dataset, HYPERPARAMS['batch_size'], num_workers=NUM_WORKERS, persistent=False)
         
         evaluate_model(model, test_loader, device)
     
@@ -27,6 +27,16 @@ export interface ScanAnalyzeNotCattleResponse {
   record?: ScanRecordDto;
 }
 
+export type ScanQualityIssue = "too_small" | "too_dark" | "too_bright" | "blurry" | "uniform";
+
+/** Photo rejected by the quality pre-gate before inference (retake rather than re-upload). */
+export interface ScanAnalyzeLowQualityResponse {
+  ok: false;
+  reason: "LOW_QUALITY";
+  issues: ScanQualityIssue[];
+  record?: ScanRecordDto;
+}
+
 export interface ScanAnalyzeCattleResponse {
   ok: true;
   animalType: "CATTLE";
@@ -39,7 +49,10 @@ export interface ScanAnalyzeCattleResponse {
   record?: ScanRecordDto;
 }
 
-export type ScanAnalyzeResponse = ScanAnalyzeNotCattleResponse | ScanAnalyzeCattleResponse;
+export type ScanAnalyzeResponse =
+  | ScanAnalyzeNotCattleResponse
+  | ScanAnalyzeLowQualityResponse
+  | ScanAnalyzeCattleResponse;
 
 export async function analyzeScanImage(
   image: File,
@@ -14,8 +14,19 @@ import { Stethoscope, ShoppingCart, FileText, Sparkles, AlertTriangle } from "lu
 import { Link } from "react-router-dom";
 import { cn } from "@/lib/utils";
 import type { ScanResult } from "@/types/scan";
+import type { ScanQualityIssue } from "@/api/scan";
 
 export type ScanErrorNotCattle = { type: "NOT_CATTLE"; probCattle: number };
+export type ScanErrorLowQuality = { type: "LOW_QUALITY"; issues: ScanQualityIssue[] };
+export type ScanError = ScanErrorNotCattle | ScanErrorLowQuality;
+
+const qualityIssueText: Record<ScanQualityIssue, string> = {
+  too_small: "The image resolution is too low.",
+  too_dark: "The photo is too dark. Move into daylight or turn on more light.",
+  too_bright: "The photo is overexposed. Avoid direct sun or flash glare.",
+  blurry: "The photo is blurry. Hold the camera steady and tap to focus.",
+  uniform: "The photo shows almost nothing. Check that the lens is not covered.",
+};
 
 export interface ScanResultsViewProps {
   /** Optional display name (e.g. animal name or "AI Health Scan") */
@@ -30,8 +41,8 @@ export interface ScanResultsViewProps {
   onNewScan?: () => void;
   /** When healthy scan: callback for "View Records" (e.g. navigate to records with animalId). */
   onViewRecords?: () => void;
-  /** When FMD pipeline rejects (image does not contain cattle). */
-  scanError?: ScanErrorNotCattle | null;
+  /** When FMD pipeline rejects (image does not contain cattle, or photo quality too low). */
+  scanError?: ScanError | null;
 }
 
 const urgencyStyles: Record<ScanResult["urgency"], string> = {
@@ -91,6 +102,36 @@ export function ScanResultsView({
     );
   }
 
+  if (scanError?.type === "LOW_QUALITY") {
+    return (
+      <div className="space-y-6">
+        <Card className="rounded-xl border-amber-200 bg-amber-50/50 dark:border-amber-900/50 dark:bg-amber-950/20">
+          <CardContent className="p-4 flex items-start gap-3">
+            <AlertTriangle className="h-5 w-5 text-icon-amber shrink-0 mt-0.5" />
+            <div>
+              <h3 className="font-medium text-icon-amber mb-1">Please retake the photo</h3>
+              <ul className="text-sm text-icon-amber opacity-90 list-disc pl-4 space-y-0.5">
+                {scanError.issues.map((issue) => (
+                  <li key={issue}>{qualityIssueText[issue] ?? issue}</li>
+                ))}
+              </ul>
+            </div>
+          </CardContent>
+        </Card>
+        <div className="flex flex-col sm:flex-row gap-3">
+          {onNewScan && (
+            <Button type="button" size="lg" className="flex-1" onClick={onNewScan}>
+              Retake photo
+            </Button>
+          )}
+          <Button type="button" size="lg" variant="outline" className="flex-1" asChild>
+            <Link to="/home">Return Home</Link>
+          </Button>
+        </div>
+      </div>
+    );
+  }
+
   if (scanError?.type === "NOT_CATTLE") {
     return (
       <div className="space-y-6">
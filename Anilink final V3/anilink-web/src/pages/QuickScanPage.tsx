@@ -9,7 +9,7 @@ import { useAnimals, useCreateAnimal } from "@/hooks/useAnimals";
 import { animalDtoToRecordsAnimal } from "@/lib/animalMappers";
 import { SCAN_RECORDS_QUERY_KEY } from "@/lib/queryClient";
 import { PhotoUploader } from "@/components/scan/PhotoUploader";
-import { ScanResultsView } from "@/components/scan/ScanResultsView";
+import { ScanResultsView, type ScanError } from "@/components/scan/ScanResultsView";
 import { SaveToRecordsModal } from "@/components/scan/SaveToRecordsModal";
 import { AddAnimalSheet } from "@/components/records/AddAnimalSheet";
 import { analyzeScanImage } from "@/api/scan";
@@ -27,7 +27,7 @@ export function QuickScanPage() {
   const [files, setFiles] = useState<File[]>([]);
   const [previewUrls, setPreviewUrls] = useState<string[]>([]);
   const [result, setResult] = useState<ScanResult | null>(null);
-  const [scanError, setScanError] = useState<{ type: "NOT_CATTLE"; probCattle: number } | null>(null);
+  const [scanError, setScanError] = useState<ScanError | null>(null);
   const [isAnalyzing, setIsAnalyzing] = useState(false);
   const [phase, setPhase] = useState<"upload" | "results">("upload");
   const [saveModalOpen, setSaveModalOpen] = useState(false);
@@ -81,6 +81,8 @@ export function QuickScanPage() {
       const apiRes = await analyzeScanImage(file, { threshold: 0.5 });
       if (apiRes.ok) {
         setResult(apiResultToScanResult(apiRes));
+      } else if (apiRes.reason === "LOW_QUALITY") {
+        setScanError({ type: "LOW_QUALITY", issues: apiRes.issues });
       } else {
         setScanError({ type: "NOT_CATTLE", probCattle: apiRes.probCattle });
       }
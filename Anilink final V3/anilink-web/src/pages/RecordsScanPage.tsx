@@ -13,7 +13,7 @@ import { animalDtoToRecordsAnimal } from "@/lib/animalMappers";
 import { mapAnimalsToScanAnimals, getScanAnimalById } from "@/data/scan";
 import { StepSelectAnimal } from "@/components/scan/StepSelectAnimal";
 import { PhotoUploader } from "@/components/scan/PhotoUploader";
-import { ScanResultsView } from "@/components/scan/ScanResultsView";
+import { ScanResultsView, type ScanError } from "@/components/scan/ScanResultsView";
 import { analyzeScanImage } from "@/api/scan";
 import { apiResultToScanResult } from "@/lib/scan/scanResultMapper";
 import { SCAN_RECORDS_QUERY_KEY } from "@/lib/queryClient";
@@ -42,7 +42,7 @@ export function RecordsScanPage() {
   const [files, setFiles] = useState<File[]>([]);
   const [previewUrls, setPreviewUrls] = useState<string[]>([]);
   const [result, setResult] = useState<ScanResult | null>(null);
-  const [scanError, setScanError] = useState<{ type: "NOT_CATTLE"; probCattle: number } | null>(null);
+  const [scanError, setScanError] = useState<ScanError | null>(null);
   const [isAnalyzing, setIsAnalyzing] = useState(false);
   const [lastRecordId, setLastRecordId] = useState<string | null>(null);
 
@@ -108,6 +108,8 @@ export function RecordsScanPage() {
         });
         if (apiRes.ok) {
           setResult(apiResultToScanResult(apiRes));
+        } else if (apiRes.reason === "LOW_QUALITY") {
+          setScanError({ type: "LOW_QUALITY", issues: apiRes.issues });
         } else {
           setScanError({ type: "NOT_CATTLE", probCattle: apiRes.probCattle });
         }
@@ -0,0 +1,28 @@
+"""Add idempotency_key to scan_records so retried scans save one record
+
+Revision ID: 012_scan_idempotency
+Revises: 011_scan_records
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = '012_scan_idempotency'
+down_revision: Union[str, None] = '011_scan_records'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('scan_records', sa.Column('idempotency_key', sa.String(64), nullable=True))
+    op.create_unique_constraint(
+        'uq_scan_records_idempotency_key', 'scan_records', ['idempotency_key']
+    )
+
+
+def downgrade() -> None:
+    op.drop_constraint('uq_scan_records_idempotency_key', 'scan_records', type_='unique')
+    op.drop_column('scan_records', 'idempotency_key')
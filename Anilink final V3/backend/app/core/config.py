@@ -60,6 +60,83 @@ class Settings(BaseSettings):
     
     # Model service (ONNX inference)
     MODEL_SERVICE_URL: str = os.getenv("MODEL_SERVICE_URL", "http://model-service:9002")
+    # Several replicas (comma-separated URLs; overrides MODEL_SERVICE_URL): requests are balanced
+    # client-side by least outstanding requests, see ai_scan/client.py
+    MODEL_SERVICE_URLS: str = os.getenv("MODEL_SERVICE_URLS", "")
+    # Active health checks (GET /health every N seconds; 0 disables): a replica is ejected after
+    # N consecutive failed checks and re-admitted on the next passing one
+    MODEL_SERVICE_HEALTH_INTERVAL: float = float(os.getenv("MODEL_SERVICE_HEALTH_INTERVAL", "5"))
+    MODEL_SERVICE_HEALTH_TIMEOUT: float = float(os.getenv("MODEL_SERVICE_HEALTH_TIMEOUT", "2"))
+    MODEL_SERVICE_HEALTH_FAILURES: int = int(os.getenv("MODEL_SERVICE_HEALTH_FAILURES", "2"))
+    # Hedging (single-image /infer, 2+ replicas): when the first replica has not answered within
+    # this percentile of recent latencies (and at least MIN_MS), also ask a second one; 0 disables
+    MODEL_SERVICE_HEDGE_PERCENTILE: float = float(os.getenv("MODEL_SERVICE_HEDGE_PERCENTILE", "95"))
+    MODEL_SERVICE_HEDGE_MIN_MS: float = float(os.getenv("MODEL_SERVICE_HEDGE_MIN_MS", "50"))
+    MODEL_SERVICE_HEDGE_MIN_SAMPLES: int = int(os.getenv("MODEL_SERVICE_HEDGE_MIN_SAMPLES", "20"))
+    # Shared keep-alive connection pool to the model-service (created at startup)
+    MODEL_SERVICE_MAX_CONNECTIONS: int = int(os.getenv("MODEL_SERVICE_MAX_CONNECTIONS", "100"))
+    MODEL_SERVICE_MAX_KEEPALIVE: int = int(os.getenv("MODEL_SERVICE_MAX_KEEPALIVE", "20"))
+    MODEL_SERVICE_KEEPALIVE_EXPIRY: float = float(os.getenv("MODEL_SERVICE_KEEPALIVE_EXPIRY", "30"))
+    # Timeouts in seconds: connect is short so a dead service fails fast; read covers inference
+    MODEL_SERVICE_CONNECT_TIMEOUT: float = float(os.getenv("MODEL_SERVICE_CONNECT_TIMEOUT", "2"))
+    MODEL_SERVICE_READ_TIMEOUT: float = float(os.getenv("MODEL_SERVICE_READ_TIMEOUT", "30"))
+    MODEL_SERVICE_POOL_TIMEOUT: float = float(os.getenv("MODEL_SERVICE_POOL_TIMEOUT", "5"))
+    # Retries (connect errors only) with jittered exponential backoff
+    MODEL_SERVICE_RETRIES: int = int(os.getenv("MODEL_SERVICE_RETRIES", "2"))
+    MODEL_SERVICE_RETRY_BACKOFF: float = float(os.getenv("MODEL_SERVICE_RETRY_BACKOFF", "0.1"))
+    # Circuit breaker: open after N consecutive failures, probe again after the reset period
+    MODEL_SERVICE_BREAKER_THRESHOLD: int = int(os.getenv("MODEL_SERVICE_BREAKER_THRESHOLD", "5"))
+    MODEL_SERVICE_BREAKER_RESET_SECONDS: float = float(os.getenv("MODEL_SERVICE_BREAKER_RESET_SECONDS", "15"))
+
+    # AI scan inference backend: "http" (model-service at MODEL_SERVICE_URL) or "in_process"
+    # (single-node deployments: the model-service's ONNX sessions are loaded inside each backend
+    # worker; needs onnxruntime + numpy installed, see model-service/requirements.txt)
+    AI_SCAN_INFERENCE_BACKEND: str = os.getenv("AI_SCAN_INFERENCE_BACKEND", "http")
+    # in_process only: model-service code and models (same env names as the model-service)
+    MODEL_SERVICE_DIR: str = os.getenv("MODEL_SERVICE_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "model-service"))
+    MODEL_VARIANT: str = os.getenv("MODEL_VARIANT", "fp32")
+    MODEL_CATTLE_PATH: str = os.getenv("MODEL_CATTLE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "cattle_detection.onnx"))
+    MODEL_FMD_PATH: str = os.getenv("MODEL_FMD_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "models", "fmd_detection.onnx"))
+    MODEL_FUSED_PATH: str = os.getenv("MODEL_FUSED_PATH", "")
+    MODEL_REGISTRY_DIR: str = os.getenv("MODEL_REGISTRY_DIR", "")
+    # in_process only: inference threads per backend worker, ORT threads each, and micro-batching
+    AI_SCAN_IN_PROCESS_WORKERS: int = int(os.getenv("AI_SCAN_IN_PROCESS_WORKERS", "1"))
+    AI_SCAN_IN_PROCESS_ORT_THREADS: int = int(os.getenv("AI_SCAN_IN_PROCESS_ORT_THREADS", str(min(2, os.cpu_count() or 1))))
+    AI_SCAN_IN_PROCESS_BATCH_MAX_SIZE: int = int(os.getenv("AI_SCAN_IN_PROCESS_BATCH_MAX_SIZE", "8"))
+    AI_SCAN_IN_PROCESS_BATCH_WINDOW_MS: float = float(os.getenv("AI_SCAN_IN_PROCESS_BATCH_WINDOW_MS", "5"))
+    AI_SCAN_IN_PROCESS_QUEUE_DEPTH: int = int(os.getenv("AI_SCAN_IN_PROCESS_QUEUE_DEPTH", "64"))
+
+    # AI scan result cache (keyed on decoded image + threshold + model version)
+    AI_SCAN_CACHE_ENABLED: bool = os.getenv("AI_SCAN_CACHE_ENABLED", "true").lower() == "true"
+    AI_SCAN_CACHE_MAX_ENTRIES: int = int(os.getenv("AI_SCAN_CACHE_MAX_ENTRIES", "2048"))
+    AI_SCAN_CACHE_TTL_SECONDS: int = int(os.getenv("AI_SCAN_CACHE_TTL_SECONDS", "86400"))
+    # Optional shared tier across workers/replicas: "" (in-process only), "sqlite" or "redis"
+    AI_SCAN_CACHE_SHARED: str = os.getenv("AI_SCAN_CACHE_SHARED", "")
+    AI_SCAN_CACHE_SHARED_MAX_ENTRIES: int = int(os.getenv("AI_SCAN_CACHE_SHARED_MAX_ENTRIES", "100000"))
+    AI_SCAN_CACHE_SQLITE_PATH: str = os.getenv("AI_SCAN_CACHE_SQLITE_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "cache", "ai_scan_cache.sqlite3"))
+    AI_SCAN_CACHE_REDIS_URL: str = os.getenv("AI_SCAN_CACHE_REDIS_URL", "redis://localhost:6379/0")
+
+    # Uploads are downscaled (short side, px) and re-encoded as JPEG before being forwarded to
+    # the model-service, which only needs 224x224; 0 forwards the original bytes
+    AI_SCAN_FORWARD_SHORT_SIDE: int = int(os.getenv("AI_SCAN_FORWARD_SHORT_SIDE", "256"))
+    AI_SCAN_FORWARD_JPEG_QUALITY: int = int(os.getenv("AI_SCAN_FORWARD_JPEG_QUALITY", "90"))
+
+    # Scan records are inserted by a background writer in batches (size or time), spooled to
+    # local files while the database is unavailable and replayed later; false commits inline
+    AI_SCAN_RECORD_WRITE_BEHIND: bool = os.getenv("AI_SCAN_RECORD_WRITE_BEHIND", "true").lower() == "true"
+    AI_SCAN_RECORD_FLUSH_SIZE: int = int(os.getenv("AI_SCAN_RECORD_FLUSH_SIZE", "100"))
+    AI_SCAN_RECORD_FLUSH_MS: float = float(os.getenv("AI_SCAN_RECORD_FLUSH_MS", "200"))
+    AI_SCAN_RECORD_SPOOL_DIR: str = os.getenv("AI_SCAN_RECORD_SPOOL_DIR", os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "cache", "scan_record_spool"))
+    AI_SCAN_RECORD_REPLAY_INTERVAL_S: float = max(1.0, float(os.getenv("AI_SCAN_RECORD_REPLAY_INTERVAL_S", "30")))
+    # Repeats of a scan (same user, animal, photo, threshold, model version) within one window of
+    # this many seconds save one record; later rescans save their own
+    AI_SCAN_RECORD_DEDUPE_WINDOW_S: float = max(1.0, float(os.getenv("AI_SCAN_RECORD_DEDUPE_WINDOW_S", "300")))
+
+    # AI scan batch endpoint (POST /v1/ai-scan/analyze-batch)
+    AI_SCAN_BATCH_MAX_IMAGES: int = int(os.getenv("AI_SCAN_BATCH_MAX_IMAGES", "500"))
+    # Images per model-service /infer-batch call, and calls in flight per batch request
+    AI_SCAN_BATCH_CHUNK_SIZE: int = int(os.getenv("AI_SCAN_BATCH_CHUNK_SIZE", "16"))
+    AI_SCAN_BATCH_CONCURRENCY: int = int(os.getenv("AI_SCAN_BATCH_CONCURRENCY", "2"))
 
     # File upload
     MAX_UPLOAD_SIZE: int = 5 * 1024 * 1024  # 5MB
@@ -82,6 +82,9 @@ from app.modules.admin.router import router as admin_router
 
 # AI scan router - calls model-service for ONNX inference
 from app.modules.ai_scan.router import router as ai_scan_router
+from app.modules.ai_scan.service import inference_client
+from app.modules.ai_scan.cache import scan_cache
+from app.modules.ai_scan.record_writer import scan_record_writer
 app.include_router(ai_scan_router, prefix="/v1/ai-scan", tags=["ai-scan"])
 
 app.include_router(auth_router, prefix="/v1/auth", tags=["auth"])
@@ -101,6 +104,23 @@ app.include_router(admin_router, prefix="/v1/admin", tags=["admin"])
 app.mount("/uploads", StaticFiles(directory=UPLOADS_DIR), name="uploads")
 
 
+@app.on_event("startup")
+async def startup():
+    # One pooled keep-alive client to the model-service per worker (or in-process sessions)
+    await inference_client.start()
+    # Cached scan results are looked up under the model version the backend serves now
+    scan_cache.version_source = lambda: inference_client.model_version
+    # Write-behind scan records; replays rows spooled while the database was unavailable
+    await scan_record_writer.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await inference_client.close()
+    await scan_record_writer.close()
+    scan_cache.close()
+
+
 @app.get("/")
 async def root():
     return {"message": "AniLink API", "version": "1.0.0"}
@@ -0,0 +1,301 @@
+"""
+Herd-level batch scans: stream many uploaded images (multipart files or one zip) to the
+model-service in fixed-size chunks, each downscaled first (imaging.prepare_image) (POST /infer-batch, or /infer-stream for per-image results).
+Only (concurrency + 1) chunks of image bytes are held in memory at a time: uploads stay in
+Starlette's spooled temp files (zip entries in the archive) until their chunk is read, and a
+chunk's bytes are dropped as soon as its results are back.
+"""
+
+import asyncio
+import json
+import os
+import uuid
+import zipfile
+from typing import AsyncIterator, Callable, Optional
+
+import httpx
+from fastapi import HTTPException, UploadFile
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.modules.ai_scan.cache import scan_cache
+from app.modules.ai_scan.client import ModelServiceUnavailable
+from app.modules.ai_scan.imaging import prepare_image
+from app.modules.ai_scan.service import call_model_service_batch, stream_model_service_batch
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def parse_animal_ids(raw: Optional[str]) -> tuple[list, dict]:
+    """
+    animal_ids form field: a JSON list (by upload position) or an object keyed by filename.
+    Returns (by_position, by_filename); values that are not UUIDs are ignored, as in /analyze.
+    """
+    if not raw:
+        return [], {}
+    try:
+        data = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise HTTPException(400, f"animal_ids must be JSON: {e}") from e
+
+    def to_uuid(value) -> Optional[uuid.UUID]:
+        try:
+            return uuid.UUID(str(value)) if value else None
+        except ValueError:
+            return None
+
+    if isinstance(data, list):
+        return [to_uuid(v) for v in data], {}
+    if isinstance(data, dict):
+        return [], {str(k): to_uuid(v) for k, v in data.items()}
+    raise HTTPException(400, "animal_ids must be a JSON list or object")
+
+
+def _archive_entries(archive: UploadFile) -> tuple[zipfile.ZipFile, list[zipfile.ZipInfo]]:
+    try:
+        zf = zipfile.ZipFile(archive.file)
+    except zipfile.BadZipFile as e:
+        raise HTTPException(400, f"Invalid zip archive: {e}") from e
+    entries = [
+        info
+        for info in zf.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith(".")
+        and info.filename.lower().endswith(IMAGE_EXTENSIONS)
+    ]
+    return zf, entries
+
+
+async def open_batch_source(
+    images: list[UploadFile], archive: Optional[UploadFile]
+) -> tuple[int, AsyncIterator[tuple[str, Optional[bytes], Optional[str]]]]:
+    """
+    Validate the upload and return (image_count, iterator of (filename, contents, error)).
+    Images are read one at a time as the iterator is consumed.
+    """
+    zf, entries = None, []
+    if archive is not None:
+        zf, entries = await asyncio.to_thread(_archive_entries, archive)
+
+    total = len(images) + len(entries)
+    if total == 0:
+        raise HTTPException(400, "No images uploaded (send images[] files or a zip archive)")
+    if total > settings.AI_SCAN_BATCH_MAX_IMAGES:
+        raise HTTPException(413, f"At most {settings.AI_SCAN_BATCH_MAX_IMAGES} images per batch")
+
+    max_size = settings.MAX_UPLOAD_SIZE
+
+    async def iterate():
+        for image in images:
+            filename = image.filename or "image.jpg"
+            if not image.content_type or not image.content_type.startswith("image/"):
+                yield filename, None, "File must be an image (PNG, JPG)"
+                continue
+            contents = await image.read(max_size + 1)
+            await image.close()
+            if not contents:
+                yield filename, None, "Empty file"
+            elif len(contents) > max_size:
+                yield filename, None, f"File larger than {max_size // (1024 * 1024)}MB"
+            else:
+                yield filename, contents, None
+        try:
+            for info in entries:
+                if info.file_size > max_size:
+                    yield info.filename, None, f"File larger than {max_size // (1024 * 1024)}MB"
+                    continue
+                try:
+                    contents = await asyncio.to_thread(zf.read, info)
+                except (zipfile.BadZipFile, OSError, RuntimeError) as e:
+                    yield info.filename, None, f"Could not read from archive: {e}"
+                    continue
+                yield info.filename, contents or None, None if contents else "Empty file"
+        finally:
+            if zf is not None:
+                zf.close()
+
+    return total, iterate()
+
+
+def _fail(items: list[dict], error: str) -> None:
+    for item in items:
+        item["error"] = error
+
+
+async def _infer_chunk(
+    chunk: list[dict],
+    threshold: float,
+    on_done: Callable[[dict], None],
+    per_image: bool,
+) -> None:
+    """
+    Fill item["model_resp"] / item["error"] for one chunk (cache first, then the service)
+    and call on_done(item) for each item once it is final. With per_image, results come from
+    /infer-stream as each image finishes; otherwise from one /infer-batch response.
+    """
+    pending = []
+    for item in chunk:
+        if item["contents"] is None:
+            on_done(item)
+            continue
+        prepared = await asyncio.to_thread(prepare_image, item["contents"], item["filename"])
+        item["contents"], item["content_type"] = prepared.contents, prepared.content_type
+        # Also the image part of the ScanRecord idempotency key
+        item["digest"] = prepared.digest
+        if scan_cache.enabled:
+            cached = await scan_cache.get(item["digest"], threshold)
+            if cached is not None:
+                item["model_resp"] = cached
+                item["cached"] = True
+                item["contents"] = None
+                on_done(item)
+                continue
+        pending.append(item)
+
+    def release(item: dict) -> None:
+        item["contents"] = None  # release the image bytes as soon as the result is in
+        on_done(item)
+
+    async def finish(item: dict, resp: dict, retry: list, last: bool) -> None:
+        if resp.get("retryable") and not last:
+            # Shed at the model-service's queue deadline without running: send it again
+            retry.append(item)
+            return
+        if resp.get("ok") is False:
+            item["error"] = resp.get("error", "Inference failed")
+        else:
+            item["model_resp"] = resp
+            await scan_cache.set(item["digest"], threshold, resp)
+        release(item)
+
+    attempts = settings.MODEL_SERVICE_RETRIES + 1
+    for attempt in range(attempts):
+        if not pending:
+            break
+        last = attempt == attempts - 1
+        retry: list[dict] = []
+        images = [(item["filename"], item["contents"], item["content_type"]) for item in pending]
+        try:
+            if per_image:
+                remaining = dict(enumerate(pending))
+                async for index, resp in stream_model_service_batch(images, threshold):
+                    await finish(remaining.pop(index), resp, retry, last)
+                for item in remaining.values():
+                    item["error"] = "Model service returned no result"
+                    release(item)
+            else:
+                responses = await call_model_service_batch(images, threshold)
+                for item, resp in zip(pending, responses):
+                    await finish(item, resp, retry, last)
+            pending = retry
+            if pending:
+                await asyncio.sleep(1)
+                continue
+        except httpx.HTTPStatusError as e:
+            # Saturated model-service: back off and retry the chunk
+            if e.response.status_code == 429 and attempt < attempts - 1:
+                await asyncio.sleep(float(e.response.headers.get("Retry-After", "1")))
+                continue
+            busy = e.response.status_code == 429
+            _fail(pending, "Model service busy" if busy else f"Model service error: {e}")
+        except ModelServiceUnavailable as e:
+            # Results already streamed stay; only the unfinished images fail
+            pending = [item for item in pending if item["model_resp"] is None and not item["error"]]
+            _fail(pending, f"Model service unavailable: {e}")
+        break
+
+    for item in pending:
+        release(item)
+
+
+async def stream_batch(
+    source: AsyncIterator[tuple[str, Optional[bytes], Optional[str]]],
+    threshold: float,
+    animal_ids: tuple[list, dict],
+    per_image: bool = True,
+) -> AsyncIterator[dict]:
+    """
+    Consume the source in chunks of AI_SCAN_BATCH_CHUNK_SIZE, with up to
+    AI_SCAN_BATCH_CONCURRENCY chunks in flight while the next one is read, and yield each
+    image's item as soon as it is final (completion order, not upload order).
+    Items: index, filename, animal_id, model_resp, error, cached.
+    Closing the generator early cancels the in-flight chunks.
+    """
+    by_position, by_filename = animal_ids
+    chunk_size = max(1, settings.AI_SCAN_BATCH_CHUNK_SIZE)
+    slots = asyncio.Semaphore(max(1, settings.AI_SCAN_BATCH_CONCURRENCY))
+    done: asyncio.Queue = asyncio.Queue()
+    tasks: list[asyncio.Task] = []
+
+    async def run_chunk(chunk: list[dict]) -> None:
+        try:
+            await _infer_chunk(chunk, threshold, done.put_nowait, per_image)
+        finally:
+            slots.release()
+
+    async def produce() -> int:
+        count = 0
+        chunk: list[dict] = []
+        async for filename, contents, error in source:
+            animal_id = by_position[count] if count < len(by_position) else None
+            if animal_id is None:
+                animal_id = by_filename.get(filename) or by_filename.get(os.path.basename(filename))
+            chunk.append(
+                {
+                    "index": count,
+                    "filename": filename,
+                    "animal_id": animal_id,
+                    "contents": contents,
+                    "model_resp": None,
+                    "error": error,
+                    "cached": False,
+                }
+            )
+            count += 1
+            if len(chunk) == chunk_size:
+                await slots.acquire()
+                tasks.append(asyncio.create_task(run_chunk(chunk)))
+                chunk = []
+        if chunk:
+            await slots.acquire()
+            tasks.append(asyncio.create_task(run_chunk(chunk)))
+        await asyncio.gather(*tasks)
+        return count
+
+    producer = asyncio.create_task(produce())
+    emitted = 0
+    try:
+        while True:
+            getter = asyncio.ensure_future(done.get())
+            await asyncio.wait({getter, producer}, return_when=asyncio.FIRST_COMPLETED)
+            if getter.done():
+                emitted += 1
+                yield getter.result()
+                continue
+            getter.cancel()
+            total = producer.result()  # re-raises a failure in reading/inference
+            while emitted < total:
+                emitted += 1
+                yield done.get_nowait()
+            break
+    finally:
+        producer.cancel()
+        for task in tasks:
+            task.cancel()
+        if hasattr(source, "aclose"):
+            await source.aclose()
+
+
+async def run_batch(
+    source: AsyncIterator[tuple[str, Optional[bytes], Optional[str]]],
+    threshold: float,
+    animal_ids: tuple[list, dict],
+) -> list[dict]:
+    """Run the whole batch through /infer-batch chunks; returns items in upload order."""
+    items = [item async for item in stream_batch(source, threshold, animal_ids, per_image=False)]
+    items.sort(key=lambda item: item["index"])
+    failed = sum(1 for item in items if item["error"])
+    if failed:
+        logger.info("AI scan batch: %d of %d images failed", failed, len(items))
+    return items
@@ -0,0 +1,238 @@
+"""
+Content-addressed cache of model-service results for repeat scans.
+Key: sha256 of the decoded image at model resolution (see imaging.prepare_image) + threshold
++ model version, so a re-uploaded photo skips both the network hop and the ONNX runs.
+Lookups use the version the inference backend serves now (version_source: the model-service's
+/health, polled by the client), so a hot swap stops old-version hits without waiting for a miss.
+Tiers: in-process LRU (per worker) in front of an optional shared tier (SQLite on disk,
+works offline; or Redis). Both tiers expire entries by TTL and evict by size.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from PIL import Image
+
+from app.core.config import settings
+from app.core.logging import logger
+
+# Same input resolution as the model-service, so the key reflects what the model sees
+DIGEST_SIZE = 224
+
+
+def pixel_digest(img: Image.Image) -> str:
+    """sha256 of an already decoded RGB image, resized to model resolution."""
+    return "px:" + hashlib.sha256(img.resize((DIGEST_SIZE, DIGEST_SIZE)).tobytes()).hexdigest()
+
+
+def raw_digest(contents: bytes) -> str:
+    """Fallback key for bytes that do not decode as an image."""
+    return "raw:" + hashlib.sha256(contents).hexdigest()
+
+
+class LRUTier:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: dict) -> None:
+        self._data[key] = (time.time() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """On-disk shared tier; safe across worker processes on one host."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS scan_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_scan_cache_accessed ON scan_cache (accessed_at)")
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM scan_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._conn.execute("DELETE FROM scan_cache WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE scan_cache SET accessed_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO scan_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._writes += 1
+            # Sweep expired rows and trim to size every 100 writes rather than on every insert
+            if self._writes % 100 == 0:
+                self._conn.execute("DELETE FROM scan_cache WHERE expires_at < ?", (now,))
+                self._conn.execute(
+                    "DELETE FROM scan_cache WHERE key IN ("
+                    "SELECT key FROM scan_cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class RedisTier:
+    """Redis-protocol shared tier (optional `redis` package). Size eviction is Redis' maxmemory policy."""
+
+    def __init__(self, url: str, ttl: float):
+        import redis
+
+        self.ttl = int(ttl)
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, key: str) -> Optional[dict]:
+        raw = self._client.get(f"ai_scan:{key}")
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key: str, value: dict) -> None:
+        self._client.set(f"ai_scan:{key}", json.dumps(value), ex=self.ttl)
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class ScanResultCache:
+    """Two-tier cache of model-service responses with hit/miss counters."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_entries: int = 2048,
+        ttl: float = 86400,
+        shared: str = "",
+    ):
+        self.enabled = enabled
+        self.memory = LRUTier(max_entries, ttl)
+        self.shared = None
+        if enabled and shared == "sqlite":
+            self.shared = SQLiteTier(
+                settings.AI_SCAN_CACHE_SQLITE_PATH, settings.AI_SCAN_CACHE_SHARED_MAX_ENTRIES, ttl
+            )
+        elif enabled and shared == "redis":
+            self.shared = RedisTier(settings.AI_SCAN_CACHE_REDIS_URL, ttl)
+        elif shared:
+            logger.warning("Unknown AI_SCAN_CACHE_SHARED=%r; using in-process cache only", shared)
+        # Active model version from the inference backend's health checks (wired at startup)
+        self.version_source: Optional[Callable[[], Optional[str]]] = None
+        # Version of the latest response; keys lookups while version_source has no answer
+        self.model_version: Optional[str] = None
+        self.stats = {"memory_hits": 0, "shared_hits": 0, "misses": 0, "sets": 0, "shared_errors": 0}
+
+    def _key(self, digest: str, threshold: float, model_version: Optional[str]) -> str:
+        return f"{digest}|t={threshold:.4f}|m={model_version or 'unknown'}"
+
+    def current_version(self) -> Optional[str]:
+        """Model version lookups are keyed on."""
+        version = self.version_source() if self.version_source is not None else None
+        return version or self.model_version
+
+    async def get(self, digest: str, threshold: float) -> Optional[dict]:
+        if not self.enabled:
+            return None
+        key = self._key(digest, threshold, self.current_version())
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats["memory_hits"] += 1
+            return value
+        if self.shared is not None:
+            try:
+                value = await asyncio.to_thread(self.shared.get, key)
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning("AI scan shared cache get failed: %s", e)
+            if value is not None:
+                self.stats["shared_hits"] += 1
+                self.memory.set(key, value)
+                return value
+        self.stats["misses"] += 1
+        return None
+
+    async def set(self, digest: str, threshold: float, model_resp: dict) -> None:
+        if not self.enabled:
+            return
+        # Store under the version that actually produced the result
+        version = model_resp.get("model_version") or self.model_version
+        self.model_version = version
+        key = self._key(digest, threshold, version)
+        self.memory.set(key, model_resp)
+        self.stats["sets"] += 1
+        if self.shared is not None:
+            try:
+                await asyncio.to_thread(self.shared.set, key, model_resp)
+            except Exception as e:
+                self.stats["shared_errors"] += 1
+                logger.warning("AI scan shared cache set failed: %s", e)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["shared_hits"] + self.stats["misses"]
+        hits = self.stats["memory_hits"] + self.stats["shared_hits"]
+        return {
+            **self.stats,
+            "hit_rate": hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "memory_evictions": self.memory.evictions,
+            "shared": settings.AI_SCAN_CACHE_SHARED or None,
+            "model_version": self.current_version(),
+        }
+
+    def close(self) -> None:
+        if self.shared is not None:
+            self.shared.close()
+
+
+scan_cache = ScanResultCache(
+    enabled=settings.AI_SCAN_CACHE_ENABLED,
+    max_entries=settings.AI_SCAN_CACHE_MAX_ENTRIES,
+    ttl=settings.AI_SCAN_CACHE_TTL_SECONDS,
+    shared=settings.AI_SCAN_CACHE_SHARED,
+)
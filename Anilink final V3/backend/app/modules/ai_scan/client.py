@@ -0,0 +1,443 @@
+"""
+Long-lived async HTTP client for the model-service.
+One httpx.AsyncClient per replica per worker (keep-alive pool, created at startup, closed at
+shutdown), split connect/read timeouts, jittered retries on connect errors, and a circuit
+breaker per replica that fails fast while it is down.
+
+With several replicas (MODEL_SERVICE_URLS) balancing is client-side: each request goes to the
+available replica with the fewest outstanding requests from this worker. A replica is ejected
+while its circuit is open or after MODEL_SERVICE_HEALTH_FAILURES failed GET /health checks,
+and re-admitted when /health passes again (an open circuit goes straight to half-open). Each
+check also records the model version the replica serves (see model_version), which keys the
+result cache after a hot swap. Single-image /infer calls are hedged: if the
+first replica has not answered within the MODEL_SERVICE_HEDGE_PERCENTILE latency, the same
+request also goes to a second replica and the first answer wins. Batch and stream calls are
+not hedged (duplicating a whole chunk would double the load when it is highest).
+Single scans are sent with X-Priority: interactive, batch and stream chunks with bulk, so the
+model-service schedules them in separate lanes.
+"""
+
+import asyncio
+import json
+import random
+import time
+from collections import deque
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.logging import logger
+
+
+class ModelServiceUnavailable(Exception):
+    """Model-service cannot be reached (circuit open, connect failure or timeout)."""
+
+
+class CircuitBreaker:
+    """
+    closed -> open after `failure_threshold` consecutive failures.
+    open -> half_open after `reset_timeout` seconds; one probe request is let through.
+    half_open -> closed on success, back to open on failure. A probe that never reports back
+    (e.g. the request was cancelled) is given up on after another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 15.0, name: str = "Model-service"):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_started: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            now = time.monotonic()
+            if self._probe_started is None or now - self._probe_started >= self.reset_timeout:
+                self._probe_started = now
+                return True
+        return False
+
+    def expire(self) -> None:
+        """Skip the rest of the open period: the next request is let through as a probe."""
+        if self.opened_at is not None:
+            self.opened_at = time.monotonic() - self.reset_timeout
+            self._probe_started = None
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self._probe_started = None
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probe_started is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                logger.warning("%s circuit opened after %d failures", self.name, self.failures)
+            self.opened_at = time.monotonic()
+        self._probe_started = None
+
+
+class Replica:
+    """One model-service instance: connection pool, circuit breaker, health and load."""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.breaker = CircuitBreaker(
+            settings.MODEL_SERVICE_BREAKER_THRESHOLD,
+            settings.MODEL_SERVICE_BREAKER_RESET_SECONDS,
+            name=f"Model-service {self.url}",
+        )
+        self.healthy = True  # verdict of the active health checks (assumed up until checked)
+        self.health_failures = 0
+        self.model_version: Optional[str] = None  # as reported by the last passed /health
+        self.outstanding = 0
+        self.requests = 0
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _build_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=self.url,
+            limits=httpx.Limits(
+                max_connections=settings.MODEL_SERVICE_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.MODEL_SERVICE_MAX_KEEPALIVE,
+                keepalive_expiry=settings.MODEL_SERVICE_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.MODEL_SERVICE_CONNECT_TIMEOUT,
+                read=settings.MODEL_SERVICE_READ_TIMEOUT,
+                write=settings.MODEL_SERVICE_READ_TIMEOUT,
+                pool=settings.MODEL_SERVICE_POOL_TIMEOUT,
+            ),
+        )
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily as well, so scripts and tests work without the app's startup hook
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self) -> None:
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    @property
+    def available(self) -> bool:
+        return self.healthy and self.breaker.state != "open"
+
+    def snapshot(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.breaker.state,
+            "model_version": self.model_version,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+        }
+
+
+def _is_connect_error(error: Exception) -> bool:
+    """The request never reached the replica, so it is safe to send it again."""
+    return isinstance(error.__cause__, (httpx.ConnectError, httpx.ConnectTimeout))
+
+
+class ModelServiceClient:
+    """Pooled async client for model-service POST /infer, balanced across replicas."""
+
+    # Recent latencies kept per endpoint for the hedging percentile
+    LATENCY_WINDOW = 512
+
+    def __init__(self, base_urls: list[str]):
+        self.replicas = [Replica(url) for url in base_urls]
+        self._latencies: dict[str, deque] = {}
+        self._health_task: Optional[asyncio.Task] = None
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    async def start(self) -> None:
+        for replica in self.replicas:
+            await replica.start()
+        if self._health_task is None:
+            if settings.MODEL_SERVICE_HEALTH_INTERVAL > 0:
+                self._health_task = asyncio.create_task(self._health_loop())
+            else:
+                # No health checks: still learn the serving model version once
+                self._health_task = asyncio.create_task(self._fetch_versions())
+
+    async def close(self) -> None:
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self.replicas:
+            await replica.close()
+
+    @property
+    def model_version(self) -> Optional[str]:
+        """Model version all available replicas reported, or None while they differ (mid-rollout) or are unknown."""
+        versions = {replica.model_version for replica in self.replicas if replica.available}
+        return versions.pop() if len(versions) == 1 else None
+
+    async def _health(self, replica: Replica) -> Optional[dict]:
+        """GET /health body if the replica reports ok, else None."""
+        try:
+            resp = await replica.client.get("/health", timeout=settings.MODEL_SERVICE_HEALTH_TIMEOUT)
+            body = resp.json() if resp.status_code == 200 else {}
+        except (httpx.HTTPError, ValueError):
+            return None
+        if not isinstance(body, dict) or not body.get("ok", False):
+            return None
+        replica.model_version = body.get("model_version") or replica.model_version
+        return body
+
+    async def _fetch_versions(self) -> None:
+        await asyncio.gather(*(self._health(replica) for replica in self.replicas))
+
+    async def _check(self, replica: Replica) -> None:
+        ok = await self._health(replica) is not None
+        if ok:
+            if not replica.healthy:
+                logger.info("Model-service replica %s passed health check, re-admitted", replica.url)
+            # Reachable again: probe it with the next request rather than waiting out the circuit
+            replica.breaker.expire()
+            replica.healthy = True
+            replica.health_failures = 0
+            return
+        replica.health_failures += 1
+        if replica.healthy and replica.health_failures >= settings.MODEL_SERVICE_HEALTH_FAILURES:
+            logger.warning("Model-service replica %s failed health checks, ejected", replica.url)
+            replica.healthy = False
+
+    async def _health_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._check(replica) for replica in self.replicas))
+            await asyncio.sleep(settings.MODEL_SERVICE_HEALTH_INTERVAL)
+
+    def _pick(self, exclude: tuple = ()) -> Optional[Replica]:
+        """
+        Least outstanding requests among available replicas (random among ties).
+        If health checks have ejected every replica, fall back to any whose circuit allows it.
+        """
+        candidates = [r for r in self.replicas if r not in exclude and r.available]
+        if not candidates:
+            candidates = [r for r in self.replicas if r not in exclude]
+        random.shuffle(candidates)
+        for replica in sorted(candidates, key=lambda r: r.outstanding):
+            if replica.breaker.allow():
+                return replica
+        return None
+
+    def _hedge_delay(self, path: str) -> Optional[float]:
+        """Seconds to wait before hedging, or None (disabled, one replica, too few samples)."""
+        if settings.MODEL_SERVICE_HEDGE_PERCENTILE <= 0 or len(self.replicas) < 2:
+            return None
+        window = self._latencies.get(path)
+        if window is None or len(window) < settings.MODEL_SERVICE_HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(window)
+        index = min(len(ordered) - 1, int(settings.MODEL_SERVICE_HEDGE_PERCENTILE / 100 * len(ordered)))
+        return max(ordered[index], settings.MODEL_SERVICE_HEDGE_MIN_MS / 1000)
+
+    async def _send(self, replica: Replica, path: str, files, data: dict, headers: dict) -> dict:
+        """
+        One POST to one replica, through its circuit breaker.
+        Raises ModelServiceUnavailable when the replica is unreachable,
+        httpx.HTTPStatusError for error responses (e.g. 429 when the model-service is saturated).
+        """
+        replica.outstanding += 1
+        replica.requests += 1
+        t0 = time.monotonic()
+        try:
+            resp = await replica.client.post(path, files=files, data=data, headers=headers)
+        except httpx.TransportError as e:
+            replica.breaker.record_failure()
+            raise ModelServiceUnavailable(f"{replica.url}: {type(e).__name__}: {e}") from e
+        finally:
+            replica.outstanding -= 1
+
+        if resp.status_code >= 500:
+            replica.breaker.record_failure()
+        else:
+            replica.breaker.record_success()
+        resp.raise_for_status()
+        self._latencies.setdefault(path, deque(maxlen=self.LATENCY_WINDOW)).append(time.monotonic() - t0)
+        return resp.json()
+
+    async def _send_hedged(self, replica: Replica, path: str, files, data: dict, headers: dict) -> dict:
+        """_send, plus a second replica if the first is slower than the hedge delay."""
+        delay = self._hedge_delay(path)
+        if delay is None:
+            return await self._send(replica, path, files, data, headers)
+
+        primary = asyncio.ensure_future(self._send(replica, path, files, data, headers))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                backup = self._pick(exclude=(replica,))
+                if backup is not None:
+                    self.hedged += 1
+                    pending.add(asyncio.ensure_future(self._send(backup, path, files, data, headers)))
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        self.hedge_wins += task is not primary
+                        return task.result()
+                    error = error or task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            # The slower copy is dropped (the model-service skips it if not yet dispatched)
+            for task in pending:
+                task.cancel()
+
+    async def _call(self, path: str, files, data: dict, headers: dict, hedge: bool = False) -> dict:
+        """
+        POST to the least loaded replica. Connect errors (the request never reached it) are
+        retried, on another replica when one is available, else after a jittered backoff.
+        Raises ModelServiceUnavailable when no replica can be reached,
+        httpx.HTTPStatusError for error responses (e.g. 429 when the model-service is saturated).
+        """
+        attempts = settings.MODEL_SERVICE_RETRIES + 1
+        tried: list[Replica] = []
+        for attempt in range(attempts):
+            replica = self._pick(exclude=tuple(tried)) or self._pick()
+            if replica is None:
+                raise ModelServiceUnavailable("circuit open, model-service marked down")
+            try:
+                if hedge:
+                    return await self._send_hedged(replica, path, files, data, headers)
+                return await self._send(replica, path, files, data, headers)
+            except ModelServiceUnavailable as e:
+                if attempt == attempts - 1 or not _is_connect_error(e):
+                    raise
+                tried.append(replica)
+                if any(r not in tried and r.available for r in self.replicas):
+                    logger.info("Model-service %s, trying another replica", e)
+                    continue
+                # Full jitter: sleep uniformly in [0, backoff * 2^attempt]
+                delay = random.uniform(0, settings.MODEL_SERVICE_RETRY_BACKOFF * 2**attempt)
+                logger.info("Model-service connect failed (%s), retrying in %.2fs", e, delay)
+                await asyncio.sleep(delay)
+
+    async def infer(
+        self,
+        file_contents: bytes,
+        filename: str,
+        threshold: float = 0.5,
+        content_type: str = "image/jpeg",
+        priority: str = "interactive",
+    ) -> dict:
+        """POST /infer with the image file (hedged across replicas)."""
+        files = {"file": (filename, file_contents, content_type)}
+        headers = {"X-Priority": priority}
+        return await self._call("/infer", files, {"threshold": str(threshold)}, headers, hedge=True)
+
+    async def infer_batch(
+        self,
+        images: list[tuple[str, bytes, str]],
+        threshold: float = 0.5,
+        priority: str = "bulk",
+    ) -> list[dict]:
+        """
+        POST /infer-batch with several (filename, contents, content_type) images.
+        Returns one /infer response or {"ok": False, "error": ...} per image, in order
+        ("retryable": True on images the model-service shed at its queue deadline).
+        """
+        files = [("files", image) for image in images]
+        headers = {"X-Priority": priority}
+        resp = await self._call("/infer-batch", files, {"threshold": str(threshold)}, headers)
+        return resp["results"]
+
+    async def _open_stream(self, files, data: dict, headers: dict) -> tuple[Replica, httpx.Response]:
+        """POST /infer-stream without reading the body, with the same retries as _call."""
+        attempts = settings.MODEL_SERVICE_RETRIES + 1
+        tried: list[Replica] = []
+        for attempt in range(attempts):
+            replica = self._pick(exclude=tuple(tried)) or self._pick()
+            if replica is None:
+                raise ModelServiceUnavailable("circuit open, model-service marked down")
+            try:
+                request = replica.client.build_request(
+                    "POST", "/infer-stream", files=files, data=data, headers=headers
+                )
+                return replica, await replica.client.send(request, stream=True)
+            except httpx.TransportError as e:
+                replica.breaker.record_failure()
+                if attempt == attempts - 1 or not isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+                    raise ModelServiceUnavailable(f"{replica.url}: {type(e).__name__}: {e}") from e
+                tried.append(replica)
+                if not any(r not in tried and r.available for r in self.replicas):
+                    await asyncio.sleep(random.uniform(0, settings.MODEL_SERVICE_RETRY_BACKOFF * 2**attempt))
+
+    async def infer_stream(
+        self,
+        images: list[tuple[str, bytes, str]],
+        threshold: float = 0.5,
+        priority: str = "bulk",
+    ) -> AsyncIterator[tuple[int, dict]]:
+        """
+        POST /infer-stream: yields (index, result) per image as the model-service finishes it.
+        Closing the iterator early closes the connection, and the model-service drops the
+        images it has not started yet.
+        """
+        files = [("files", image) for image in images]
+        replica, resp = await self._open_stream(files, {"threshold": str(threshold)}, {"X-Priority": priority})
+        replica.outstanding += 1  # for least-outstanding routing while the stream is open
+        replica.requests += 1
+        try:
+            if resp.status_code >= 500:
+                replica.breaker.record_failure()
+            else:
+                replica.breaker.record_success()
+            if resp.is_error:
+                await resp.aread()
+                resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if line:
+                    message = json.loads(line)
+                    yield message["index"], message["result"]
+        except httpx.TransportError as e:
+            replica.breaker.record_failure()
+            raise ModelServiceUnavailable(f"{replica.url}: {type(e).__name__}: {e}") from e
+        finally:
+            replica.outstanding -= 1
+            await resp.aclose()
+
+    def snapshot(self) -> dict:
+        return {
+            "replicas": [replica.snapshot() for replica in self.replicas],
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_ms": {
+                path: round(delay * 1000, 1)
+                for path in self._latencies
+                if (delay := self._hedge_delay(path)) is not None
+            },
+        }
+
+
+def _replica_urls() -> list[str]:
+    urls = [url.strip() for url in settings.MODEL_SERVICE_URLS.split(",") if url.strip()]
+    return urls or [settings.MODEL_SERVICE_URL]
+
+
+model_service_client = ModelServiceClient(_replica_urls())
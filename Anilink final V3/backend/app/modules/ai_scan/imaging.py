@@ -0,0 +1,59 @@
+"""
+Upload preparation before forwarding to the model-service.
+The model-service only looks at a 224x224 resize, so multi-megabyte phone photos are
+downscaled here (JPEG draft decoding, then short side to AI_SCAN_FORWARD_SHORT_SIDE) and
+re-encoded as a compact baseline JPEG without EXIF/ICC metadata. The same decode yields the
+result-cache digest. CPU-bound: call prepare_image via asyncio.to_thread.
+"""
+
+import io
+import mimetypes
+from dataclasses import dataclass
+
+from PIL import Image
+
+from app.core.config import settings
+from app.modules.ai_scan.cache import pixel_digest, raw_digest
+
+
+@dataclass
+class PreparedImage:
+    contents: bytes
+    content_type: str
+    digest: str
+
+
+def _content_type(filename: str) -> str:
+    return mimetypes.guess_type(filename)[0] or "image/jpeg"
+
+
+def prepare_image(contents: bytes, filename: str) -> PreparedImage:
+    """
+    Downscale and re-encode one upload. Images already within the bound that are plain JPEGs
+    are forwarded as-is; undecodable bytes are forwarded unchanged (the model-service reports
+    the error) with a raw-bytes digest.
+    """
+    short_side = settings.AI_SCAN_FORWARD_SHORT_SIDE
+    try:
+        img = Image.open(io.BytesIO(contents))
+        fmt = img.format
+        width, height = img.size
+        if short_side > 0:
+            # Only JPEGs support draft mode: the DCT scales by 1/2..1/8, never below the target
+            scale = short_side / min(width, height)
+            img.draft("RGB", (max(short_side, round(width * scale)), max(short_side, round(height * scale))))
+        img = img.convert("RGB")
+    except Exception:
+        return PreparedImage(contents, _content_type(filename), raw_digest(contents))
+
+    digest = pixel_digest(img)
+    if short_side <= 0 or (min(width, height) <= short_side and fmt == "JPEG"):
+        return PreparedImage(contents, Image.MIME.get(fmt, _content_type(filename)), digest)
+
+    if min(img.size) > short_side:
+        scale = short_side / min(img.size)
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.BICUBIC, reducing_gap=2.0)
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=settings.AI_SCAN_FORWARD_JPEG_QUALITY)
+    return PreparedImage(buf.getvalue(), "image/jpeg", digest)
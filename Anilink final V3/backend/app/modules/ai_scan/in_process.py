@@ -0,0 +1,198 @@
+"""
+In-process inference backend (AI_SCAN_INFERENCE_BACKEND=in_process) for single-node
+deployments where the backend and the models share a box. Loads the model-service's own
+modules (inference, batching, registry, ...) from MODEL_SERVICE_DIR and runs the same
+micro-batched ONNX sessions inside the backend worker, skipping multipart encoding, the HTTP
+hop and JSON decoding. Same interface and response shapes as ModelServiceClient.
+
+onnxruntime and numpy are only needed in this mode; they are imported on first use.
+Registry hot swaps are not watched here: the registry's `current` version (or the
+MODEL_*_PATH files) is loaded at startup. The quality pre-gate uses its default thresholds.
+"""
+
+import asyncio
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import AsyncIterator, Optional
+
+import httpx
+
+from app.core.config import settings
+from app.core.logging import logger
+from app.modules.ai_scan.client import ModelServiceUnavailable
+
+
+def _busy(message: str) -> httpx.HTTPStatusError:
+    """The error ModelServiceClient raises for a saturated model-service (429), so callers'
+    back-off and retry handling applies unchanged."""
+    request = httpx.Request("POST", "in-process://model-service")
+    response = httpx.Response(429, headers={"Retry-After": "1"}, request=request)
+    return httpx.HTTPStatusError(message, request=request, response=response)
+
+
+class InProcessInference:
+    """ONNX inference in this process, behind the ModelServiceClient interface."""
+
+    def __init__(self):
+        self.spec = None
+        self.batcher = None
+        self._queue_full_error = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _load(self):
+        """Import the model-service modules and load + warm up the sessions (blocking)."""
+        if settings.MODEL_SERVICE_DIR not in sys.path:
+            # The model-service is a flat module directory (inference.py, batching.py, ...)
+            sys.path.insert(0, settings.MODEL_SERVICE_DIR)
+        try:
+            from batching import Lane, MicroBatcher, QueueFullError
+            from inference import _load_sessions, run_inference_batch, variant_path
+            from quality import QualityConfig
+            from registry import ModelRegistry, spec_from_paths
+            from sessions import SessionConfig
+        except ImportError as e:
+            raise ModelServiceUnavailable(
+                f"in-process inference needs the model-service code and its requirements: {e}"
+            ) from e
+
+        if settings.MODEL_REGISTRY_DIR:
+            spec = ModelRegistry(settings.MODEL_REGISTRY_DIR, settings.MODEL_VARIANT).resolve()
+        else:
+            spec = spec_from_paths(
+                variant_path(settings.MODEL_CATTLE_PATH, settings.MODEL_VARIANT),
+                variant_path(settings.MODEL_FMD_PATH, settings.MODEL_VARIANT),
+                variant_path(settings.MODEL_FUSED_PATH, settings.MODEL_VARIANT),
+            )
+        missing = spec.missing()
+        if missing:
+            raise ModelServiceUnavailable(missing)
+
+        session_config = SessionConfig(intra_op_threads=settings.AI_SCAN_IN_PROCESS_ORT_THREADS)
+        _load_sessions(spec, session_config)
+        workers = max(1, settings.AI_SCAN_IN_PROCESS_WORKERS)
+        batcher = MicroBatcher(
+            partial(run_inference_batch, spec=spec, session_config=session_config, quality_config=QualityConfig()),
+            executor=ThreadPoolExecutor(workers, thread_name_prefix="ai-scan-inference"),
+            max_batch_size=settings.AI_SCAN_IN_PROCESS_BATCH_MAX_SIZE,
+            window_ms=settings.AI_SCAN_IN_PROCESS_BATCH_WINDOW_MS,
+            concurrency=workers,
+            # Same lanes as the model-service: bulk batch/stream chunks yield to single scans
+            lanes=[
+                Lane("interactive", weight=8, max_queue=settings.AI_SCAN_IN_PROCESS_QUEUE_DEPTH),
+                Lane(
+                    "bulk",
+                    weight=1,
+                    max_concurrency=max(1, workers - 1),
+                    max_queue=4 * settings.AI_SCAN_IN_PROCESS_QUEUE_DEPTH,
+                ),
+            ],
+        )
+        return spec, batcher, QueueFullError
+
+    @property
+    def model_version(self) -> Optional[str]:
+        """Version of the loaded models (None until loaded)."""
+        return self.spec.version if self.spec is not None else None
+
+    async def start(self) -> None:
+        """Load the models; failures are logged and reported by the next call instead."""
+        try:
+            await self._ensure_started()
+        except ModelServiceUnavailable as e:
+            logger.warning("In-process inference not available: %s", e)
+
+    async def _ensure_started(self):
+        if self.batcher is not None:
+            return self.batcher
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self.batcher is None:
+                try:
+                    spec, batcher, queue_full_error = await asyncio.to_thread(self._load)
+                except ModelServiceUnavailable:
+                    raise
+                except Exception as e:
+                    raise ModelServiceUnavailable(f"model load failed: {e}") from e
+                await batcher.start()
+                self.spec, self._queue_full_error = spec, queue_full_error
+                self.batcher = batcher
+                logger.info("In-process inference ready: model %s", spec.version)
+        return self.batcher
+
+    async def close(self) -> None:
+        if self.batcher is not None:
+            await self.batcher.stop()
+            self.batcher.executor.shutdown(wait=False, cancel_futures=True)
+            self.batcher = None
+
+    async def infer(
+        self,
+        file_contents: bytes,
+        filename: str,
+        threshold: float = 0.5,
+        content_type: str = "image/jpeg",
+        priority: str = "interactive",
+    ) -> dict:
+        """Same result as model-service POST /infer."""
+        batcher = await self._ensure_started()
+        t0 = time.perf_counter()
+        try:
+            result = await batcher.submit(file_contents, threshold, priority)
+        except self._queue_full_error as e:
+            raise _busy(str(e)) from e
+        result["timings_ms"]["total"] = (time.perf_counter() - t0) * 1000
+        return result
+
+    def _enqueue(self, batcher, images: list[tuple[str, bytes, str]], threshold: float, priority: str) -> list:
+        try:
+            return batcher.enqueue_many([(contents, threshold) for _, contents, _ in images], priority)
+        except self._queue_full_error as e:
+            raise _busy(str(e)) from e
+
+    @staticmethod
+    def _outcome(future: asyncio.Future) -> dict:
+        if future.exception() is not None:
+            return {"ok": False, "error": f"Inference failed: {future.exception()}"}
+        return future.result()
+
+    async def infer_batch(
+        self,
+        images: list[tuple[str, bytes, str]],
+        threshold: float = 0.5,
+        priority: str = "bulk",
+    ) -> list[dict]:
+        """Same results as model-service POST /infer-batch, in order."""
+        batcher = await self._ensure_started()
+        futures = self._enqueue(batcher, images, threshold, priority)
+        try:
+            if futures:
+                await asyncio.wait(futures)
+        finally:
+            for future in futures:
+                future.cancel()  # no-op once done; drops queued images if the caller went away
+        return [self._outcome(future) for future in futures]
+
+    async def infer_stream(
+        self,
+        images: list[tuple[str, bytes, str]],
+        threshold: float = 0.5,
+        priority: str = "bulk",
+    ) -> AsyncIterator[tuple[int, dict]]:
+        """Yields (index, result) as each image finishes; closing early drops unstarted images."""
+        batcher = await self._ensure_started()
+        futures = self._enqueue(batcher, images, threshold, priority)
+        pending = {future: index for index, future in enumerate(futures)}
+        try:
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    yield pending.pop(future), self._outcome(future)
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+in_process_inference = InProcessInference()
@@ -28,3 +28,5 @@ class ScanRecord(Base):
     fmd_confidence = Column(Float, nullable=True)
     raw_json = Column(JSONB, nullable=True)
     image_ref = Column(String(512), nullable=True)
+    # sha256 of user, animal, image content and threshold: a retried upload saves one record
+    idempotency_key = Column(String(64), nullable=True, unique=True)
@@ -0,0 +1,350 @@
+"""
+Write-behind persistence of ScanRecord rows (AI_SCAN_RECORD_WRITE_BEHIND).
+The scan endpoints hand over fully built records (id and created_at are set in Python) and
+respond immediately; a background task inserts them in batches of up to
+AI_SCAN_RECORD_FLUSH_SIZE rows, at the latest AI_SCAN_RECORD_FLUSH_MS after the first one
+arrived, as one multi-row INSERT ... ON CONFLICT DO NOTHING (so a replayed or retried record,
+whose id comes from its idempotency key, is not saved twice).
+
+If the database is unavailable the batch is appended to a local spool file (JSON lines, one
+per worker process) instead, and replayed on the next start and every
+AI_SCAN_RECORD_REPLAY_INTERVAL_S until it is empty. Spool files left by worker processes that
+are no longer running are replayed too; a replay first claims a file by renaming it to
+<name>.replaying.<pid>, so workers starting together do not replay (and remove) the same one.
+
+A record's id is returned to the client before it is inserted, so a row is never dropped:
+save_scan_records only hands over records whose animal exists and belongs to the user. A row
+whose animal was deleted in the meantime is saved unlinked (what ON DELETE SET NULL would have
+done), and a row the database still rejects goes to scan_records.rejected.jsonl in the spool
+directory (not replayed automatically) with an error log.
+
+Records become visible in GET /records up to one flush interval after the scan response.
+"""
+
+import asyncio
+import contextlib
+import glob
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import DataError, IntegrityError
+
+from app.core.config import settings
+from app.core.db import SessionLocal
+from app.core.logging import logger
+from app.modules.ai_scan.models import ScanRecord
+
+_COLUMNS = [column.name for column in ScanRecord.__table__.columns]
+_UUID_COLUMNS = ("id", "user_id", "animal_id")
+# Lower bound for AI_SCAN_RECORD_REPLAY_INTERVAL_S (0 would replay on every loop pass)
+MIN_REPLAY_INTERVAL_S = 1.0
+
+
+def _row(record: ScanRecord) -> dict:
+    return {name: getattr(record, name) for name in _COLUMNS}
+
+
+def _to_json(row: dict) -> str:
+    encoded = dict(row)
+    for name in _UUID_COLUMNS:
+        if encoded[name] is not None:
+            encoded[name] = str(encoded[name])
+    encoded["created_at"] = encoded["created_at"].isoformat()
+    # Anything raw_json holds that JSON has no type for (e.g. numpy scalars) is kept as text
+    return json.dumps(encoded, default=str)
+
+
+def _from_json(line: str) -> dict:
+    row = json.loads(line)
+    for name in _UUID_COLUMNS:
+        if row.get(name) is not None:
+            row[name] = uuid.UUID(row[name])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    return row
+
+
+def _pid_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ScanRecordWriter:
+    """Buffers ScanRecord rows and inserts them in batches from a background task."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        flush_size: int = 100,
+        flush_ms: float = 200,
+        spool_dir: str = "",
+        replay_interval: float = 30,
+    ):
+        self.enabled = enabled
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = max(0.0, flush_ms) / 1000
+        self.spool_dir = spool_dir
+        self.replay_interval = max(MIN_REPLAY_INTERVAL_S, replay_interval)
+        self._buffer: list[dict] = []
+        # Submitted records by idempotency key until their batch is inserted or spooled
+        self._pending: dict[str, ScanRecord] = {}
+        self._arrived: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._spool_lock = threading.Lock()
+        self.stats = {"submitted": 0, "inserted": 0, "duplicates": 0, "unlinked": 0, "rejected": 0,
+                      "flushes": 0, "spooled": 0, "replayed": 0, "db_errors": 0}
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    @property
+    def spool_path(self) -> str:
+        return os.path.join(self.spool_dir, f"scan_records.{os.getpid()}.jsonl")
+
+    @property
+    def rejected_path(self) -> str:
+        return os.path.join(self.spool_dir, "scan_records.rejected.jsonl")
+
+    async def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self._arrived = asyncio.Event()
+        self._closing = False
+        try:
+            await asyncio.to_thread(self._replay)
+        except Exception as e:
+            # The spool stays on disk and the flush loop replays it later; never block startup
+            logger.warning("Scan record spool replay at startup failed: %s", e)
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def close(self) -> None:
+        if self._task is None:
+            return
+        # Not cancelled: let the loop finish its current flush or replay and exit
+        self._closing = True
+        self._arrived.set()
+        await self._task
+        self._task = None
+        # Whatever is still buffered goes to the database, or to the spool if that fails
+        while self._buffer:
+            if not await self._flush():
+                logger.error("Scan record writer closed with %d rows neither inserted nor spooled", len(self._buffer))
+                break
+
+    def submit(self, records: list[ScanRecord]) -> None:
+        """Queue records for insertion (their ids are final); returns without touching the DB."""
+        now = datetime.now(timezone.utc)
+        for record in records:
+            if record.created_at is None:
+                record.created_at = now
+            if record.idempotency_key is not None:
+                self._pending.setdefault(record.idempotency_key, record)
+            self._buffer.append(_row(record))
+        self.stats["submitted"] += len(records)
+        if self._arrived is not None:
+            self._arrived.set()
+
+    def pending(self, keys) -> dict[str, ScanRecord]:
+        """Records submitted under these idempotency keys that are not in the database yet."""
+        return {key: self._pending[key] for key in keys if key in self._pending}
+
+    def _settle(self, rows: list[dict]) -> None:
+        for row in rows:
+            if row["idempotency_key"] is not None:
+                self._pending.pop(row["idempotency_key"], None)
+
+    async def _flush_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_replay = loop.time() + self.replay_interval
+        while not self._closing:
+            try:
+                # Sleep until rows arrive or the next replay is due, whichever comes first
+                try:
+                    await asyncio.wait_for(self._arrived.wait(), max(0.0, next_replay - loop.time()))
+                except asyncio.TimeoutError:
+                    pass
+                self._arrived.clear()
+                if self._buffer and len(self._buffer) < self.flush_size and not self._closing:
+                    # Let the batch fill up for one interval after its first row
+                    await asyncio.sleep(self.flush_interval)
+                while self._buffer:
+                    if not await self._flush():
+                        # Neither inserted nor spooled: the rows stay buffered until the next replay
+                        break
+                if loop.time() >= next_replay and not self._closing:
+                    next_replay = loop.time() + self.replay_interval
+                    await asyncio.to_thread(self._replay)
+            except Exception:
+                # The loop must outlive any single failure, or buffered rows would never be written
+                logger.exception("Scan record writer loop failed; continuing")
+
+    async def _flush(self) -> bool:
+        """Insert (or spool) the next batch; False if it could do neither and the rows are back in the buffer."""
+        rows, self._buffer = self._buffer[: self.flush_size], self._buffer[self.flush_size :]
+        self.stats["flushes"] += 1
+        try:
+            await asyncio.to_thread(self._insert, rows)
+            self._settle(rows)
+            return True
+        except Exception as e:
+            self.stats["db_errors"] += 1
+            logger.warning("Scan record flush failed (%s); spooling %d rows to %s", e, len(rows), self.spool_path)
+        try:
+            await asyncio.to_thread(self._spool, rows)
+            self._settle(rows)
+            return True
+        except Exception as e:
+            logger.error("Could not spool %d scan records to %s (%s); keeping them buffered", len(rows), self.spool_path, e)
+            self._buffer[:0] = rows
+            return False
+
+    def _insert(self, rows: list[dict]) -> None:
+        """One multi-row INSERT; if the database rejects it, the rows are inserted one by one."""
+        # The first copy of a repeated id is the one whose values the client was shown
+        first: dict = {}
+        for row in rows:
+            first.setdefault(row["id"], row)
+        unique = list(first.values())
+        try:
+            self._execute(unique)
+        except (IntegrityError, DataError):
+            for row in unique:
+                self._insert_one(row)
+        self.stats["duplicates"] += len(rows) - len(unique)
+
+    def _insert_one(self, row: dict) -> None:
+        try:
+            self._execute([row])
+            return
+        except IntegrityError as e:
+            if row["animal_id"] is None:
+                self._reject(row, e)
+                return
+            error = e
+        except DataError as e:
+            self._reject(row, e)
+            return
+        # The animal was deleted after the record was acknowledged: keep the record, unlinked
+        logger.warning("Scan record %s: animal %s is gone (%s); saving it unlinked", row["id"], row["animal_id"], error)
+        try:
+            self._execute([{**row, "animal_id": None}])
+            self.stats["unlinked"] += 1
+        except (IntegrityError, DataError) as e:
+            self._reject(row, e)
+
+    def _reject(self, row: dict, error: Exception) -> None:
+        """Keep a row the database will not accept for manual repair (its id was already returned)."""
+        logger.error("Scan record %s rejected by the database (%s); kept in %s", row["id"], error, self.rejected_path)
+        with self._spool_lock, open(self.rejected_path, "a", encoding="utf-8") as f:
+            f.write(_to_json(row) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["rejected"] += 1
+
+    def _execute(self, rows: list[dict]) -> None:
+        db = SessionLocal()
+        try:
+            result = db.execute(pg_insert(ScanRecord.__table__).values(rows).on_conflict_do_nothing())
+            db.commit()
+            self.stats["inserted"] += result.rowcount
+            self.stats["duplicates"] += len(rows) - result.rowcount
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _spool(self, rows: list[dict]) -> None:
+        with self._spool_lock, open(self.spool_path, "a", encoding="utf-8") as f:
+            f.write("".join(_to_json(row) + "\n" for row in rows))
+            f.flush()
+            os.fsync(f.fileno())
+        self.stats["spooled"] += len(rows)
+
+    def _spool_files(self) -> list[tuple[str, str, int]]:
+        """
+        (path, spool name, owning pid) of every spool file: scan_records.<pid>.jsonl, owned by
+        the process that wrote it, and scan_records.<pid>.jsonl.replaying.<pid2>, claimed by a
+        replay in process pid2.
+        """
+        pattern = os.path.join(self.spool_dir, "scan_records.*.jsonl")
+        files = []
+        for path in glob.glob(pattern) + glob.glob(pattern + ".replaying.*"):
+            name, _, claimed_by = path.partition(".replaying.")
+            try:
+                files.append((path, name, int(claimed_by or os.path.basename(name).split(".")[1])))
+            except ValueError:
+                continue  # scan_records.rejected.jsonl
+        return files
+
+    def _replay(self) -> None:
+        """Insert rows from this process's spool and from those of processes no longer running."""
+        for path, name, pid in self._spool_files():
+            if pid != os.getpid() and _pid_running(pid):
+                continue
+            claimed = f"{name}.replaying.{os.getpid()}"
+            with self._spool_lock:
+                try:
+                    # Atomic: of several workers replaying the same orphan, one wins the rename
+                    os.rename(path, claimed)
+                except FileNotFoundError:
+                    continue
+                try:
+                    with open(claimed, encoding="utf-8") as f:
+                        rows = [_from_json(line) for line in f if line.strip()]
+                except (OSError, ValueError) as e:
+                    logger.warning("Scan record spool %s could not be read (%s); kept for the next replay", claimed, e)
+                    continue
+                try:
+                    for i in range(0, len(rows), self.flush_size):
+                        self._insert(rows[i : i + self.flush_size])
+                except Exception as e:
+                    # Still down (or the driver failed); the claimed file is replayed again later
+                    # (by this process, or by the next one if it exits; inserts are idempotent)
+                    logger.warning("Scan record spool replay failed (%s); %d rows kept in %s", e, len(rows), claimed)
+                    return
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(claimed)
+            self.stats["replayed"] += len(rows)
+            logger.info("Replayed %d spooled scan records from %s", len(rows), path)
+
+    def snapshot(self) -> dict:
+        spooled = rejected = 0
+        for path in [path for path, _, _ in self._spool_files()] + [self.rejected_path]:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    count = sum(1 for _ in f)
+            except OSError:
+                continue
+            if path == self.rejected_path:
+                rejected += count
+            else:
+                spooled += count
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "buffered": len(self._buffer),
+            "spool_rows": spooled,
+            "rejected_rows": rejected,
+        }
+
+
+scan_record_writer = ScanRecordWriter(
+    enabled=settings.AI_SCAN_RECORD_WRITE_BEHIND,
+    flush_size=settings.AI_SCAN_RECORD_FLUSH_SIZE,
+    flush_ms=settings.AI_SCAN_RECORD_FLUSH_MS,
+    spool_dir=settings.AI_SCAN_RECORD_SPOOL_DIR,
+    replay_interval=settings.AI_SCAN_RECORD_REPLAY_INTERVAL_S,
+)
@@ -1,26 +1,56 @@
-"""Router for AI Health Scan - POST /v1/ai-scan/analyze, GET /v1/ai-scan/records."""
+"""Router for AI Health Scan - POST /v1/ai-scan/analyze, /analyze-batch, /analyze-stream, GET /v1/ai-scan/records."""
 
+import asyncio
+import json
+import time
 import uuid
 from typing import Optional
 
+import httpx
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
 from app.core.security import get_current_active_user
 from app.core.db import get_db
+from app.core.logging import logger
+from app.core.rbac import require_admin
 from app.modules.users.models import User
 from app.modules.ai_scan.schemas import (
+    HerdSummary,
     ScanAnalyzeNotCattleResponse,
     ScanAnalyzeCattleResponse,
+    ScanAnalyzeLowQualityResponse,
+    ScanBatchItem,
+    ScanBatchResponse,
     ScanRecordDto,
     ScanRecordResponse,
     ScanRecordCreate,
 )
-from app.modules.ai_scan.service import call_model_service, persist_scan_record
+from app.modules.ai_scan.cache import scan_cache
+from app.modules.ai_scan.imaging import prepare_image
+from app.modules.ai_scan.client import ModelServiceUnavailable, model_service_client
+from app.modules.ai_scan.batch import open_batch_source, parse_animal_ids, run_batch, stream_batch
+from app.modules.ai_scan.service import (
+    build_scan_record,
+    call_model_service,
+    save_scan_records,
+    scan_idempotency_key,
+    should_persist,
+)
+from app.modules.ai_scan.record_writer import scan_record_writer
+from app.modules.ai_scan.singleflight import scan_flights
 
 router = APIRouter()
 
 
+def _record_key(user_id, animal_id, digest: str, threshold: float, model_resp: dict) -> str:
+    """Idempotency key of a scan's record, under the model version that produced the result."""
+    model_version = model_resp.get("model_version") or scan_cache.current_version()
+    return scan_idempotency_key(user_id, animal_id, digest, threshold, model_version)
+
+
 def _model_to_dto(record) -> ScanRecordDto:
     return ScanRecordDto(
         id=str(record.id),
@@ -40,6 +70,10 @@ def _model_to_dto(record) -> ScanRecordDto:
 
 def _model_response_to_ui(model_resp: dict) -> dict:
     """Map model-service response to frontend schema."""
+    quality = model_resp.get("quality")
+    if quality and not quality.get("passed", True):
+        # Rejected by the model-service quality pre-gate; no model probabilities
+        return {"ok": False, "reason": "LOW_QUALITY", "issues": quality["issues"]}
     if not model_resp.get("passed_gate"):
         return {
             "ok": False,
@@ -69,7 +103,7 @@ def _model_response_to_ui(model_resp: dict) -> dict:
 
 @router.post(
     "/analyze",
-    response_model=ScanAnalyzeCattleResponse | ScanAnalyzeNotCattleResponse,
+    response_model=ScanAnalyzeCattleResponse | ScanAnalyzeNotCattleResponse | ScanAnalyzeLowQualityResponse,
 )
 async def analyze(
     image: UploadFile = File(..., description="Image file (PNG, JPG) for analysis"),
@@ -89,12 +123,39 @@ async def analyze(
     if not contents:
         raise HTTPException(400, "Empty file")
 
-    try:
-        model_resp = call_model_service(
-            contents,
-            filename=image.filename or "image.jpg",
+    # Downscale + re-encode off the event loop; the same decode gives the cache digest
+    filename = image.filename or "image.jpg"
+    prepared = await asyncio.to_thread(prepare_image, contents, filename)
+    del contents
+
+    # Repeat uploads of the same photo are served from the result cache
+    model_resp = None
+    if scan_cache.enabled:
+        model_resp = await scan_cache.get(prepared.digest, threshold)
+
+    async def infer() -> dict:
+        resp = await call_model_service(
+            prepared.contents,
+            filename=filename,
             threshold=threshold,
+            content_type=prepared.content_type,
         )
+        if scan_cache.enabled:
+            await scan_cache.set(prepared.digest, threshold, resp)
+        return resp
+
+    try:
+        if model_resp is None:
+            # Copies of the same upload already in flight (client retries) share one inference
+            model_resp = await scan_flights.do(f"{prepared.digest}|t={threshold:.4f}", infer)
+    except ModelServiceUnavailable as e:
+        raise HTTPException(503, f"Model service unavailable: {e}") from e
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 429:
+            raise HTTPException(
+                429, "Model service busy, retry shortly", headers={"Retry-After": "1"}
+            ) from e
+        raise HTTPException(503, f"Model service unavailable: {e}") from e
     except Exception as e:
         raise HTTPException(503, f"Model service unavailable: {e}") from e
 
@@ -105,33 +166,219 @@ async def analyze(
         except ValueError:
             pass
 
-    # Persistence rule: only save when sick / medium or high urgency.
-    # Do NOT persist healthy or low-urgency scans as cases/records.
-    # persist = (fmd_label == "INFECTED") OR (urgency in ["MEDIUM", "HIGH"]) OR (risk_level != "LOW")
-    # Model returns fmd.label: "INFECTED" | "HEALTHY". No urgency/risk_level in model output.
-    fmd_label = model_resp.get("fmd", {}).get("label") if model_resp.get("fmd") else None
-    should_persist = (
-        animal_uuid is not None
-        and fmd_label == "INFECTED"
-    )
-
+    # Persistence rule: only INFECTED scans linked to an animal (see should_persist).
+    # Keyed on the image content and model version, so an upload retried within the dedupe
+    # window (AI_SCAN_RECORD_DEDUPE_WINDOW_S) returns the record saved the first time.
     record_dto = None
-    if should_persist:
-        record = persist_scan_record(
-            db,
-            user_id=current_user.id,
-            model_response=model_resp,
+    if should_persist(model_resp, animal_uuid):
+        record = build_scan_record(
+            current_user.id,
+            model_resp,
             animal_id=animal_uuid,
             image_ref=image.filename,
+            idempotency_key=_record_key(current_user.id, animal_uuid, prepared.digest, threshold, model_resp),
         )
+        # Written behind the response when AI_SCAN_RECORD_WRITE_BEHIND is on
+        [record] = save_scan_records(db, [record])
         record_dto = _model_to_dto(record)
 
-    ui_result = _model_response_to_ui(model_resp)
+    return _ui_response(_model_response_to_ui(model_resp), record_dto)
+
+
+def _ui_response(ui_result: dict, record_dto: Optional[ScanRecordDto] = None):
     if ui_result["ok"]:
         return ScanAnalyzeCattleResponse(**ui_result, record=record_dto)
+    if ui_result["reason"] == "LOW_QUALITY":
+        return ScanAnalyzeLowQualityResponse(**ui_result, record=record_dto)
     return ScanAnalyzeNotCattleResponse(**ui_result, record=record_dto)
 
 
+class _HerdTally:
+    """Builds ScanBatchItem entries from batch items and rolls them up into a HerdSummary."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.analyzed = 0
+        self.failed = 0
+        self.not_cattle = 0
+        self.low_quality = 0
+        self.healthy = 0
+        self.infected = 0
+        self.cache_hits = 0
+        self.infected_animals: list[str] = []
+
+    def add(self, item: dict, record_dto: Optional[ScanRecordDto] = None) -> ScanBatchItem:
+        animal_id = str(item["animal_id"]) if item["animal_id"] else None
+        entry = ScanBatchItem(
+            index=item["index"], filename=item["filename"], animal_id=animal_id, error=item["error"]
+        )
+        resp = item["model_resp"]
+        if resp is None:
+            self.failed += 1
+            return entry
+        self.analyzed += 1
+        self.cache_hits += item["cached"]
+        ui_result = _model_response_to_ui(resp)
+        entry.result = _ui_response(ui_result, record_dto)
+        if ui_result["ok"]:
+            if ui_result["diagnosis"]["condition"] == "FOOT_AND_MOUTH_DISEASE":
+                self.infected += 1
+                if animal_id:
+                    self.infected_animals.append(animal_id)
+            else:
+                self.healthy += 1
+        elif ui_result["reason"] == "LOW_QUALITY":
+            self.low_quality += 1
+        else:
+            self.not_cattle += 1
+        return entry
+
+    def summary(self, total: int, records_saved: int) -> HerdSummary:
+        diagnosed = self.healthy + self.infected
+        return HerdSummary(
+            total=total,
+            analyzed=self.analyzed,
+            failed=self.failed,
+            not_cattle=self.not_cattle,
+            low_quality=self.low_quality,
+            healthy=self.healthy,
+            infected=self.infected,
+            prevalence=self.infected / diagnosed if diagnosed else None,
+            infected_animal_ids=self.infected_animals,
+            records_saved=records_saved,
+            cache_hits=self.cache_hits,
+            elapsed_ms=(time.perf_counter() - self.t0) * 1000,
+        )
+
+
+def _records_to_save(items: list[dict], user_id, threshold: float) -> list[tuple[int, object]]:
+    """(index, unsaved ScanRecord) for the items that qualify under should_persist."""
+    to_save = []
+    for item in items:
+        resp = item["model_resp"]
+        if resp is not None and should_persist(resp, item["animal_id"]):
+            key = _record_key(user_id, item["animal_id"], item["digest"], threshold, resp)
+            record = build_scan_record(user_id, resp, item["animal_id"], item["filename"], key)
+            to_save.append((item["index"], record))
+    return to_save
+
+
+@router.post("/analyze-batch", response_model=ScanBatchResponse)
+async def analyze_batch(
+    images: list[UploadFile] = File([], description="Image files (PNG, JPG)"),
+    archive: Optional[UploadFile] = File(None, description="Zip of images (alternative to images)"),
+    threshold: float = Form(0.5, description="Cattle detection threshold"),
+    animal_ids: Optional[str] = Form(
+        None,
+        description="JSON list of animal IDs by upload position, or object keyed by filename",
+    ),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Herd screening: analyze many images in one request (multipart files and/or a zip).
+    Images are streamed to the model-service in chunks; qualifying records are saved with one
+    bulk insert. Returns per-image results (in upload order) plus a herd summary.
+    """
+    tally = _HerdTally()
+    mapping = parse_animal_ids(animal_ids)
+    total, source = await open_batch_source(images, archive)
+    items = await run_batch(source, threshold, mapping)
+
+    to_save = _records_to_save(items, current_user.id, threshold)
+    saved = save_scan_records(db, [record for _, record in to_save])
+    record_dtos = {index: _model_to_dto(record) for (index, _), record in zip(to_save, saved)}
+
+    results = [tally.add(item, record_dtos.get(item["index"])) for item in items]
+    return ScanBatchResponse(results=results, summary=tally.summary(total, len(saved)))
+
+
+@router.post("/analyze-stream")
+async def analyze_stream(
+    images: list[UploadFile] = File([], description="Image files (PNG, JPG)"),
+    archive: Optional[UploadFile] = File(None, description="Zip of images (alternative to images)"),
+    threshold: float = Form(0.5, description="Cattle detection threshold"),
+    animal_ids: Optional[str] = Form(
+        None,
+        description="JSON list of animal IDs by upload position, or object keyed by filename",
+    ),
+    format: str = Form("sse", description="sse (text/event-stream) or ndjson"),
+    current_user: User = Depends(get_current_active_user),
+    db: Session = Depends(get_db),
+):
+    """
+    Streaming variant of /analyze-batch for large uploads: each image's result is sent as soon
+    as it is ready (completion order; use `index` to place it), followed by the saved records
+    and the herd summary.
+
+    Events: `result` (ScanBatchItem, record not yet attached), then `records`
+    ({"records": [{"index", "record"}]}) and `summary` (HerdSummary).
+    If the client disconnects, unfinished images are cancelled and nothing is saved.
+    """
+    if format not in ("sse", "ndjson"):
+        raise HTTPException(400, "format must be 'sse' or 'ndjson'")
+    tally = _HerdTally()
+    mapping = parse_animal_ids(animal_ids)
+    total, source = await open_batch_source(images, archive)
+
+    def event(name: str, data: dict) -> str:
+        if format == "sse":
+            return f"event: {name}\ndata: {json.dumps(data)}\n\n"
+        return json.dumps({"event": name, "data": data}) + "\n"
+
+    async def events():
+        finished = []
+        results = stream_batch(source, threshold, mapping)
+        try:
+            async for item in results:
+                finished.append(item)
+                yield event("result", tally.add(item).model_dump(mode="json"))
+        finally:
+            await results.aclose()
+
+        to_save = _records_to_save(finished, current_user.id, threshold)
+        saved = save_scan_records(db, [record for _, record in to_save])
+        records = [
+            {"index": index, "record": _model_to_dto(record).model_dump(mode="json")}
+            for (index, _), record in zip(to_save, saved)
+        ]
+        yield event("records", {"records": records})
+        yield event("summary", tally.summary(total, len(saved)).model_dump(mode="json"))
+        if tally.failed:
+            logger.info("AI scan stream: %d of %d images failed", tally.failed, total)
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        events(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/cache-stats")
+async def scan_cache_stats(
+    current_user: User = Depends(require_admin),
+):
+    """Admin: hit/miss counters of this worker's scan result cache, and coalesced scans."""
+    return {**scan_cache.snapshot(), "singleflight": scan_flights.snapshot()}
+
+
+@router.get("/replicas")
+async def model_service_replicas(
+    current_user: User = Depends(require_admin),
+):
+    """Admin: model-service replicas as seen by this worker (health, circuit, load, hedging)."""
+    return {"backend": settings.AI_SCAN_INFERENCE_BACKEND, **model_service_client.snapshot()}
+
+
+@router.get("/record-writer")
+async def scan_record_writer_stats(
+    current_user: User = Depends(require_admin),
+):
+    """Admin: this worker's write-behind scan record writer (buffered, spooled, inserted rows)."""
+    return scan_record_writer.snapshot()
+
+
 @router.get("/records", response_model=list[ScanRecordDto])
 async def list_scan_records(
     limit: int = 50,
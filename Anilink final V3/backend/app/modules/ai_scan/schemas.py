@@ -56,6 +56,15 @@ class ScanAnalyzeNotCattleResponse(BaseModel):
     record: Optional[ScanRecordDto] = None
 
 
+class ScanAnalyzeLowQualityResponse(BaseModel):
+    """Response when the photo is too dark, bright, blurry, small or uniform to analyze."""
+
+    ok: Literal[False] = False
+    reason: Literal["LOW_QUALITY"] = "LOW_QUALITY"
+    issues: list[Literal["too_small", "too_dark", "too_bright", "blurry", "uniform"]]
+    record: Optional[ScanRecordDto] = None
+
+
 class ScanAnalyzeDiagnosis(BaseModel):
     """FMD diagnosis when cattle is detected."""
 
@@ -72,3 +81,39 @@ class ScanAnalyzeCattleResponse(BaseModel):
     probCattle: float
     diagnosis: ScanAnalyzeDiagnosis
     record: Optional[ScanRecordDto] = None
+
+
+class ScanBatchItem(BaseModel):
+    """Per-image result of POST /v1/ai-scan/analyze-batch (result or error)."""
+
+    index: int
+    filename: Optional[str] = None
+    animal_id: Optional[str] = None
+    result: Optional[
+        ScanAnalyzeCattleResponse | ScanAnalyzeNotCattleResponse | ScanAnalyzeLowQualityResponse
+    ] = None
+    error: Optional[str] = None
+
+
+class HerdSummary(BaseModel):
+    """Herd-level roll-up of a batch scan."""
+
+    total: int
+    analyzed: int
+    failed: int
+    not_cattle: int
+    low_quality: int = 0
+    healthy: int
+    infected: int
+    prevalence: Optional[float] = None  # infected / (healthy + infected)
+    infected_animal_ids: list[str] = []
+    records_saved: int
+    cache_hits: int
+    elapsed_ms: float
+
+
+class ScanBatchResponse(BaseModel):
+    """Response of POST /v1/ai-scan/analyze-batch."""
+
+    results: list[ScanBatchItem]
+    summary: HerdSummary
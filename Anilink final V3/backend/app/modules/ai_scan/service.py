@@ -1,45 +1,117 @@
 """AI Scan service: calls model-service and persists results."""
 
+import hashlib
 import json
+import time
 import uuid
-from typing import Optional
+from typing import AsyncIterator, Optional
 
-import httpx
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
 from sqlalchemy.orm import Session
 
 from app.core.config import settings
+from app.modules.ai_scan.client import model_service_client
+from app.modules.ai_scan.in_process import in_process_inference
 from app.modules.ai_scan.models import ScanRecord
+from app.modules.ai_scan.record_writer import scan_record_writer
+from app.modules.animals.models import Animal
+
+INFERENCE_BACKENDS = {"http": model_service_client, "in_process": in_process_inference}
+if settings.AI_SCAN_INFERENCE_BACKEND not in INFERENCE_BACKENDS:
+    raise ValueError(
+        f"Unknown AI_SCAN_INFERENCE_BACKEND: {settings.AI_SCAN_INFERENCE_BACKEND}. "
+        f"Choose one of {tuple(INFERENCE_BACKENDS)}"
+    )
+# Both expose infer / infer_batch / infer_stream with the model-service's response shapes
+inference_client = INFERENCE_BACKENDS[settings.AI_SCAN_INFERENCE_BACKEND]
+
+# Records with an idempotency key get an id derived from it, so every copy of a retried scan
+# refers to the same record, also before the write-behind writer has inserted it
+_RECORD_ID_NAMESPACE = uuid.UUID("5b0a7c1e-3f0e-4d5c-9a51-6f2d1c0e8b47")
 
 
-def call_model_service(
+async def call_model_service(
     file_contents: bytes,
     filename: str,
     threshold: float = 0.5,
+    content_type: str = "image/jpeg",
 ) -> dict:
     """
-    Call model-service POST /infer with the image file.
+    Call model-service POST /infer with the image file over the shared pooled client
+    (or run it in this process with AI_SCAN_INFERENCE_BACKEND=in_process).
     Returns model-service response dict.
     """
-    url = f"{settings.MODEL_SERVICE_URL.rstrip('/')}/infer"
-    files = {"file": (filename, file_contents, "image/jpeg")}
-    data = {"threshold": str(threshold)}
+    return await inference_client.infer(file_contents, filename, threshold, content_type)
+
+
+async def call_model_service_batch(
+    images: list[tuple[str, bytes, str]],
+    threshold: float = 0.5,
+) -> list[dict]:
+    """
+    Call model-service POST /infer-batch with several (filename, contents, content_type) images.
+    Returns one response dict per image ({"ok": False, "error": ...} for failed images).
+    """
+    return await inference_client.infer_batch(images, threshold)
+
 
-    with httpx.Client(timeout=30.0) as client:
-        resp = client.post(url, files=files, data=data)
-        resp.raise_for_status()
-        return resp.json()
+def stream_model_service_batch(
+    images: list[tuple[str, bytes, str]],
+    threshold: float = 0.5,
+) -> AsyncIterator[tuple[int, dict]]:
+    """Call model-service POST /infer-stream; yields (index, response dict) as images finish."""
+    return inference_client.infer_stream(images, threshold)
 
 
-def persist_scan_record(
-    db: Session,
+def should_persist(model_response: dict, animal_id: Optional[uuid.UUID]) -> bool:
+    """
+    Persistence rule: only save when sick / medium or high urgency.
+    Do NOT persist healthy or low-urgency scans as cases/records.
+    persist = (fmd_label == "INFECTED") OR (urgency in ["MEDIUM", "HIGH"]) OR (risk_level != "LOW")
+    Model returns fmd.label: "INFECTED" | "HEALTHY". No urgency/risk_level in model output.
+    """
+    fmd_label = model_response.get("fmd", {}).get("label") if model_response.get("fmd") else None
+    return animal_id is not None and fmd_label == "INFECTED"
+
+
+def unowned_animal_ids(db: Session, user_id: uuid.UUID, animal_ids) -> set[uuid.UUID]:
+    """Animal ids that do not exist or do not belong to user_id (one query)."""
+    wanted = {animal_id for animal_id in animal_ids if animal_id is not None}
+    if not wanted:
+        return set()
+    owned = db.query(Animal.id).filter(Animal.id.in_(wanted), Animal.owner_user_id == user_id).all()
+    return wanted - {animal_id for (animal_id,) in owned}
+
+
+def scan_idempotency_key(
+    user_id: uuid.UUID,
+    animal_id: Optional[uuid.UUID],
+    digest: str,
+    threshold: float,
+    model_version: Optional[str],
+    at: Optional[float] = None,
+) -> str:
+    """
+    Record key of a scan: the same user, animal, image content, threshold and model version
+    within one AI_SCAN_RECORD_DEDUPE_WINDOW_S time bucket save one record, so retries and
+    concurrent copies of an upload collapse while a later rescan (or one after a model swap)
+    saves its own. Buckets are fixed, so a retry crossing a bucket edge saves a second record.
+    """
+    bucket = int((time.time() if at is None else at) // settings.AI_SCAN_RECORD_DEDUPE_WINDOW_S)
+    raw = f"{user_id}|{animal_id}|{digest}|t={threshold:.4f}|m={model_version or 'unknown'}|w={bucket}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def build_scan_record(
     user_id: uuid.UUID,
     model_response: dict,
     animal_id: Optional[uuid.UUID] = None,
     image_ref: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
 ) -> ScanRecord:
-    """Save scan result to DB."""
-    record = ScanRecord(
-        id=uuid.uuid4(),
+    """ScanRecord for a model-service response (not yet added to a session)."""
+    return ScanRecord(
+        id=uuid.uuid5(_RECORD_ID_NAMESPACE, idempotency_key) if idempotency_key else uuid.uuid4(),
         user_id=user_id,
         animal_id=animal_id,
         scan_type="FMD_SCAN",
@@ -52,8 +124,127 @@ def persist_scan_record(
         fmd_confidence=model_response.get("fmd", {}).get("confidence") if model_response.get("fmd") else None,
         raw_json=model_response,
         image_ref=image_ref,
+        idempotency_key=idempotency_key,
     )
+
+
+def _records_by_key(db: Session, keys: list[str]) -> dict[str, ScanRecord]:
+    if not keys:
+        return {}
+    existing = db.query(ScanRecord).filter(ScanRecord.idempotency_key.in_(keys)).all()
+    return {record.idempotency_key: record for record in existing}
+
+
+def persist_scan_record(
+    db: Session,
+    user_id: uuid.UUID,
+    model_response: dict,
+    animal_id: Optional[uuid.UUID] = None,
+    image_ref: Optional[str] = None,
+    idempotency_key: Optional[str] = None,
+) -> ScanRecord:
+    """
+    Save scan result to DB. With an idempotency_key, a record already saved under that key
+    (an earlier copy of a retried upload) is returned instead of inserting a duplicate.
+    """
+    if idempotency_key is not None:
+        existing = _records_by_key(db, [idempotency_key]).get(idempotency_key)
+        if existing is not None:
+            return existing
+    record = build_scan_record(user_id, model_response, animal_id, image_ref, idempotency_key)
     db.add(record)
-    db.commit()
+    try:
+        db.commit()
+    except IntegrityError:
+        # A concurrent copy inserted the same key first
+        db.rollback()
+        existing = _records_by_key(db, [idempotency_key]).get(idempotency_key) if idempotency_key else None
+        if existing is None:
+            raise
+        return existing
     db.refresh(record)
     return record
+
+
+def persist_scan_records(db: Session, records: list[ScanRecord]) -> list[ScanRecord]:
+    """
+    Save many scan records in one transaction: the ORM batches them into a multi-row INSERT,
+    and one SELECT reloads them all (instead of a refresh per record).
+    Records whose idempotency_key is already saved (or repeated within the batch) are not
+    inserted again; the existing record is returned in their place.
+    """
+    if not records:
+        return []
+    existing = _records_by_key(db, [r.idempotency_key for r in records if r.idempotency_key is not None])
+    new, targets = [], []  # targets: id of the record each input resolves to
+    for record in records:
+        key = record.idempotency_key
+        if key is not None and key in existing:
+            targets.append(existing[key].id)
+            continue
+        new.append(record)
+        targets.append(record.id)
+        if key is not None:
+            existing[key] = record
+    if new:
+        db.add_all(new)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Raced with a concurrent upload of the same images: save them one at a time
+            db.rollback()
+            return [
+                persist_scan_record(db, r.user_id, r.raw_json, r.animal_id, r.image_ref, r.idempotency_key)
+                for r in records
+            ]
+    loaded = {r.id: r for r in db.query(ScanRecord).filter(ScanRecord.id.in_(set(targets))).all()}
+    return [loaded[record_id] for record_id in targets]
+
+
+def _write_behind_allowed(db: Session, records: list[ScanRecord]) -> bool:
+    """
+    The writer only gets records whose insert cannot be rejected later: every linked animal
+    must exist and belong to the record's user. If that cannot be checked, save inline.
+    """
+    try:
+        return not any(
+            unowned_animal_ids(db, user_id, [r.animal_id for r in records if r.user_id == user_id])
+            for user_id in {r.user_id for r in records}
+        )
+    except SQLAlchemyError:
+        db.rollback()
+        return False
+
+
+def save_scan_records(db: Session, records: list[ScanRecord]) -> list[ScanRecord]:
+    """
+    Save scan records without waiting on the database when the write-behind writer is running
+    (AI_SCAN_RECORD_WRITE_BEHIND): new records are returned as built, with final ids, and
+    inserted shortly after. Otherwise, or when the animals of new records fail validation (the
+    only place scan animals are checked, so only records that are saved cost the query), they
+    are committed inline (persist_scan_records), so database errors reach the caller.
+    As with persist_scan_records, a record whose idempotency_key is already saved (or still
+    waiting in the writer, or repeated within the batch) is not written again; the earlier
+    record is returned in its place.
+    """
+    if not records:
+        return []
+    if not scan_record_writer.running:
+        return persist_scan_records(db, records)
+    keys = [r.idempotency_key for r in records if r.idempotency_key is not None]
+    known = {**scan_record_writer.pending(keys), **_records_by_key(db, keys)}
+    saved, new = [], []
+    for record in records:
+        key = record.idempotency_key
+        if key is not None and key in known:
+            saved.append(known[key])
+            continue
+        new.append(record)
+        saved.append(record)
+        if key is not None:
+            known[key] = record
+    if new and not _write_behind_allowed(db, new):
+        return persist_scan_records(db, records)
+    if new:
+        scan_record_writer.submit(new)
+    return saved
@@ -0,0 +1,48 @@
+"""
+Request coalescing for identical concurrent scans (per worker process).
+A flaky mobile connection often delivers the same photo two or three times within a second;
+the first request runs the inference and later ones with the same key attach to it and share
+its result (or its exception) instead of running the models again.
+
+The call runs as its own task, so the requests waiting on it (including the one that started
+it) can disconnect without cancelling it for the others.
+"""
+
+import asyncio
+from typing import Awaitable, Callable
+
+
+class SingleFlight:
+    """At most one in-flight call per key; concurrent callers with that key share its outcome."""
+
+    def __init__(self):
+        self._calls: dict[str, asyncio.Task] = {}
+        self.stats = {"calls": 0, "coalesced": 0}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable]):
+        task = self._calls.get(key)
+        if task is None:
+            self.stats["calls"] += 1
+            task = asyncio.create_task(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    def _done(self, key: str, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception retrieved even when every waiter has gone away
+        if not task.cancelled():
+            task.exception()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": self.in_flight}
+
+
+scan_flights = SingleFlight()
@@ -0,0 +1,285 @@
+"""
+Dynamic micro-batching for POST /infer.
+Concurrent uploads are collected for up to BATCH_WINDOW_MS (or BATCH_MAX_SIZE images),
+run through the model as one batch on the inference executor, and each waiting request
+gets its own result back. At most `concurrency` batches run at once; while all workers are
+busy, new requests queue up (bounded by `max_queue`) and form the next, larger batch.
+
+Priority lanes (e.g. interactive scans vs bulk re-scoring): each lane has its own bounded
+queue, a weight, a cap on the batches it may have running at once and a queue-time deadline.
+A batch holds images of one lane only. When a worker frees up, the next lane is chosen by
+start-time fair queuing on images served / weight, so a backlogged bulk lane gets 1/(w+1) of
+the workers while interactive requests are waiting, and everything when they are not. A lane
+may also use smaller batches, which bounds how long a request waits behind a batch already
+running when no worker is reserved for it. Images
+that waited longer than their lane's deadline are failed with DeadlineExceededError instead of
+being run (the client is expected to retry).
+"""
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+class QueueFullError(Exception):
+    """Raised by submit() when max_queue requests are already waiting."""
+
+
+class DeadlineExceededError(QueueFullError):
+    """A queued image waited longer than its lane's deadline and was shed without running."""
+
+
+@dataclass(frozen=True)
+class Lane:
+    """Priority class: scheduling weight, running-batch cap, queue bound and queue-time deadline."""
+
+    name: str
+    weight: float = 1.0
+    max_concurrency: int = 0  # 0 = up to the batcher's concurrency
+    max_queue: int = 64
+    deadline_ms: float = 0  # 0 = wait indefinitely
+    max_batch_size: int = 0  # 0 = the batcher's max_batch_size
+
+
+class _LaneState:
+    def __init__(self, lane: Lane):
+        self.lane = lane
+        self.items: deque = deque()
+        self.running = 0
+        self.start_tag = 0.0  # virtual start time of the lane's next batch (fair queuing)
+        self.arrived = asyncio.Event()
+
+
+class MicroBatcher:
+    """Collects (image, threshold) requests into batches and runs them on an executor."""
+
+    def __init__(
+        self,
+        run_batch: Callable[[list[bytes], list[float]], list],
+        executor: Optional[Executor] = None,
+        max_batch_size: int = 8,
+        window_ms: float = 10.0,
+        max_queue: int = 64,
+        concurrency: int = 1,
+        on_batch: Optional[Callable[[list, str], None]] = None,
+        lanes: Optional[list[Lane]] = None,
+    ):
+        self.run_batch = run_batch
+        self.on_batch = on_batch
+        self.executor = executor
+        self.max_batch_size = max(1, max_batch_size)
+        self.window = max(0.0, window_ms) / 1000
+        self.concurrency = max(1, concurrency)
+        # Without lanes, one lane with the plain FIFO behaviour
+        self.lanes = lanes or [Lane("default", max_queue=max(1, max_queue))]
+        self.default_lane = self.lanes[0].name
+        self._states: dict[str, _LaneState] = {}
+        self._vtime = 0.0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._reaper: Optional[asyncio.Task] = None
+        self._running: set[asyncio.Task] = set()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(state.items) for state in self._states.values())
+
+    def lane_depths(self) -> dict[str, int]:
+        return {name: len(state.items) for name, state in self._states.items()}
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._running)
+
+    async def start(self) -> None:
+        self._states = {lane.name: _LaneState(lane) for lane in self.lanes}
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._task = asyncio.create_task(self._dispatch_loop())
+        deadlines = [lane.deadline_ms for lane in self.lanes if lane.deadline_ms > 0]
+        if deadlines:
+            self._reaper = asyncio.create_task(self._reap_loop(min(deadlines) / 1000))
+
+    async def stop(self) -> None:
+        for task in (self._task, self._reaper):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._reaper = None
+        if self._running:
+            await asyncio.gather(*self._running, return_exceptions=True)
+
+    def _lane(self, priority: Optional[str]) -> _LaneState:
+        state = self._states.get(priority or self.default_lane)
+        if state is None:
+            raise ValueError(f"Unknown priority: {priority}. Choose one of {tuple(self._states)}")
+        return state
+
+    def _put(self, state: _LaneState, items: list[tuple[bytes, float]]) -> list[asyncio.Future]:
+        if not state.items:
+            # An idle lane re-enters at the current virtual time, without banked credit
+            state.start_tag = max(state.start_tag, self._vtime)
+        loop = asyncio.get_running_loop()
+        now = time.perf_counter()
+        futures = []
+        for image_bytes, threshold in items:
+            future = loop.create_future()
+            state.items.append((image_bytes, threshold, future, now))
+            futures.append(future)
+        state.arrived.set()
+        self._wakeup.set()
+        return futures
+
+    async def submit(self, image_bytes: bytes, threshold: float, priority: Optional[str] = None) -> dict:
+        """Queue one image and wait for its result. Raises QueueFullError when saturated."""
+        state = self._lane(priority)
+        if len(state.items) >= state.lane.max_queue:
+            raise QueueFullError(
+                f"Inference queue full ({state.lane.max_queue} waiting, {state.lane.name})"
+            )
+        return await self._put(state, [(image_bytes, threshold)])[0]
+
+    def enqueue_many(
+        self, items: list[tuple[bytes, float]], priority: Optional[str] = None
+    ) -> list[asyncio.Future]:
+        """
+        Queue several (image, threshold) pairs at once; returns one future per item, in order.
+        All-or-nothing: raises QueueFullError unless the queue has room for every item.
+        Cancelling a future before its batch is dispatched drops the item without running it.
+        """
+        state = self._lane(priority)
+        free = state.lane.max_queue - len(state.items)
+        if len(items) > free:
+            raise QueueFullError(
+                f"Inference queue full ({free} free, {len(items)} requested, {state.lane.name})"
+            )
+        return self._put(state, items)
+
+    async def submit_many(self, items: list[tuple[bytes, float]], priority: Optional[str] = None) -> list:
+        """Queue several items (see enqueue_many) and wait for all: one result or exception each."""
+        futures = self.enqueue_many(items, priority)
+        return await asyncio.gather(*futures, return_exceptions=True)
+
+    def _shed_expired(self, state: _LaneState) -> None:
+        """Fail queued images past the lane deadline (FIFO, so they are all at the head)."""
+        if state.lane.deadline_ms <= 0:
+            return
+        cutoff = time.perf_counter() - state.lane.deadline_ms / 1000
+        while state.items and state.items[0][3] < cutoff:
+            _, _, future, enqueued = state.items.popleft()
+            if not future.done():
+                waited = time.perf_counter() - enqueued
+                future.set_exception(
+                    DeadlineExceededError(
+                        f"Shed after {waited:.1f}s in the {state.lane.name} queue "
+                        f"(deadline {state.lane.deadline_ms / 1000:g}s)"
+                    )
+                )
+
+    async def _reap_loop(self, deadline: float) -> None:
+        # Shed promptly even while every worker is busy and nothing is being dispatched
+        interval = min(1.0, max(0.05, deadline / 10))
+        while True:
+            await asyncio.sleep(interval)
+            for state in self._states.values():
+                self._shed_expired(state)
+
+    def _pop(self, state: _LaneState) -> Optional[tuple]:
+        """Next live item of the lane: cancelled requests and expired images are dropped."""
+        self._shed_expired(state)
+        while state.items:
+            item = state.items.popleft()
+            if not item[2].done():
+                return item
+        return None
+
+    def _next_lane(self) -> Optional[_LaneState]:
+        """Eligible lane (work queued, under its running cap) with the earliest virtual start."""
+        best = None
+        for state in self._states.values():
+            self._shed_expired(state)
+            cap = state.lane.max_concurrency or self.concurrency
+            if not state.items or state.running >= cap:
+                continue
+            if best is None or state.start_tag < best.start_tag:
+                best = state
+        return best
+
+    async def _collect(self, state: _LaneState) -> list:
+        """Take the lane's first request, then gather more until the window closes or the batch is full."""
+        batch = []
+        limit = min(state.lane.max_batch_size or self.max_batch_size, self.max_batch_size)
+        deadline = time.perf_counter() + self.window
+        while len(batch) < limit:
+            item = self._pop(state)
+            if item is not None:
+                batch.append(item)
+                continue
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not batch:
+                break
+            state.arrived.clear()
+            try:
+                await asyncio.wait_for(state.arrived.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _dispatch_loop(self) -> None:
+        while True:
+            # Only start collecting once a worker is free, so queued requests batch together
+            await self._slots.acquire()
+            try:
+                while True:
+                    state = self._next_lane()
+                    if state is not None:
+                        break
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                state.running += 1
+                batch = await self._collect(state)
+            except BaseException:
+                self._slots.release()
+                raise
+            if not batch:
+                state.running -= 1
+                self._slots.release()
+                continue
+            # Charge the lane for the images it is about to run
+            self._vtime = state.start_tag
+            state.start_tag += len(batch) / state.lane.weight
+            task = asyncio.create_task(self._run(state, batch))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, state: _LaneState, batch: list) -> None:
+        loop = asyncio.get_running_loop()
+        images = [item[0] for item in batch]
+        thresholds = [item[1] for item in batch]
+        dispatched = time.perf_counter()
+        try:
+            results = await loop.run_in_executor(self.executor, self.run_batch, images, thresholds)
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            state.running -= 1
+            self._slots.release()
+            # A lane at its running cap may be eligible again
+            self._wakeup.set()
+        for (_, _, future, enqueued), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                result["timings_ms"]["queue"] = (dispatched - enqueued) * 1000
+                future.set_result(result)
+        if self.on_batch is not None:
+            self.on_batch(results, state.lane.name)
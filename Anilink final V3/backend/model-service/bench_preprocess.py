@@ -0,0 +1,113 @@
+"""
+Micro-benchmark: preprocessing engine (utils.load_and_preprocess) vs the original
+full-decode implementation, on 1-12 MP phone-size JPEGs.
+
+Reports median/p95 latency per image size and the max absolute difference of the
+output tensor against the original (draft decode on and off).
+
+Usage:
+    python bench_preprocess.py                 # synthetic photos, 1/3/8/12 MP
+    python bench_preprocess.py --images DIR    # real photos (*.jpg, *.jpeg, *.png)
+    python bench_preprocess.py --repeat 50
+"""
+
+import argparse
+import glob
+import io
+import os
+import statistics
+import time
+
+import numpy as np
+from PIL import Image
+
+from utils import IMAGE_SIZE, MEAN, STD, load_and_preprocess
+
+# Typical phone camera resolutions (4:3)
+PHOTO_SIZES = {
+    "1MP": (1152, 864),
+    "3MP": (2048, 1536),
+    "8MP": (3264, 2448),
+    "12MP": (4032, 3024),
+}
+
+
+def reference_preprocess(image_bytes: bytes) -> np.ndarray:
+    """The original implementation: full-resolution decode, then separate NumPy passes."""
+    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
+    img = img.resize((IMAGE_SIZE, IMAGE_SIZE))
+    img_array = np.array(img).astype(np.float32) / 255.0
+    img_array = (img_array - MEAN) / STD
+    img_array = np.transpose(img_array, (2, 0, 1))
+    img_array = np.expand_dims(img_array, axis=0)
+    return img_array.astype(np.float32)
+
+
+def synthetic_photo(width: int, height: int, seed: int = 0) -> bytes:
+    """Photo-like JPEG: smooth colour fields plus sensor-like noise, quality 90."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(height // 64 + 1, width // 64 + 1, 3), dtype=np.uint8)
+    img = Image.fromarray(coarse).resize((width, height), Image.Resampling.BICUBIC)
+    pixels = np.asarray(img, dtype=np.int16) + rng.integers(-12, 13, size=(height, width, 3))
+    buf = io.BytesIO()
+    Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).save(buf, "JPEG", quality=90)
+    return buf.getvalue()
+
+
+def _time(fn, repeat: int) -> list[float]:
+    fn()  # warm-up
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _p95(samples: list[float]) -> float:
+    return sorted(samples)[max(0, int(round(0.95 * len(samples))) - 1)]
+
+
+def bench(name: str, image_bytes: bytes, repeat: int) -> None:
+    ref = reference_preprocess(image_bytes)
+    out = np.empty((1, 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32)
+    diff_exact = float(np.abs(load_and_preprocess(image_bytes, draft=False) - ref).max())
+    diff_draft = float(np.abs(load_and_preprocess(image_bytes, draft=True) - ref).max())
+
+    ref_ms = _time(lambda: reference_preprocess(image_bytes), repeat)
+    exact_ms = _time(lambda: load_and_preprocess(image_bytes, out=out, draft=False), repeat)
+    draft_ms = _time(lambda: load_and_preprocess(image_bytes, out=out, draft=True), repeat)
+
+    ref_med = statistics.median(ref_ms)
+    print(
+        f"{name:>14} {len(image_bytes) / 1e6:6.2f}MB | "
+        f"original {ref_med:7.1f} / {_p95(ref_ms):7.1f} | "
+        f"fused {statistics.median(exact_ms):7.1f} / {_p95(exact_ms):7.1f} (diff {diff_exact:.1e}) | "
+        f"draft {statistics.median(draft_ms):7.1f} / {_p95(draft_ms):7.1f} (diff {diff_draft:.2f}) | "
+        f"x{ref_med / statistics.median(draft_ms):.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model-service image preprocessing")
+    parser.add_argument("--images", help="Directory of real photos instead of synthetic ones")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per image")
+    args = parser.parse_args()
+
+    print("times in ms, median / p95; diff = max abs difference vs original output tensor")
+    if args.images:
+        paths = sorted(
+            p for ext in ("*.jpg", "*.jpeg", "*.png") for p in glob.glob(os.path.join(args.images, ext))
+        )
+        if not paths:
+            raise SystemExit(f"No images found in {args.images}")
+        for path in paths:
+            with open(path, "rb") as f:
+                bench(os.path.basename(path)[:14], f.read(), args.repeat)
+    else:
+        for name, (width, height) in PHOTO_SIZES.items():
+            bench(name, synthetic_photo(width, height), args.repeat)
+
+
+if __name__ == "__main__":
+    main()
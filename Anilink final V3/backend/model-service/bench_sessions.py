@@ -0,0 +1,116 @@
+"""
+Sweep ONNX Runtime session settings for one model and report, per setting:
+load time (cold, and with the optimized-graph cache warm), warm-up time, first-run latency
+and steady-state p50/p95 latency. Use it to pick ORT_* values for model-service/main.py.
+
+Usage:
+    python bench_sessions.py --model ../models/cattle_detection.onnx
+    python bench_sessions.py --model ../models/fmd_detection.onnx --threads 1 2 4 \
+        --levels basic all --runs 300 --report sweep.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+from sessions import EXECUTION_MODES, GRAPH_OPTIMIZATION_LEVELS, SessionConfig, create_session
+
+
+def _p95(samples: list[float]) -> float:
+    return sorted(samples)[max(0, int(round(0.95 * len(samples))) - 1)]
+
+
+def _input(session, batch: int) -> tuple[str, np.ndarray]:
+    inp = session.get_inputs()[0]
+    shape = [d if isinstance(d, int) and d > 0 else batch for d in inp.shape]
+    x = np.random.default_rng(0).normal(size=shape).astype(np.float32)
+    return inp.name, x
+
+
+def measure(model_path: str, config: SessionConfig, runs: int) -> dict:
+    cache_dir = tempfile.mkdtemp(prefix="ort-opt-")
+    try:
+        # Cold load without warm-up, so the first run shows the lazy-initialization cost
+        cold = SessionConfig(**{**config.__dict__, "optimized_model_dir": cache_dir, "warmup_runs": 0})
+        session, cold_stats = create_session(model_path, cold)
+        name, x = _input(session, 1)
+        t0 = time.perf_counter()
+        session.run(None, {name: x})
+        first_run_ms = (time.perf_counter() - t0) * 1000
+        del session
+
+        # Second load reads the optimized graph written by the first one, then warms up
+        cached = SessionConfig(**{**config.__dict__, "optimized_model_dir": cache_dir})
+        session, cached_stats = create_session(model_path, cached)
+        samples = []
+        for _ in range(runs):
+            t0 = time.perf_counter()
+            session.run(None, {name: x})
+            samples.append((time.perf_counter() - t0) * 1000)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    return {
+        "load_cold_ms": cold_stats["load_ms"],
+        "load_cached_ms": cached_stats["load_ms"],
+        "warmup_ms": cached_stats["warmup_ms"],
+        "first_run_ms": round(first_run_ms, 2),
+        "p50_ms": round(statistics.median(samples), 3),
+        "p95_ms": round(_p95(samples), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep ORT session options for a model")
+    parser.add_argument("--model", required=True, help=".onnx model to load")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, os.cpu_count() or 1])
+    parser.add_argument("--levels", nargs="+", choices=GRAPH_OPTIMIZATION_LEVELS, default=["basic", "all"])
+    parser.add_argument("--modes", nargs="+", choices=EXECUTION_MODES, default=["sequential"])
+    parser.add_argument("--mem-pattern", nargs="+", choices=("on", "off"), default=["on"])
+    parser.add_argument("--arena", nargs="+", choices=("on", "off"), default=["on", "off"])
+    parser.add_argument("--warmup-runs", type=int, default=2)
+    parser.add_argument("--runs", type=int, default=200, help="Timed steady-state runs")
+    parser.add_argument("--report", help="Write results as JSON")
+    args = parser.parse_args()
+
+    results = []
+    header = (
+        f"{'threads':>7} {'level':>8} {'mode':>10} {'mem':>4} {'arena':>5} | "
+        f"{'load':>7} {'cached':>7} {'warmup':>7} {'first':>7} | {'p50':>7} {'p95':>7}"
+    )
+    print(f"{args.model} (times in ms)")
+    print(header)
+    print("-" * len(header))
+    for threads, level, mode, mem, arena in itertools.product(
+        sorted(set(args.threads)), args.levels, args.modes, args.mem_pattern, args.arena
+    ):
+        config = SessionConfig(
+            intra_op_threads=threads,
+            execution_mode=mode,
+            graph_optimization=level,
+            enable_mem_pattern=mem == "on",
+            enable_cpu_mem_arena=arena == "on",
+            warmup_runs=args.warmup_runs,
+        )
+        r = measure(args.model, config, args.runs)
+        results.append({"config": {k: v for k, v in config.__dict__.items() if k != "optimized_model_dir"}, **r})
+        print(
+            f"{threads:>7} {level:>8} {mode:>10} {mem:>4} {arena:>5} | "
+            f"{r['load_cold_ms']:>7.1f} {r['load_cached_ms']:>7.1f} {r['warmup_ms']:>7.1f} "
+            f"{r['first_run_ms']:>7.1f} | {r['p50_ms']:>7.2f} {r['p95_ms']:>7.2f}"
+        )
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump({"model": args.model, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
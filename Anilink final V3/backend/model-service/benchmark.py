@@ -0,0 +1,569 @@
+"""
+Offline load generator for the inference path: replays sample images against a running
+model-service (POST /infer, or /infer-batch with --batch-size > 1) or in-process against
+run_inference_batch, and writes a JSON report that can be diffed between runs.
+
+Load shapes:
+  --concurrency N             closed loop: N clients, each sends its next request when the last returns
+  --rate R [--arrival poisson] open loop: R requests/s on a fixed (or Poisson) schedule; latency is
+                              measured from the scheduled send time, so queueing is not hidden
+Reports throughput, latency p50/p95/p99, CPU utilization and peak RSS of the process under test
+(this process in-process; --server-pid and its worker children over HTTP, Linux /proc only),
+plus the mean of each timings_ms stage the service reported.
+
+--synthetic N generates N JPEGs (phone-sized by default), so no dataset is needed.
+Only the service's own dependencies are used; no network access beyond --url.
+
+Usage:
+    python benchmark.py run --target inprocess --cattle ../models/cattle_detection.onnx \
+        --fmd ../models/fmd_detection.onnx --synthetic 32 --concurrency 4 --duration 30 --report a.json
+    python benchmark.py run --target http --url http://localhost:9002 --images /data/samples \
+        --rate 20 --duration 60 --server-pid $(pgrep -f "uvicorn main:app" | head -1) --report b.json
+    python benchmark.py compare a.json b.json
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+from urllib.parse import urlparse
+
+import numpy as np
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+SYNTHETIC_SIZES = ((4032, 3024), (1920, 1080), (1280, 960), (640, 480))
+
+
+# --- Images -------------------------------------------------------------------------------
+
+
+def synthetic_images(count: int, sizes=SYNTHETIC_SIZES, seed: int = 0) -> list[tuple[str, bytes]]:
+    """JPEGs with smooth gradients plus noise (compresses like a photo, unlike flat colour)."""
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        width, height = sizes[i % len(sizes)]
+        # Build at low resolution and upscale: fast, and gives photo-like low-frequency content
+        small = rng.integers(0, 256, size=(height // 32 + 1, width // 32 + 1, 3), dtype=np.uint8)
+        img = Image.fromarray(small).resize((width, height), Image.Resampling.BILINEAR)
+        noise = rng.integers(-12, 13, size=(height, width, 3), dtype=np.int16)
+        pixels = np.clip(np.asarray(img, dtype=np.int16) + noise, 0, 255).astype(np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(pixels).save(buf, format="JPEG", quality=90)
+        images.append((f"synthetic_{i}_{width}x{height}.jpg", buf.getvalue()))
+    return images
+
+
+def directory_images(path: str, limit: int = 0) -> list[tuple[str, bytes]]:
+    """Images under path (recursively), read into memory so disk I/O is not measured."""
+    paths = []
+    for root, _, files in os.walk(path):
+        paths += [os.path.join(root, f) for f in sorted(files) if f.lower().endswith(IMAGE_EXTENSIONS)]
+    if limit:
+        paths = paths[:limit]
+    images = []
+    for p in paths:
+        with open(p, "rb") as f:
+            images.append((os.path.relpath(p, path), f.read()))
+    return images
+
+
+# --- Targets ------------------------------------------------------------------------------
+
+
+class HttpTarget:
+    """POST /infer (one image) or /infer-batch (several) with a keep-alive connection per thread."""
+
+    def __init__(self, url: str, threshold: float, timeout: float, priority: Optional[str] = None):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.https = parsed.scheme == "https"
+        self.prefix = parsed.path.rstrip("/")
+        self.threshold = threshold
+        self.timeout = timeout
+        self.priority = priority
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            conn = self._local.conn = cls(self.host, self.port, timeout=self.timeout)
+        return conn
+
+    def _body(self, field: str, images: list[tuple[str, bytes]]) -> tuple[bytes, str]:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, data in images:
+            content_type = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+            parts.append(
+                f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{os.path.basename(name)}"\r\n'
+                f"Content-Type: {content_type}\r\n\r\n".encode()
+                + data
+                + b"\r\n"
+            )
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="threshold"\r\n\r\n{self.threshold}\r\n'
+            f"--{boundary}--\r\n".encode()
+        )
+        return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+    def __call__(self, images: list[tuple[str, bytes]]) -> list[dict]:
+        path, field = ("/infer", "file") if len(images) == 1 else ("/infer-batch", "files")
+        body, content_type = self._body(field, images)
+        conn = self._connection()
+        try:
+            headers = {"Content-Type": content_type}
+            if self.priority:
+                headers["X-Priority"] = self.priority
+            conn.request("POST", self.prefix + path, body=body, headers=headers)
+            resp = conn.getresponse()
+            payload = resp.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the broken connection; the next request on this thread reconnects
+            conn.close()
+            self._local.conn = None
+            raise
+        if resp.status >= 400:
+            raise RuntimeError(f"HTTP {resp.status}")
+        data = json.loads(payload)
+        return data["results"] if "results" in data else [data]
+
+
+class InProcessTarget:
+    """run_inference_batch in this process (sessions shared across threads, as INFERENCE_EXECUTOR=thread)."""
+
+    def __init__(self, spec, session_config, quality_config, threshold: float):
+        from inference import _load_sessions
+
+        self.spec = spec
+        self.session_config = session_config
+        self.quality_config = quality_config
+        self.threshold = threshold
+        _load_sessions(spec, session_config)
+
+    def __call__(self, images: list[tuple[str, bytes]]) -> list[dict]:
+        from inference import run_inference_batch
+
+        results = run_inference_batch(
+            [data for _, data in images],
+            [self.threshold] * len(images),
+            self.spec,
+            self.session_config,
+            self.quality_config,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+
+# --- Process resource sampling (Linux /proc) ----------------------------------------------
+
+
+def _children(pid: int) -> list[int]:
+    kids = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children") as f:
+                kids += [int(c) for c in f.read().split()]
+    except OSError:
+        pass
+    return kids
+
+
+def _process_tree(pid: int) -> list[int]:
+    """pid plus all descendants (process executor workers)."""
+    tree, stack = [], [pid]
+    while stack:
+        p = stack.pop()
+        tree.append(p)
+        stack += _children(p)
+    return tree
+
+
+def _cpu_seconds(pids: list[int]) -> Optional[float]:
+    ticks = os.sysconf("SC_CLK_TCK")
+    total = 0.0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks  # utime + stime
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+def _rss_bytes(pids: list[int]) -> int:
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+        except OSError:
+            continue
+    return total
+
+
+class ResourceSampler:
+    """Peak RSS (sampled) and CPU time of a process tree over the run; None where unsupported."""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.supported = pid is not None and os.path.exists(f"/proc/{pid}/stat")
+        self.peak_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self) -> None:
+        while not self._stop.is_set():
+            self.peak_rss = max(self.peak_rss, _rss_bytes(_process_tree(self.pid)))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        if self.supported:
+            self._cpu0 = _cpu_seconds(_process_tree(self.pid))
+            self._thread.start()
+        elif self.pid == os.getpid():
+            self._cpu0 = sum(os.times()[:2])
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._t0
+        self.result = {"cpu_seconds": None, "cpu_cores_used": None, "cpu_utilization": None, "peak_rss_mb": None}
+        if self.supported:
+            self._stop.set()
+            self._thread.join()
+            cpu = _cpu_seconds(_process_tree(self.pid)) - self._cpu0
+            self.result["peak_rss_mb"] = round(self.peak_rss / 2**20, 1)
+        elif self.pid == os.getpid():
+            import resource
+
+            cpu = sum(os.times()[:2]) - self._cpu0
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux, bytes on macOS
+            self.result["peak_rss_mb"] = round(maxrss / (2**20 if sys.platform == "darwin" else 2**10), 1)
+        else:
+            return
+        self.result["cpu_seconds"] = round(cpu, 2)
+        self.result["cpu_cores_used"] = round(cpu / wall, 2)
+        self.result["cpu_utilization"] = round(cpu / wall / (os.cpu_count() or 1), 3)
+
+
+# --- Load driver --------------------------------------------------------------------------
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: list[float] = []
+        self.errors: dict[str, int] = {}
+        self.images = 0
+        self.stage_ms: dict[str, list[float]] = {}
+
+    def ok(self, latency: float, results: list[dict]) -> None:
+        with self.lock:
+            self.latencies.append(latency)
+            self.images += len(results)
+            for result in results:
+                for stage, ms in result.get("timings_ms", {}).items():
+                    if ms is not None:
+                        self.stage_ms.setdefault(stage, []).append(ms)
+
+    def error(self, e: Exception) -> None:
+        key = str(e) if isinstance(e, RuntimeError) and str(e).startswith("HTTP ") else type(e).__name__
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+
+def _batches(images: list, batch_size: int):
+    """Endless round-robin over the images, batch_size at a time (thread-safe)."""
+    cycle = itertools.cycle(images)
+    lock = threading.Lock()
+
+    def next_batch():
+        with lock:
+            return [next(cycle) for _ in range(batch_size)]
+
+    return next_batch
+
+
+def _send(target, batch, recorder: Recorder, started: float) -> None:
+    try:
+        results = target(batch)
+    except Exception as e:
+        recorder.error(e)
+        return
+    recorder.ok(time.perf_counter() - started, results)
+
+
+def closed_loop(target, next_batch, concurrency: int, duration: float, requests: int, recorder: Recorder) -> None:
+    deadline = time.perf_counter() + duration if duration else None
+    budget = itertools.count()
+
+    def client():
+        while True:
+            if deadline is not None and time.perf_counter() >= deadline:
+                return
+            if requests and next(budget) >= requests:
+                return
+            _send(target, next_batch(), recorder, time.perf_counter())
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def open_loop(
+    target, next_batch, rate: float, arrival: str, max_in_flight: int, duration: float, requests: int,
+    recorder: Recorder, seed: int = 0,
+) -> None:
+    rng = random.Random(seed)
+    total = requests or int(rate * duration)
+    start = time.perf_counter()
+    scheduled = start
+    with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+        for _ in range(total):
+            scheduled += rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # Latency counts from the scheduled send time: time spent waiting for a free
+            # client thread is part of it (no coordinated omission)
+            pool.submit(_send, target, next_batch(), recorder, scheduled)
+
+
+def _percentile(samples: list[float], q: float) -> Optional[float]:
+    return float(np.percentile(samples, q)) if samples else None
+
+
+def _ms(value: Optional[float]) -> Optional[float]:
+    return round(value * 1000, 2) if value is not None else None
+
+
+def build_target(args):
+    if args.target == "http":
+        return HttpTarget(args.url, args.threshold, args.timeout, args.priority)
+
+    from quality import QualityConfig
+    from registry import ModelRegistry, spec_from_paths
+    from sessions import SessionConfig
+
+    if args.registry:
+        spec = ModelRegistry(args.registry).resolve(args.version)
+    else:
+        spec = spec_from_paths(args.cattle or "", args.fmd or "", args.fused or "")
+    missing = spec.missing()
+    if missing:
+        sys.exit(missing)
+    config = SessionConfig(intra_op_threads=args.intra_op_threads, graph_optimization=args.graph_optimization)
+    return InProcessTarget(spec, config, QualityConfig(enabled=not args.no_quality_gate), args.threshold)
+
+
+def run(args) -> None:
+    if args.synthetic:
+        images = synthetic_images(args.synthetic, seed=args.seed)
+    elif args.images:
+        images = directory_images(args.images, args.limit)
+    else:
+        sys.exit("Pass --images DIR or --synthetic N")
+    if not images:
+        sys.exit(f"No images found under {args.images}")
+    if not args.duration and not args.requests:
+        sys.exit("Pass --duration or --requests")
+
+    mode = f"rate {args.rate}/s ({args.arrival})" if args.rate else f"concurrency {args.concurrency}"
+    print(f"{args.target}: {len(images)} images, batch {args.batch_size}, {mode}", flush=True)
+    pid = os.getpid() if args.target == "inprocess" else args.server_pid
+    warm = Recorder()
+    recorder = Recorder()
+    quiet = args.target == "inprocess" and not args.verbose
+    # In-process, the service prints per-batch timings: discard them for the whole run
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull if quiet else sys.stdout):
+        target = build_target(args)
+        next_batch = _batches(images, args.batch_size)
+        # Warm-up: connections, sessions and lazy allocations, excluded from the report
+        for _ in range(args.warmup):
+            _send(target, next_batch(), warm, time.perf_counter())
+        t0 = time.perf_counter()
+        with ResourceSampler(pid) as sampler:
+            if args.rate:
+                open_loop(
+                    target, next_batch, args.rate, args.arrival, args.concurrency or 64, args.duration,
+                    args.requests, recorder, args.seed,
+                )
+            else:
+                closed_loop(target, next_batch, args.concurrency, args.duration, args.requests, recorder)
+        wall = time.perf_counter() - t0
+    if warm.errors:
+        print(f"  warm-up errors: {warm.errors}")
+
+    lat = recorder.latencies
+    completed = len(lat)
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": {
+            "target": args.target,
+            "url": args.url if args.target == "http" else None,
+            "images": args.images or f"synthetic:{args.synthetic}",
+            "image_count": len(images),
+            "batch_size": args.batch_size,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "arrival": args.arrival if args.rate else None,
+            "duration_s": args.duration,
+            "requests": args.requests,
+            "threshold": args.threshold,
+            "label": args.label,
+        },
+        "environment": {
+            "host": platform.node(),
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "env": {k: v for k, v in os.environ.items() if k.startswith(("ORT_", "BATCH_", "INFERENCE_", "MODEL_"))},
+        },
+        "results": {
+            "wall_s": round(wall, 2),
+            "completed": completed,
+            "errors": recorder.errors,
+            "error_rate": round(sum(recorder.errors.values()) / max(1, completed + sum(recorder.errors.values())), 4),
+            "throughput_rps": round(completed / wall, 2),
+            "throughput_images_per_s": round(recorder.images / wall, 2),
+            "latency_ms": {
+                "mean": _ms(statistics.fmean(lat)) if lat else None,
+                "p50": _ms(_percentile(lat, 50)),
+                "p95": _ms(_percentile(lat, 95)),
+                "p99": _ms(_percentile(lat, 99)),
+                "max": _ms(max(lat)) if lat else None,
+            },
+            "service_timings_ms": {
+                stage: round(statistics.fmean(values), 2) for stage, values in sorted(recorder.stage_ms.items())
+            },
+            **sampler.result,
+        },
+    }
+    if args.target == "inprocess":
+        from inference import session_stats
+
+        report["environment"]["sessions"] = session_stats()
+
+    r = report["results"]
+    print(
+        f"  {completed} requests in {r['wall_s']}s: {r['throughput_rps']} req/s, "
+        f"{r['throughput_images_per_s']} images/s, errors {recorder.errors or 0}"
+    )
+    print(
+        f"  latency ms: p50 {r['latency_ms']['p50']}  p95 {r['latency_ms']['p95']}  "
+        f"p99 {r['latency_ms']['p99']}  max {r['latency_ms']['max']}"
+    )
+    print(f"  cpu cores used {r['cpu_cores_used']}, peak RSS {r['peak_rss_mb']}MB")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.report}")
+
+
+COMPARED = (
+    ("throughput_rps", ("throughput_rps",), True),
+    ("throughput_images_per_s", ("throughput_images_per_s",), True),
+    ("latency p50 ms", ("latency_ms", "p50"), False),
+    ("latency p95 ms", ("latency_ms", "p95"), False),
+    ("latency p99 ms", ("latency_ms", "p99"), False),
+    ("error_rate", ("error_rate",), False),
+    ("cpu_cores_used", ("cpu_cores_used",), False),
+    ("peak_rss_mb", ("peak_rss_mb",), False),
+)
+
+
+def compare(args) -> None:
+    with open(args.baseline) as f:
+        base = json.load(f)
+    with open(args.candidate) as f:
+        cand = json.load(f)
+    for key in ("target", "batch_size", "concurrency", "rate", "image_count"):
+        if base["config"].get(key) != cand["config"].get(key):
+            print(f"warning: {key} differs ({base['config'].get(key)} vs {cand['config'].get(key)})")
+
+    print(f"{'metric':<26} {'baseline':>10} {'candidate':>10} {'change':>9}")
+    for name, path, higher_is_better in COMPARED:
+        a, b = base["results"], cand["results"]
+        for key in path:
+            a, b = (a or {}).get(key), (b or {}).get(key)
+        if a is None or b is None:
+            continue
+        change = f"{(b - a) / a * 100:+.1f}%" if a else "n/a"
+        worse = a and ((b < a) if higher_is_better else (b > a)) and abs(b - a) / a > args.tolerance
+        print(f"{name:<26} {a:>10} {b:>10} {change:>9}{'  <-- regression' if worse else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the model-service inference path")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    r = sub.add_parser("run", help="Generate load and write a report")
+    r.add_argument("--target", choices=("http", "inprocess"), default="http")
+    r.add_argument("--url", default="http://localhost:9002", help="model-service base URL (http target)")
+    r.add_argument("--timeout", type=float, default=60)
+    r.add_argument("--priority", choices=("interactive", "bulk"), help="X-Priority header (http target)")
+    r.add_argument("--server-pid", type=int, help="model-service PID for CPU/RSS (http target, Linux)")
+    r.add_argument("--cattle", default=os.getenv("MODEL_CATTLE_PATH"), help="inprocess: cattle model")
+    r.add_argument("--fmd", default=os.getenv("MODEL_FMD_PATH"), help="inprocess: FMD model")
+    r.add_argument("--fused", default=os.getenv("MODEL_FUSED_PATH", ""), help="inprocess: fused model")
+    r.add_argument("--registry", default=os.getenv("MODEL_REGISTRY_DIR", ""), help="inprocess: model registry")
+    r.add_argument("--version", help="inprocess: registry version (default: current)")
+    r.add_argument("--intra-op-threads", type=int, default=int(os.getenv("ORT_INTRA_OP_THREADS", "0")))
+    r.add_argument("--graph-optimization", default=os.getenv("ORT_GRAPH_OPTIMIZATION", "all"))
+    r.add_argument("--no-quality-gate", action="store_true", help="inprocess: run every image through the models")
+    r.add_argument("--images", help="Directory of sample images")
+    r.add_argument("--limit", type=int, default=0, help="Use at most N images from --images")
+    r.add_argument("--synthetic", type=int, default=0, help="Generate N synthetic JPEGs instead")
+    r.add_argument("--batch-size", type=int, default=1, help="Images per request (>1 uses /infer-batch)")
+    r.add_argument("--concurrency", type=int, default=4, help="Clients (closed loop) or max in flight (--rate)")
+    r.add_argument("--rate", type=float, default=0, help="Open loop: requests per second")
+    r.add_argument("--arrival", choices=("fixed", "poisson"), default="fixed")
+    r.add_argument("--duration", type=float, default=30, help="Seconds (0 = use --requests)")
+    r.add_argument("--requests", type=int, default=0, help="Stop after N requests")
+    r.add_argument("--warmup", type=int, default=10, help="Untimed requests before the run")
+    r.add_argument("--threshold", type=float, default=0.5)
+    r.add_argument("--seed", type=int, default=0)
+    r.add_argument("--verbose", action="store_true", help="inprocess: keep the service's log output")
+    r.add_argument("--label", help="Free text stored in the report (e.g. git sha, setting under test)")
+    r.add_argument("--report", help="Write the report as JSON")
+    r.set_defaults(func=run)
+
+    c = sub.add_parser("compare", help="Compare two reports")
+    c.add_argument("baseline")
+    c.add_argument("candidate")
+    c.add_argument("--tolerance", type=float, default=0.05, help="Relative change flagged as regression")
+    c.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
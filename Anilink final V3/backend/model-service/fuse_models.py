@@ -0,0 +1,199 @@
+"""
+Offline tool: merge cattle_detection.onnx and fmd_detection.onnx into one ONNX graph.
+
+The fused graph has the shared image input and two outputs (cattle_logits, fmd_logits), so the
+model-service runs one session per batch instead of two (one dispatch, one memory arena, one
+load). Serve it with MODEL_FUSED_PATH=/models/fused_detection.onnx.
+
+--share-backbone additionally merges everything the two models have in common: initializers
+with identical bytes are stored once, and nodes that compute the same op on the same inputs
+(e.g. a MobileNetV2 backbone frozen during fine-tuning) are evaluated once. Layers whose
+weights differ are left alone, so outputs are unchanged either way.
+
+Requires the `onnx` package (not needed by the service itself):
+    pip install onnx
+
+Usage:
+    python fuse_models.py --cattle ../models/cattle_detection.onnx \
+        --fmd ../models/fmd_detection.onnx --out ../models/fused_detection.onnx [--share-backbone]
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+
+import numpy as np
+
+from inference import FUSED_CATTLE_OUTPUT, FUSED_FMD_OUTPUT
+
+
+def _prefixed(model, prefix: str, output_name: str):
+    """Copy of the model's nodes/initializers with every internal name prefixed."""
+    import onnx
+
+    graph = onnx.compose.add_prefix(model, prefix, rename_inputs=False, rename_outputs=False).graph
+    # add_prefix leaves graph inputs/outputs alone; rename the output to its fused name
+    for node in graph.node:
+        node.output[:] = [output_name if name == graph.output[0].name else name for name in node.output]
+    return graph
+
+
+def _dedupe_initializers(graph) -> int:
+    """Store byte-identical initializers once; returns how many were dropped."""
+    from onnx import numpy_helper
+
+    canonical = {}
+    rename = {}
+    kept = []
+    for init in graph.initializer:
+        array = numpy_helper.to_array(init)
+        key = (array.dtype.str, array.shape, hashlib.sha256(array.tobytes()).hexdigest())
+        if key in canonical:
+            rename[init.name] = canonical[key]
+        else:
+            canonical[key] = init.name
+            kept.append(init)
+    for node in graph.node:
+        node.input[:] = [rename.get(name, name) for name in node.input]
+    del graph.initializer[:]
+    graph.initializer.extend(kept)
+    return len(rename)
+
+
+def _dedupe_nodes(graph) -> int:
+    """
+    Common-subexpression elimination over a topologically sorted graph: a node with the same
+    op, attributes and (already deduplicated) inputs as an earlier one reuses its outputs.
+    Returns how many nodes were dropped.
+    """
+    graph_outputs = {o.name for o in graph.output}
+    seen = {}
+    rename = {}
+    kept = []
+    for node in graph.node:
+        node.input[:] = [rename.get(name, name) for name in node.input]
+        key = (
+            node.domain,
+            node.op_type,
+            tuple(node.input),
+            tuple(attr.SerializeToString() for attr in node.attribute),
+            len(node.output),
+        )
+        previous = seen.get(key)
+        if previous is not None and not graph_outputs.intersection(node.output):
+            rename.update(zip(node.output, previous.output))
+            continue
+        seen[key] = node
+        kept.append(node)
+    dropped = len(graph.node) - len(kept)
+    del graph.node[:]
+    graph.node.extend(kept)
+    return dropped
+
+
+def fuse(cattle_path: str, fmd_path: str, share_backbone: bool = False):
+    """Build the fused ModelProto (weights inlined)."""
+    import onnx
+    from onnx import helper
+
+    cattle = onnx.load(cattle_path)
+    fmd = onnx.load(fmd_path)
+
+    opsets = {o.domain: o.version for o in cattle.opset_import}
+    for o in fmd.opset_import:
+        if opsets.get(o.domain, o.version) != o.version:
+            raise SystemExit(f"Opset mismatch for domain '{o.domain}': {opsets[o.domain]} vs {o.version}")
+        opsets[o.domain] = o.version
+
+    cattle_input = cattle.graph.input[0]
+    fmd_input = fmd.graph.input[0]
+    if cattle_input.type != fmd_input.type:
+        raise SystemExit("Models take different input shapes/types; they cannot share one input")
+
+    cattle_graph = _prefixed(cattle, "cattle/", FUSED_CATTLE_OUTPUT)
+    fmd_graph = _prefixed(fmd, "fmd/", FUSED_FMD_OUTPUT)
+    # Both graphs read the single fused input
+    for node in fmd_graph.node:
+        node.input[:] = [cattle_input.name if name == fmd_input.name else name for name in node.input]
+
+    outputs = []
+    for output, name in ((cattle.graph.output[0], FUSED_CATTLE_OUTPUT), (fmd.graph.output[0], FUSED_FMD_OUTPUT)):
+        fused_output = onnx.ValueInfoProto()
+        fused_output.CopyFrom(output)
+        fused_output.name = name
+        outputs.append(fused_output)
+
+    graph = helper.make_graph(
+        list(cattle_graph.node) + list(fmd_graph.node),
+        "cattle_fmd_fused",
+        [cattle_input],
+        outputs,
+        list(cattle_graph.initializer) + list(fmd_graph.initializer),
+    )
+    fused = helper.make_model(
+        graph,
+        opset_imports=[helper.make_opsetid(domain, version) for domain, version in opsets.items()],
+        producer_name="anilink-fuse-models",
+    )
+    fused.ir_version = max(cattle.ir_version, fmd.ir_version)
+
+    if share_backbone:
+        shared_inits = _dedupe_initializers(fused.graph)
+        shared_nodes = _dedupe_nodes(fused.graph)
+        total = len(cattle.graph.node) + len(fmd.graph.node)
+        print(f"Shared {shared_inits} initializers and {shared_nodes}/{total} nodes")
+        if shared_nodes == 0:
+            print("Backbones differ (weights not identical); only the session/dispatch is shared")
+
+    onnx.checker.check_model(fused)
+    return fused
+
+
+def verify(fused_path: str, cattle_path: str, fmd_path: str) -> float:
+    """Run fused and original models on the same random input; return the max abs difference."""
+    import onnxruntime as ort
+
+    def run(path):
+        session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+        inp = session.get_inputs()[0]
+        shape = [d if isinstance(d, int) else 1 for d in inp.shape]
+        return session, inp.name, shape
+
+    fused, fused_input, shape = run(fused_path)
+    x = np.random.default_rng(0).normal(size=shape).astype(np.float32)
+    fused_cattle, fused_fmd = fused.run([FUSED_CATTLE_OUTPUT, FUSED_FMD_OUTPUT], {fused_input: x})
+    diff = 0.0
+    for path, fused_out in ((cattle_path, fused_cattle), (fmd_path, fused_fmd)):
+        session, name, _ = run(path)
+        diff = max(diff, float(np.abs(session.run(None, {name: x})[0] - fused_out).max()))
+    return diff
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuse the cattle + FMD ONNX models into one graph")
+    parser.add_argument("--cattle", required=True, help="cattle_detection.onnx")
+    parser.add_argument("--fmd", required=True, help="fmd_detection.onnx")
+    parser.add_argument("--out", required=True, help="Output path, e.g. fused_detection.onnx")
+    parser.add_argument(
+        "--share-backbone",
+        action="store_true",
+        help="Deduplicate identical weights and layers (shared backbone)",
+    )
+    args = parser.parse_args()
+
+    for path in (args.cattle, args.fmd):
+        if not os.path.exists(path):
+            sys.exit(f"Model not found: {path}")
+
+    import onnx
+
+    fused = fuse(args.cattle, args.fmd, share_backbone=args.share_backbone)
+    onnx.save(fused, args.out)
+    size_mb = os.path.getsize(args.out) / 1e6
+    print(f"Wrote {args.out} ({size_mb:.1f}MB, {len(fused.graph.node)} nodes)")
+    print(f"Max abs difference vs separate models: {verify(args.out, args.cattle, args.fmd):.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,136 +3,372 @@ ONNX inference for cattle + FMD detection.
 Reference: Updated_detection_Models/app_onnx.py
 - Same preprocessing (224x224, ImageNet mean/std, CHW)
 - Same softmax (numerically stable)
+- Stage 0 (optional): image-quality pre-gate (quality.py), no model run for unusable photos
 - Stage 1: cattle gate; Stage 2: FMD (Healthy vs Infected)
 - Threshold: default 0.5; special rule if non_cattle_prob > 0.4
+- Batched: cattle gate runs once per batch, FMD only on the gate-passing subset
+- Fused (MODEL_FUSED_PATH, see fuse_models.py): one session computes both heads per batch
+- Sessions are loaded per ModelSpec (registry.py), so a new model version can be loaded and
+  swapped in while batches on the previous one finish
 """
 
 import os
+import threading
 import time
 from typing import Optional
 
 import numpy as np
 
-from utils import load_and_preprocess
+from quality import QualityConfig, assess
+from registry import ModelSpec, RegistryError, check_input_shape, verify_checksums
+from sessions import SessionConfig, create_session
+from utils import IMAGE_SIZE, decode, normalize_into
 
-# Module-level cached sessions
-_cattle_session = None
-_fmd_session = None
-_cattle_input_name = None
-_cattle_output_name = None
-_fmd_input_name = None
-_fmd_output_name = None
+# Fused cattle+FMD graph (fuse_models.py): one input, two named outputs
+FUSED_CATTLE_OUTPUT = "cattle_logits"
+FUSED_FMD_OUTPUT = "fmd_logits"
+
+# Loaded model sets, keyed by ModelSpec. A hot swap loads the new spec next to the old one;
+# batches already running or queued keep their reference to the old bundle until they finish.
+_bundles: dict = {}
+_load_lock = threading.Lock()
+# Specs dropped by release_sessions: a batch must not load them again behind the swap's back
+_released: set = set()
+
+# Per-session load_ms / warmup_ms / optimized_cache of the latest load, keyed cattle, fmd or fused
+_session_stats: dict = {}
+
+# Per-thread batch tensor, grown on demand and reused across batches (decoded into in place)
+_buffers = threading.local()
 
 
 def _softmax(logits: np.ndarray) -> np.ndarray:
-    """Numerically stable softmax. Matches app_onnx.py."""
-    exp_logits = np.exp(logits - np.max(logits))
-    return exp_logits / np.sum(exp_logits)
+    """Numerically stable softmax over the last axis. Matches app_onnx.py."""
+    exp_logits = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+    return exp_logits / np.sum(exp_logits, axis=-1, keepdims=True)
 
 
-def _load_sessions(cattle_path: str, fmd_path: str) -> None:
-    """Load ONNX sessions at module level (load once)."""
-    global _cattle_session, _fmd_session
-    global _cattle_input_name, _cattle_output_name
-    global _fmd_input_name, _fmd_output_name
+def _batch_buffer(n: int) -> np.ndarray:
+    """Return this thread's float32 [n, 3, 224, 224] batch tensor (a view of a reused buffer)."""
+    buf = getattr(_buffers, "batch", None)
+    if buf is None or len(buf) < n:
+        buf = np.empty((n, 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32)
+        _buffers.batch = buf
+    return buf[:n]
 
-    import onnxruntime as ort
 
-    if _cattle_session is not None:
-        return
+def _has_dynamic_batch(session) -> bool:
+    """True if the first input declares a symbolic (dynamic) batch axis."""
+    batch_dim = session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int)
 
-    t0 = time.perf_counter()
-    _cattle_session = ort.InferenceSession(
-        cattle_path, providers=["CPUExecutionProvider"]
-    )
-    _cattle_input_name = _cattle_session.get_inputs()[0].name
-    _cattle_output_name = _cattle_session.get_outputs()[0].name
-    elapsed = (time.perf_counter() - t0) * 1000
-    print(f"[MODEL-SERVICE] Cattle model loaded in {elapsed:.0f}ms")
-
-    t0 = time.perf_counter()
-    _fmd_session = ort.InferenceSession(
-        fmd_path, providers=["CPUExecutionProvider"]
-    )
-    _fmd_input_name = _fmd_session.get_inputs()[0].name
-    _fmd_output_name = _fmd_session.get_outputs()[0].name
-    elapsed = (time.perf_counter() - t0) * 1000
-    print(f"[MODEL-SERVICE] FMD model loaded in {elapsed:.0f}ms")
 
+def _run_batched(
+    session, input_name: str, output_names: list[str], batch: np.ndarray, dynamic: bool
+) -> list[np.ndarray]:
+    """
+    Run a session on a [N, 3, 224, 224] batch and return [N, num_classes] logits per output.
+    Graphs exported with a fixed batch of 1 are run item by item.
+    """
+    if dynamic or len(batch) == 1:
+        return session.run(output_names, {input_name: batch})
+    runs = [session.run(output_names, {input_name: batch[i : i + 1]}) for i in range(len(batch))]
+    return [np.concatenate(outputs) for outputs in zip(*runs)]
 
-def run_inference(
-    image_bytes: bytes,
-    threshold: float = 0.5,
-    cattle_path: str = "",
-    fmd_path: str = "",
-) -> dict:
+
+MODEL_VARIANTS = ("fp32", "int8")
+
+
+def variant_path(path: str, variant: str) -> str:
+    """Path of a model variant: fp32 is the exported file, int8 sits next to it as <name>.int8.onnx."""
+    if variant not in MODEL_VARIANTS:
+        raise ValueError(f"Unknown MODEL_VARIANT: {variant}. Choose one of {MODEL_VARIANTS}")
+    if variant == "fp32" or not path:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{variant}{ext}"
+
+
+class _Bundle:
+    """Sessions (and their input/output names) for one ModelSpec."""
+
+    def __init__(self, spec: ModelSpec, session_config: Optional[SessionConfig]):
+        self.spec = spec
+        self.stats = {}
+        self.fused = None
+        self.cattle = None
+        self.fmd = None
+        try:
+            self.cattle_index = spec.cattle_classes.index("cattle")
+            self.non_cattle_index = spec.cattle_classes.index("non_cattle")
+            self.healthy_index = spec.fmd_classes.index("healthy")
+            self.infected_index = spec.fmd_classes.index("infected")
+        except ValueError as e:
+            raise RegistryError(f"{spec.version}: unexpected class names: {e}") from e
+
+        verify_checksums(spec)
+        if spec.fused_path:
+            self.fused, self.stats["fused"] = create_session(spec.fused_path, session_config)
+            check_input_shape(spec, self.fused)
+            self.fused_input = self.fused.get_inputs()[0].name
+            self.fused_dynamic = _has_dynamic_batch(self.fused)
+            print(f"[MODEL-SERVICE] Fused cattle+FMD model loaded: {self.stats['fused']}")
+        else:
+            self.cattle, self.stats["cattle"] = create_session(spec.cattle_path, session_config)
+            check_input_shape(spec, self.cattle)
+            self.cattle_input = self.cattle.get_inputs()[0].name
+            self.cattle_output = self.cattle.get_outputs()[0].name
+            self.cattle_dynamic = _has_dynamic_batch(self.cattle)
+            print(f"[MODEL-SERVICE] Cattle model loaded: {self.stats['cattle']}")
+
+            self.fmd, self.stats["fmd"] = create_session(spec.fmd_path, session_config)
+            check_input_shape(spec, self.fmd)
+            self.fmd_input = self.fmd.get_inputs()[0].name
+            self.fmd_output = self.fmd.get_outputs()[0].name
+            self.fmd_dynamic = _has_dynamic_batch(self.fmd)
+            print(f"[MODEL-SERVICE] FMD model loaded: {self.stats['fmd']}")
+        print(f"[MODEL-SERVICE] Model version {spec.version}")
+
+
+def _load_sessions(spec: ModelSpec, session_config: Optional[SessionConfig] = None) -> _Bundle:
     """
-    Full pipeline: cattle gate then FMD.
-    Returns dict matching POST /infer response schema.
+    Load (once) and warm up the sessions for spec, built per session_config.
+    Checksums and input shape are verified against the manifest; RegistryError if they differ.
+    Only for activating spec (startup, a swap, a worker process); batches use _sessions_for.
     """
-    _load_sessions(cattle_path, fmd_path)
+    bundle = _bundles.get(spec)
+    if bundle is not None:
+        return bundle
+    with _load_lock:
+        _released.discard(spec)
+        bundle = _bundles.get(spec)
+        if bundle is None:
+            bundle = _Bundle(spec, session_config)
+            _bundles[spec] = bundle
+            _session_stats.clear()
+            _session_stats.update(version=spec.version, **bundle.stats)
+    return bundle
 
-    input_tensor = load_and_preprocess(image_bytes)
 
-    # Stage 1: Cattle detection
-    t0 = time.perf_counter()
-    cattle_out = _cattle_session.run(
-        [_cattle_output_name], {_cattle_input_name: input_tensor}
-    )
-    cattle_logits = cattle_out[0][0]
-    cattle_probs = _softmax(cattle_logits)
-    cattle_prob = float(cattle_probs[0])
-    non_cattle_prob = float(cattle_probs[1])
-    cattle_elapsed = (time.perf_counter() - t0) * 1000
-    print(f"[MODEL-SERVICE] Cattle inference: {cattle_elapsed:.0f}ms")
-
-    # Gate logic (matches app_onnx.py)
+def _sessions_for(spec: ModelSpec, session_config: Optional[SessionConfig] = None) -> _Bundle:
+    """The loaded sessions of spec for a batch; a spec released by a swap is never loaded again."""
+    bundle = _bundles.get(spec)
+    if bundle is not None:
+        return bundle
+    with _load_lock:
+        if spec in _released:
+            raise RegistryError(f"{spec.version}: model set was released by a swap")
+    return _load_sessions(spec, session_config)
+
+
+def release_sessions(keep: ModelSpec) -> None:
+    """
+    Drop every loaded model set except keep. Batches bound to a released bundle (see
+    run_inference_batch) finish on their own reference.
+    """
+    with _load_lock:
+        for spec in [s for s in _bundles if s != keep]:
+            del _bundles[spec]
+            _released.add(spec)
+
+
+def session_stats() -> dict:
+    """Version and load/warm-up timings of the latest sessions loaded in this process."""
+    return dict(_session_stats)
+
+
+def _gate(
+    cattle_prob: float,
+    non_cattle_prob: float,
+    threshold: float,
+    non_cattle_max: float = 0.4,
+    strict_cattle_min: float = 0.8,
+) -> tuple[bool, str]:
+    """Cattle gate logic (matches app_onnx.py). Returns (is_cattle, gate_rule)."""
     is_cattle = cattle_prob > non_cattle_prob and cattle_prob >= threshold
-    if non_cattle_prob > 0.4:
-        is_cattle = is_cattle and cattle_prob >= max(threshold, 0.8)
+    if non_cattle_prob > non_cattle_max:
+        is_cattle = is_cattle and cattle_prob >= max(threshold, strict_cattle_min)
 
     gate_rule = (
         "passed"
         if is_cattle
-        else f"cattle_prob={cattle_prob:.3f} < threshold or non_cattle_prob={non_cattle_prob:.3f} > 0.4"
+        else f"cattle_prob={cattle_prob:.3f} < threshold or non_cattle_prob={non_cattle_prob:.3f} > {non_cattle_max}"
     )
+    return is_cattle, gate_rule
+
 
-    if not is_cattle:
-        return {
+def _low_quality_result(quality: dict, threshold: float, spec: ModelSpec, decode_ms: float, t0: float) -> dict:
+    """Response for an image rejected by the quality pre-gate (no model probabilities)."""
+    return {
+        "ok": True,
+        "threshold": threshold,
+        "cattle_prob": None,
+        "non_cattle_prob": None,
+        "passed_gate": False,
+        "gate_rule": "low_quality: " + ", ".join(quality["issues"]),
+        "fmd": None,
+        "quality": quality,
+        "model_version": spec.version,
+        "timings_ms": {
+            "decode": decode_ms,
+            "preprocess": (time.perf_counter() - t0) * 1000,
+            "cattle": None,
+            "fmd": None,
+        },
+    }
+
+
+def run_inference_batch(
+    images: list[bytes],
+    thresholds: list[float],
+    spec: ModelSpec,
+    session_config: Optional[SessionConfig] = None,
+    quality_config: Optional[QualityConfig] = None,
+    bundle: Optional[_Bundle] = None,
+) -> list:
+    """
+    Batched pipeline: cattle gate once over all images, then FMD on the gate-passing subset.
+    Returns one entry per image, in order: a response dict (POST /infer schema), or the
+    exception raised while decoding that image so one bad upload does not fail the batch.
+    Each dict carries timings_ms for decode, preprocess (decode + normalize), cattle and fmd
+    (batch-level for the model runs).
+    With a fused model both heads come from one run, timed as timings_ms["fused"].
+    The whole batch runs on the sessions of spec, even if a newer spec is swapped in meanwhile;
+    bundle (from _load_sessions) pins them when the batch is bound, so a batch queued before a
+    swap does not need the released spec loaded again.
+    With quality_config, images failing the quality pre-gate (quality.py) skip both models and
+    come back with passed_gate False, null probabilities and quality.issues.
+    """
+    if bundle is None:
+        bundle = _sessions_for(spec, session_config)
+    spec = bundle.spec
+
+    results: list = [None] * len(images)
+    buffer = _batch_buffer(len(images))
+    valid = []
+    preprocess_ms = {}
+    decode_ms = {}
+    quality = {}
+    for i, image_bytes in enumerate(images):
+        t0 = time.perf_counter()
+        try:
+            img, original_size = decode(image_bytes)
+            decode_ms[i] = (time.perf_counter() - t0) * 1000
+            if quality_config is not None and quality_config.enabled:
+                quality[i] = assess(img, original_size, quality_config)
+                if not quality[i]["passed"]:
+                    # Unusable photo: answer now, without a batch slot or any session run
+                    results[i] = _low_quality_result(quality[i], thresholds[i], spec, decode_ms[i], t0)
+                    continue
+            # Normalize straight into the next free slot; failed images do not take a slot
+            normalize_into(img, buffer[len(valid)])
+            valid.append(i)
+        except Exception as e:
+            results[i] = e
+        preprocess_ms[i] = (time.perf_counter() - t0) * 1000
+    if not valid:
+        return results
+
+    batch = buffer[: len(valid)]
+
+    fused_fmd_logits = None
+    if bundle.fused is not None:
+        # One dispatch for both heads; FMD logits of gate-failing images are discarded
+        t0 = time.perf_counter()
+        cattle_logits, fused_fmd_logits = _run_batched(
+            bundle.fused,
+            bundle.fused_input,
+            [FUSED_CATTLE_OUTPUT, FUSED_FMD_OUTPUT],
+            batch,
+            bundle.fused_dynamic,
+        )
+        fused_elapsed = (time.perf_counter() - t0) * 1000
+        print(f"[MODEL-SERVICE] Fused inference: {fused_elapsed:.0f}ms (batch={len(valid)})")
+        cattle_probs = _softmax(cattle_logits)
+        cattle_elapsed = None
+    else:
+        # Stage 1: Cattle detection (whole batch)
+        t0 = time.perf_counter()
+        cattle_logits = _run_batched(
+            bundle.cattle, bundle.cattle_input, [bundle.cattle_output], batch, bundle.cattle_dynamic
+        )[0]
+        cattle_probs = _softmax(cattle_logits)
+        cattle_elapsed = (time.perf_counter() - t0) * 1000
+        print(f"[MODEL-SERVICE] Cattle inference: {cattle_elapsed:.0f}ms (batch={len(valid)})")
+
+    passed = []
+    for row, i in enumerate(valid):
+        cattle_prob = float(cattle_probs[row][bundle.cattle_index])
+        non_cattle_prob = float(cattle_probs[row][bundle.non_cattle_index])
+        is_cattle, gate_rule = _gate(
+            cattle_prob, non_cattle_prob, thresholds[i], spec.non_cattle_max, spec.strict_cattle_min
+        )
+        results[i] = {
             "ok": True,
-            "threshold": threshold,
+            "threshold": thresholds[i],
             "cattle_prob": cattle_prob,
             "non_cattle_prob": non_cattle_prob,
-            "passed_gate": False,
+            "passed_gate": is_cattle,
             "gate_rule": gate_rule,
             "fmd": None,
+            "quality": quality.get(i),
+            "model_version": spec.version,
+            "timings_ms": {
+                "decode": decode_ms[i],
+                "preprocess": preprocess_ms[i],
+                "cattle": cattle_elapsed,
+                "fmd": None,
+            },
         }
+        if fused_fmd_logits is not None:
+            results[i]["timings_ms"]["fused"] = fused_elapsed
+        if is_cattle:
+            passed.append((row, i))
 
-    # Stage 2: FMD detection
-    t0 = time.perf_counter()
-    fmd_out = _fmd_session.run(
-        [_fmd_output_name], {_fmd_input_name: input_tensor}
-    )
-    fmd_logits = fmd_out[0][0]
-    fmd_probs = _softmax(fmd_logits)
-    healthy_prob = float(fmd_probs[0])
-    infected_prob = float(fmd_probs[1])
-    fmd_elapsed = (time.perf_counter() - t0) * 1000
-    print(f"[MODEL-SERVICE] FMD inference: {fmd_elapsed:.0f}ms")
+    if not passed:
+        return results
 
-    label = "INFECTED" if infected_prob > healthy_prob else "HEALTHY"
-    confidence = max(healthy_prob, infected_prob)
+    rows = [row for row, _ in passed]
+    if fused_fmd_logits is not None:
+        fmd_probs = _softmax(fused_fmd_logits[rows])
+        fmd_elapsed = None
+    else:
+        # Stage 2: FMD detection (gate-passing subset only)
+        t0 = time.perf_counter()
+        fmd_batch = batch[rows]
+        fmd_logits = _run_batched(
+            bundle.fmd, bundle.fmd_input, [bundle.fmd_output], fmd_batch, bundle.fmd_dynamic
+        )[0]
+        fmd_probs = _softmax(fmd_logits)
+        fmd_elapsed = (time.perf_counter() - t0) * 1000
+        print(f"[MODEL-SERVICE] FMD inference: {fmd_elapsed:.0f}ms (batch={len(passed)})")
 
-    return {
-        "ok": True,
-        "threshold": threshold,
-        "cattle_prob": cattle_prob,
-        "non_cattle_prob": non_cattle_prob,
-        "passed_gate": True,
-        "gate_rule": gate_rule,
-        "fmd": {
+    for k, (_, i) in enumerate(passed):
+        healthy_prob = float(fmd_probs[k][bundle.healthy_index])
+        infected_prob = float(fmd_probs[k][bundle.infected_index])
+        label = "INFECTED" if infected_prob > healthy_prob else "HEALTHY"
+        results[i]["fmd"] = {
             "label": label,
-            "confidence": confidence,
+            "confidence": max(healthy_prob, infected_prob),
             "probs": {"healthy": healthy_prob, "infected": infected_prob},
-        },
-    }
+        }
+        results[i]["timings_ms"]["fmd"] = fmd_elapsed
+
+    return results
+
+
+def run_inference(
+    image_bytes: bytes,
+    threshold: float,
+    spec: ModelSpec,
+    session_config: Optional[SessionConfig] = None,
+    quality_config: Optional[QualityConfig] = None,
+) -> dict:
+    """
+    Full pipeline: cattle gate then FMD.
+    Returns dict matching POST /infer response schema.
+    """
+    result = run_inference_batch([image_bytes], [threshold], spec, session_config, quality_config)[0]
+    if isinstance(result, Exception):
+        raise result
+    return result
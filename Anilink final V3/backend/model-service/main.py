@@ -1,50 +1,531 @@
 """Model Service: ONNX inference for cattle + FMD detection."""
 
+import asyncio
+import json
 import os
-from fastapi import FastAPI, File, Form, UploadFile, HTTPException
+import time
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Optional
+
+from fastapi import FastAPI, File, Form, Header, Request, UploadFile, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+import metrics
+from batching import DeadlineExceededError, Lane, MicroBatcher, QueueFullError
+from inference import _load_sessions, release_sessions, run_inference_batch, session_stats, variant_path
+from quality import QualityConfig
+from registry import ModelRegistry, ModelSpec, RegistryError, spec_from_paths, verify_checksums
+from sessions import SessionConfig
+from workers import create_executor, default_worker_count, prime_executor
+
+# fp32 (exported models) or int8 (quantize_models.py output, <name>.int8.onnx next to each model)
+MODEL_VARIANT = os.getenv("MODEL_VARIANT", "fp32")
+CATTLE_PATH = variant_path(os.getenv("MODEL_CATTLE_PATH", "/models/cattle_detection.onnx"), MODEL_VARIANT)
+FMD_PATH = variant_path(os.getenv("MODEL_FMD_PATH", "/models/fmd_detection.onnx"), MODEL_VARIANT)
+# Optional fused cattle+FMD graph (fuse_models.py). When set, it is served instead of the two models.
+FUSED_PATH = variant_path(os.getenv("MODEL_FUSED_PATH", ""), MODEL_VARIANT)
+
+# Versioned model registry (registry.py). When set, the version named by <dir>/current is served
+# instead of MODEL_*_PATH, and new versions are hot-swapped via POST /admin/reload or the
+# file watch (polls `current` every MODEL_REGISTRY_POLL_S seconds; 0 disables it).
+MODEL_REGISTRY_DIR = os.getenv("MODEL_REGISTRY_DIR", "")
+MODEL_REGISTRY_POLL_S = float(os.getenv("MODEL_REGISTRY_POLL_S", "10"))
+# Shared secret for /admin/* (X-Admin-Token header); empty = no check (internal network only)
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+
+registry = ModelRegistry(MODEL_REGISTRY_DIR, MODEL_VARIANT) if MODEL_REGISTRY_DIR else None
+
+
+def _initial_spec() -> ModelSpec:
+    if registry is None:
+        return spec_from_paths(CATTLE_PATH, FMD_PATH, FUSED_PATH)
+    try:
+        return registry.resolve()
+    except RegistryError as e:
+        print(f"[MODEL-SERVICE] Model registry: {e}")
+        return ModelSpec(version="unknown", cattle_path=CATTLE_PATH, fmd_path=FMD_PATH, fused_path=FUSED_PATH)
+
+
+# The model set new batches run on; replaced by _activate
+active_spec = _initial_spec()
+
+# Micro-batching: gather concurrent uploads for up to BATCH_WINDOW_MS or BATCH_MAX_SIZE images.
+# BATCH_MAX_SIZE=1 disables batching.
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "8"))
+BATCH_WINDOW_MS = float(os.getenv("BATCH_WINDOW_MS", "10"))
+
+# Executor: "thread" (shared sessions) or "process" (sessions loaded once per worker process).
+# Default worker count fills every core: cpu_count // ORT_INTRA_OP_THREADS.
+INFERENCE_EXECUTOR = os.getenv("INFERENCE_EXECUTOR", "thread")
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", str(min(2, os.cpu_count() or 1))))
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(default_worker_count(ORT_INTRA_OP_THREADS))))
+# Requests allowed to wait for a worker; beyond this /infer answers 429
+INFERENCE_QUEUE_DEPTH = int(os.getenv("INFERENCE_QUEUE_DEPTH", "64"))
+
+# Priority lanes (batching.py), chosen per request by the X-Priority header: interactive
+# (default for /infer) or bulk (default for /infer-batch and /infer-stream). Weighted fair
+# scheduling between them; bulk may hold at most PRIORITY_BULK_MAX_CONCURRENCY workers, so with
+# 2+ workers one is always free for interactive scans. With a single worker there is nothing to
+# reserve, so bulk batches are kept small (PRIORITY_BULK_MAX_BATCH_SIZE) to bound how long an
+# interactive scan waits behind one. Images that waited longer than the lane's deadline are
+# answered 429 / {"retryable": true} without running.
+PRIORITIES = ("interactive", "bulk")
+LANES = [
+    Lane(
+        "interactive",
+        weight=float(os.getenv("PRIORITY_INTERACTIVE_WEIGHT", "8")),
+        max_queue=INFERENCE_QUEUE_DEPTH,
+        deadline_ms=float(os.getenv("PRIORITY_INTERACTIVE_DEADLINE_MS", "5000")),
+    ),
+    Lane(
+        "bulk",
+        weight=float(os.getenv("PRIORITY_BULK_WEIGHT", "1")),
+        max_concurrency=int(os.getenv("PRIORITY_BULK_MAX_CONCURRENCY", str(max(1, INFERENCE_WORKERS - 1)))),
+        max_queue=int(os.getenv("PRIORITY_BULK_QUEUE_DEPTH", str(4 * INFERENCE_QUEUE_DEPTH))),
+        deadline_ms=float(os.getenv("PRIORITY_BULK_DEADLINE_MS", "60000")),
+        max_batch_size=int(
+            os.getenv("PRIORITY_BULK_MAX_BATCH_SIZE", str(2 if INFERENCE_WORKERS == 1 else BATCH_MAX_SIZE))
+        ),
+    ),
+]
+# Images accepted per POST /infer-batch (a chunk must fit in the queue to be accepted)
+INFER_BATCH_MAX_FILES = min(int(os.getenv("INFER_BATCH_MAX_FILES", "32")), LANES[1].max_queue)
+
+# ONNX Runtime session options (see sessions.py). ORT_OPTIMIZED_MODEL_DIR caches optimized graphs
+# on disk so cold starts skip graph optimization; ORT_WARMUP_RUNS run on a zero tensor at load.
+SESSION_CONFIG = SessionConfig(
+    intra_op_threads=ORT_INTRA_OP_THREADS,
+    inter_op_threads=int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+    execution_mode=os.getenv("ORT_EXECUTION_MODE", "sequential"),
+    graph_optimization=os.getenv("ORT_GRAPH_OPTIMIZATION", "all"),
+    enable_mem_pattern=os.getenv("ORT_ENABLE_MEM_PATTERN", "true").lower() == "true",
+    enable_cpu_mem_arena=os.getenv("ORT_ENABLE_CPU_MEM_ARENA", "true").lower() == "true",
+    optimized_model_dir=os.getenv("ORT_OPTIMIZED_MODEL_DIR", ""),
+    warmup_runs=int(os.getenv("ORT_WARMUP_RUNS", "2")),
+)
+
+# Image-quality pre-gate (quality.py): too-small/dark/bright/blurry/uniform photos are answered
+# without running the models. QUALITY_GATE=false disables it.
+QUALITY_CONFIG = QualityConfig(
+    enabled=os.getenv("QUALITY_GATE", "true").lower() == "true",
+    min_side=int(os.getenv("QUALITY_MIN_SIDE", "112")),
+    min_brightness=float(os.getenv("QUALITY_MIN_BRIGHTNESS", "25")),
+    max_brightness=float(os.getenv("QUALITY_MAX_BRIGHTNESS", "235")),
+    max_clipped_fraction=float(os.getenv("QUALITY_MAX_CLIPPED_FRACTION", "0.6")),
+    min_sharpness=float(os.getenv("QUALITY_MIN_SHARPNESS", "10")),
+    min_contrast=float(os.getenv("QUALITY_MIN_CONTRAST", "6")),
+)
+
+
+def _run_batch_for(spec: ModelSpec, bundle=None):
+    """
+    Batch callable for spec. Thread workers get the loaded bundle bound in, so a batch queued
+    before a swap runs on it even after release_sessions dropped it; process workers load their
+    own sessions and take the spec only.
+    """
+    return partial(
+        run_inference_batch,
+        spec=spec,
+        session_config=SESSION_CONFIG,
+        quality_config=QUALITY_CONFIG,
+        bundle=bundle,
+    )
+
+
+executor = create_executor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, active_spec, SESSION_CONFIG)
+batcher = MicroBatcher(
+    _run_batch_for(active_spec),
+    executor=executor,
+    max_batch_size=BATCH_MAX_SIZE,
+    window_ms=BATCH_WINDOW_MS,
+    concurrency=INFERENCE_WORKERS,
+    on_batch=metrics.observe_batch,
+    lanes=LANES,
+)
+metrics.register_gauge(
+    "model_service_queue_depth",
+    "Images waiting for a worker",
+    lambda: {(name,): depth for name, depth in batcher.lane_depths().items()},
+    ("priority",),
+)
+metrics.register_gauge("model_service_in_flight_batches", "Batches running on workers", lambda: batcher.in_flight)
+metrics.register_gauge(
+    "model_service_model_info", "Serving model version", lambda: {(active_spec.version,): 1}, ("version",)
+)
+
+
+def _missing_model() -> Optional[str]:
+    """Error message for the first model file that is not on disk, else None."""
+    return active_spec.missing()
+
+
+def _priority(header: Optional[str], default: str) -> str:
+    """Lane for a request's X-Priority header (400 for an unknown class)."""
+    priority = (header or default).strip().lower()
+    if priority not in PRIORITIES:
+        raise HTTPException(400, f"X-Priority must be one of {PRIORITIES}")
+    return priority
+
+
+def _rejected(e: QueueFullError) -> HTTPException:
+    """429 + Retry-After for a full lane or an image shed at its queue deadline."""
+    metrics.observe_error("deadline_exceeded" if isinstance(e, DeadlineExceededError) else "queue_full")
+    return HTTPException(429, str(e), headers={"Retry-After": "1"})
+
+
+def _outcome(outcome) -> dict:
+    """Per-image /infer-batch and /infer-stream entry for a result or exception."""
+    if isinstance(outcome, DeadlineExceededError):
+        metrics.observe_error("deadline_exceeded")
+        return {"ok": False, "error": str(outcome), "retryable": True}
+    if isinstance(outcome, Exception):
+        return {"ok": False, "error": f"Inference failed: {outcome}"}
+    return outcome
+
+
+def _threshold(threshold: Optional[float]) -> float:
+    """Request threshold, or the serving model version's default."""
+    return active_spec.default_threshold if threshold is None else threshold
+
+
+# Session load/warm-up stats reported by process workers at startup (and after each swap)
+worker_session_stats: list[dict] = []
+# Outcome of the last hot swap attempt, for GET /models
+last_reload: dict = {}
+_swap_lock = asyncio.Lock()
+
+
+async def _activate(spec: ModelSpec) -> dict:
+    """
+    Load and warm up spec next to the serving models, then switch new batches over to it.
+    Batches already dispatched finish on the previous models, which are released afterwards.
+    Raises RegistryError (or the load error) and keeps serving the previous version on failure.
+    """
+    global active_spec, executor
+    async with _swap_lock:
+        previous = active_spec
+        if spec == previous:
+            return {"version": spec.version, "previous": previous.version, "swapped": False}
+        missing = spec.missing()
+        if missing:
+            raise RegistryError(f"{spec.version}: {missing}")
+
+        t0 = time.perf_counter()
+        old_executor = bundle = None
+        if INFERENCE_EXECUTOR == "thread":
+            # Thread workers share sessions: load the new set in this process, next to the old one
+            bundle = await asyncio.to_thread(_load_sessions, spec, SESSION_CONFIG)
+            stats = [session_stats()]
+        else:
+            # Process workers are bound to one spec: start a new pool, switch, retire the old one
+            new_executor = create_executor(INFERENCE_EXECUTOR, INFERENCE_WORKERS, spec, SESSION_CONFIG)
+            try:
+                await asyncio.to_thread(verify_checksums, spec)
+                stats = await asyncio.to_thread(prime_executor, new_executor, INFERENCE_WORKERS)
+            except BaseException:
+                new_executor.shutdown(wait=False, cancel_futures=True)
+                raise
+            old_executor, executor = executor, new_executor
+            batcher.executor = new_executor
+            worker_session_stats[:] = stats
+
+        # No await between these two: the dispatcher sees either the old or the new pair
+        batcher.run_batch = _run_batch_for(spec, bundle)
+        active_spec = spec
+        load_ms = (time.perf_counter() - t0) * 1000
+        print(f"[MODEL-SERVICE] Swapped model {previous.version} -> {spec.version} ({load_ms:.0f}ms)")
+
+        if old_executor is not None:
+            # Let batches already running on the old pool finish before its workers exit
+            asyncio.create_task(asyncio.to_thread(old_executor.shutdown, True))
+        else:
+            release_sessions(keep=spec)
+        return {
+            "version": spec.version,
+            "previous": previous.version,
+            "swapped": True,
+            "load_ms": load_ms,
+            "sessions": stats,
+        }
+
+
+async def _reload(version: Optional[str] = None) -> dict:
+    """Resolve a registry version (default: current) and activate it; records the outcome."""
+    try:
+        spec = await asyncio.to_thread(registry.resolve, version)
+        result = await _activate(spec)
+        last_reload.clear()
+        last_reload.update(ok=True, at=time.time(), **{k: v for k, v in result.items() if k != "sessions"})
+        return result
+    except Exception as e:
+        last_reload.clear()
+        last_reload.update(ok=False, at=time.time(), version=version, error=str(e))
+        raise
+
+
+async def _watch_registry() -> None:
+    """
+    Poll the registry's `current` pointer and swap when it changes. Only pointer changes count,
+    so a version pinned with POST /admin/reload stays until `current` is moved again.
+    """
+    seen = await asyncio.to_thread(registry.current_version)
+    while True:
+        await asyncio.sleep(MODEL_REGISTRY_POLL_S)
+        try:
+            version = await asyncio.to_thread(registry.current_version)
+            if version and version != seen:
+                seen = version
+                await _reload(version)
+        except Exception as e:
+            print(f"[MODEL-SERVICE] Model registry watch: reload failed, still serving {active_spec.version}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load (and warm up) sessions before the first request
+    if _missing_model() is None:
+        if INFERENCE_EXECUTOR == "thread":
+            # Thread workers share one set of sessions
+            bundle = await asyncio.to_thread(_load_sessions, active_spec, SESSION_CONFIG)
+            batcher.run_batch = _run_batch_for(active_spec, bundle)
+        else:
+            worker_session_stats[:] = await asyncio.to_thread(
+                prime_executor, executor, INFERENCE_WORKERS
+            )
+    await batcher.start()
+    watcher = None
+    if registry is not None and MODEL_REGISTRY_POLL_S > 0:
+        watcher = asyncio.create_task(_watch_registry())
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    await batcher.stop()
+    executor.shutdown(wait=False, cancel_futures=True)
 
-from inference import run_inference
 
 app = FastAPI(
     title="AniLink Model Service",
     description="ONNX inference for cattle detection and FMD classification",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
-CATTLE_PATH = os.getenv("MODEL_CATTLE_PATH", "/models/cattle_detection.onnx")
-FMD_PATH = os.getenv("MODEL_FMD_PATH", "/models/fmd_detection.onnx")
+
+INSTRUMENTED_PATHS = ("/infer", "/infer-batch", "/infer-stream")
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    if request.url.path not in INSTRUMENTED_PATHS:
+        return await call_next(request)
+    t0 = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.request_seconds.observe(time.perf_counter() - t0, request.url.path)
+        metrics.requests_total.inc(request.url.path, str(status))
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus text format: stage latency histograms, batch sizes, outcomes, errors, queue."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/health")
 async def health():
-    return {"ok": True}
+    return {
+        "ok": True,
+        "executor": INFERENCE_EXECUTOR,
+        "variant": MODEL_VARIANT,
+        "model_version": active_spec.version,
+        "fused": bool(active_spec.fused_path),
+        "quality_gate": QUALITY_CONFIG.enabled,
+        "workers": INFERENCE_WORKERS,
+        "in_flight_batches": batcher.in_flight,
+        "queue_depth": batcher.lane_depths(),
+        "sessions": session_stats() if INFERENCE_EXECUTOR == "thread" else worker_session_stats,
+    }
+
+
+def _check_admin(token: Optional[str]) -> None:
+    if MODEL_ADMIN_TOKEN and token != MODEL_ADMIN_TOKEN:
+        raise HTTPException(403, "Invalid admin token")
+
+
+@app.get("/models")
+async def models():
+    """Serving model version, versions available in the registry and the last reload outcome."""
+    return {
+        "version": active_spec.version,
+        "registry": MODEL_REGISTRY_DIR or None,
+        "current": registry.current_version() if registry else None,
+        "available": registry.versions() if registry else [],
+        "default_threshold": active_spec.default_threshold,
+        "last_reload": last_reload or None,
+    }
+
+
+@app.post("/admin/reload")
+async def admin_reload(
+    version: Optional[str] = Form(None, description="Registry version (default: the `current` pointer)"),
+    x_admin_token: Optional[str] = Header(None),
+):
+    """Load a registry version in the background, warm it up and swap it in without downtime."""
+    _check_admin(x_admin_token)
+    if registry is None:
+        raise HTTPException(400, "MODEL_REGISTRY_DIR is not configured")
+    if _swap_lock.locked():
+        raise HTTPException(409, "A model swap is already in progress")
+    try:
+        return await _reload(version)
+    except RegistryError as e:
+        raise HTTPException(400, str(e)) from e
+    except Exception as e:
+        raise HTTPException(500, f"Model load failed, still serving {active_spec.version}: {e}") from e
 
 
 @app.post("/infer")
 async def infer(
     file: UploadFile = File(..., description="Image file (PNG, JPG)"),
-    threshold: float = Form(0.5, description="Cattle detection threshold"),
+    threshold: Optional[float] = Form(None, description="Cattle detection threshold (default: model version's)"),
+    x_priority: Optional[str] = Header(None, description="interactive (default) or bulk"),
 ):
     """Run cattle + FMD inference on uploaded image."""
+    priority = _priority(x_priority, "interactive")
     if not file.content_type or not file.content_type.startswith("image/"):
+        metrics.observe_error("invalid_upload")
         raise HTTPException(400, "File must be an image (PNG, JPG)")
 
+    t0 = time.perf_counter()
     contents = await file.read()
+    metrics.stage_seconds.observe(time.perf_counter() - t0, "upload_read")
     if not contents:
+        metrics.observe_error("invalid_upload")
         raise HTTPException(400, "Empty file")
 
-    if not os.path.exists(CATTLE_PATH):
-        raise HTTPException(503, f"Cattle model not found at {CATTLE_PATH}")
-    if not os.path.exists(FMD_PATH):
-        raise HTTPException(503, f"FMD model not found at {FMD_PATH}")
+    missing = _missing_model()
+    if missing:
+        metrics.observe_error("model_missing")
+        raise HTTPException(503, missing)
 
+    t0 = time.perf_counter()
     try:
-        result = run_inference(
-            contents,
-            threshold=threshold,
-            cattle_path=CATTLE_PATH,
-            fmd_path=FMD_PATH,
-        )
-        return result
+        result = await batcher.submit(contents, _threshold(threshold), priority)
+    except QueueFullError as e:
+        raise _rejected(e) from e
     except Exception as e:
+        # Already counted by type in metrics.observe_batch
         raise HTTPException(500, f"Inference failed: {e}") from e
+    result["timings_ms"]["total"] = (time.perf_counter() - t0) * 1000
+    return result
+
+
+async def _read_batch(files: list[UploadFile], threshold: float) -> tuple[list, list, list]:
+    """
+    Read a multi-file upload. Returns (results, items, positions): results has an error
+    entry for each unusable file (None elsewhere); items are (contents, threshold) pairs to
+    queue, and positions their indexes in the upload.
+    """
+    t0 = time.perf_counter()
+    results: list = [None] * len(files)
+    items = []
+    positions = []
+    for i, file in enumerate(files):
+        if not file.content_type or not file.content_type.startswith("image/"):
+            metrics.observe_error("invalid_upload")
+            results[i] = {"ok": False, "error": "File must be an image (PNG, JPG)"}
+            continue
+        contents = await file.read()
+        if not contents:
+            metrics.observe_error("invalid_upload")
+            results[i] = {"ok": False, "error": "Empty file"}
+            continue
+        items.append((contents, threshold))
+        positions.append(i)
+    metrics.stage_seconds.observe(time.perf_counter() - t0, "upload_read")
+    return results, items, positions
+
+
+@app.post("/infer-batch")
+async def infer_batch(
+    files: list[UploadFile] = File(..., description="Image files (PNG, JPG)"),
+    threshold: Optional[float] = Form(None, description="Cattle detection threshold (default: model version's)"),
+    x_priority: Optional[str] = Header(None, description="bulk (default) or interactive"),
+):
+    """
+    Run cattle + FMD inference on several images in one request.
+    Returns {"results": [...]} in upload order; each entry is an /infer response, or
+    {"ok": false, "error": ...} for an image that could not be read or decoded
+    ({"ok": false, "error": ..., "retryable": true} if it was shed at the queue deadline).
+    """
+    priority = _priority(x_priority, "bulk")
+    if len(files) > INFER_BATCH_MAX_FILES:
+        raise HTTPException(413, f"At most {INFER_BATCH_MAX_FILES} images per batch")
+
+    missing = _missing_model()
+    if missing:
+        metrics.observe_error("model_missing")
+        raise HTTPException(503, missing)
+
+    t0 = time.perf_counter()
+    results, items, positions = await _read_batch(files, _threshold(threshold))
+    try:
+        outcomes = await batcher.submit_many(items, priority) if items else []
+    except QueueFullError as e:
+        raise _rejected(e) from e
+
+    for i, outcome in zip(positions, outcomes):
+        results[i] = _outcome(outcome)
+    return {"results": results, "timings_ms": {"total": (time.perf_counter() - t0) * 1000}}
+
+
+@app.post("/infer-stream")
+async def infer_stream(
+    files: list[UploadFile] = File(..., description="Image files (PNG, JPG)"),
+    threshold: Optional[float] = Form(None, description="Cattle detection threshold (default: model version's)"),
+    x_priority: Optional[str] = Header(None, description="bulk (default) or interactive"),
+):
+    """
+    Like /infer-batch, but streams NDJSON lines {"index": i, "result": {...}} as each image
+    finishes. If the client disconnects, images not yet dispatched to a worker are dropped.
+    """
+    priority = _priority(x_priority, "bulk")
+    if len(files) > INFER_BATCH_MAX_FILES:
+        raise HTTPException(413, f"At most {INFER_BATCH_MAX_FILES} images per batch")
+
+    missing = _missing_model()
+    if missing:
+        metrics.observe_error("model_missing")
+        raise HTTPException(503, missing)
+
+    results, items, positions = await _read_batch(files, _threshold(threshold))
+    try:
+        futures = batcher.enqueue_many(items, priority) if items else []
+    except QueueFullError as e:
+        raise _rejected(e) from e
+
+    def line(index: int, result: dict) -> str:
+        return json.dumps({"index": index, "result": result}) + "\n"
+
+    async def stream():
+        pending = dict(zip(futures, positions))
+        try:
+            for index, result in enumerate(results):
+                if result is not None:
+                    yield line(index, result)
+            while pending:
+                done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    yield line(index, _outcome(future.exception() or future.result()))
+        finally:
+            # Client went away (or the stream failed): drop work that has not started yet
+            for future in pending:
+                future.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
@@ -0,0 +1,198 @@
+"""
+Prometheus metrics for the model-service (text exposition format, served on GET /metrics).
+
+Stage timings come back from the inference workers in each result's timings_ms, so all
+metrics are recorded in the API process, whichever executor runs inference; no
+multiprocess collector is needed. Everything is updated from the event loop thread.
+
+Stages (model_service_stage_seconds{stage=...}):
+  upload_read  reading the uploaded files (per request)
+  decode       JPEG/PNG decode + resize (per image)
+  preprocess   normalization into the batch tensor, excluding decode (per image)
+  queue        wait in the micro-batch queue (per image)
+  cattle, fmd  session runs (per batch; fmd on the gate-passing subset)
+  fused        fused cattle+FMD session run (per batch, MODEL_FUSED_PATH)
+Total time per request is model_service_request_seconds{endpoint=...} (for /infer-stream,
+until the response starts); queue wait per priority lane is model_service_queue_seconds.
+Gauges (queue depth per lane, in-flight batches, serving model version) are read at scrape time.
+"""
+
+import bisect
+from typing import Callable, Optional
+
+# Seconds; covers sub-millisecond preprocessing up to multi-second queueing under overload
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Gauge:
+    """Gauge read from a callback at scrape time (with labelnames, read returns {labels: value})."""
+
+    def __init__(self, name: str, help: str, read: Callable, labelnames: tuple = ()):
+        self.name, self.help, self.read, self.labelnames = name, help, read, labelnames
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        values = self.read() if self.labelnames else {(): self.read()}
+        for labels, value in values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, labelnames
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = f'le="{_number(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.register(
+    Histogram("model_service_stage_seconds", "Latency per pipeline stage", ("stage",))
+)
+batch_size = registry.register(
+    Histogram(
+        "model_service_batch_size", "Images per batch run on a worker", buckets=BATCH_SIZE_BUCKETS
+    )
+)
+batches_total = registry.register(
+    Counter("model_service_batches_total", "Batches run, by priority lane", ("priority",))
+)
+queue_seconds = registry.register(
+    Histogram("model_service_queue_seconds", "Time in the micro-batch queue, by priority lane", ("priority",))
+)
+images_total = registry.register(Counter("model_service_images_total", "Images run through the models"))
+gate_total = registry.register(
+    Counter("model_service_gate_total", "Cattle gate outcomes (pass, fail, low_quality)", ("result",))
+)
+quality_issues_total = registry.register(
+    Counter("model_service_quality_issues_total", "Images rejected by the quality pre-gate, by issue", ("issue",))
+)
+fmd_label_total = registry.register(
+    Counter("model_service_fmd_label_total", "FMD predictions by label", ("label",))
+)
+errors_total = registry.register(
+    Counter("model_service_errors_total", "Errors by type", ("type",))
+)
+requests_total = registry.register(
+    Counter("model_service_requests_total", "Requests by endpoint and status", ("endpoint", "status"))
+)
+request_seconds = registry.register(
+    Histogram("model_service_request_seconds", "Total request handling time", ("endpoint",))
+)
+
+
+def register_gauge(name: str, help: str, read: Callable, labelnames: tuple = ()) -> None:
+    registry.register(Gauge(name, help, read, labelnames))
+
+
+def observe_error(kind: str) -> None:
+    errors_total.inc(kind)
+
+
+def observe_batch(results: list, priority: str = "default") -> None:
+    """Record one batch from MicroBatcher: batch size, per-image stages and outcomes, model runs."""
+    batch_size.observe(len(results))
+    batches_total.inc(priority)
+    session_runs: dict[str, Optional[float]] = {}
+    for result in results:
+        if isinstance(result, Exception):
+            observe_error(type(result).__name__)
+            continue
+        images_total.inc()
+        timings = result.get("timings_ms", {})
+        decode_ms = timings.get("decode")
+        if decode_ms is not None:
+            stage_seconds.observe(decode_ms / 1000, "decode")
+            stage_seconds.observe(max(0.0, timings["preprocess"] - decode_ms) / 1000, "preprocess")
+        if timings.get("queue") is not None:
+            stage_seconds.observe(timings["queue"] / 1000, "queue")
+            queue_seconds.observe(timings["queue"] / 1000, priority)
+        # Session timings are per batch (repeated on every image): record each once
+        for stage in ("cattle", "fmd", "fused"):
+            if timings.get(stage) is not None:
+                session_runs.setdefault(stage, timings[stage])
+        quality = result.get("quality")
+        if quality and not quality["passed"]:
+            gate_total.inc("low_quality")
+            for issue in quality["issues"]:
+                quality_issues_total.inc(issue)
+            continue
+        gate_total.inc("pass" if result.get("passed_gate") else "fail")
+        if result.get("fmd"):
+            fmd_label_total.inc(result["fmd"]["label"])
+    for stage, elapsed_ms in session_runs.items():
+        stage_seconds.observe(elapsed_ms / 1000, stage)
+
+
+def render() -> str:
+    return registry.render()
@@ -0,0 +1,82 @@
+"""
+Image-quality pre-gate, run on the decoded 224x224 image before any ONNX session.
+Photos that are too small, dark/bright, blurry or nearly uniform are rejected with
+reason LOW_QUALITY instead of paying for cattle + FMD inference and returning a
+misleading confidence. All checks are NumPy on one 224x224 grayscale frame (~1 ms).
+
+Checks (thresholds from QUALITY_* env vars in main.py):
+  too_small   shorter side of the original upload < min_side pixels
+  too_dark    mean luminance < min_brightness, or most pixels crushed to black
+  too_bright  mean luminance > max_brightness, or most pixels clipped to white
+  blurry      variance of the Laplacian < min_sharpness
+  uniform     luminance std < min_contrast (lens cap, blank wall, solid frame)
+"""
+
+from dataclasses import dataclass
+
+import numpy as np
+from PIL import Image
+
+# ITU-R BT.601 luma, as PIL's "L" conversion
+_LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+@dataclass(frozen=True)
+class QualityConfig:
+    """Pre-gate thresholds (frozen and picklable, so it can be passed to spawned workers)."""
+
+    enabled: bool = True
+    min_side: int = 112
+    min_brightness: float = 25.0
+    max_brightness: float = 235.0
+    max_clipped_fraction: float = 0.6
+    min_sharpness: float = 10.0
+    min_contrast: float = 6.0
+
+
+def _laplacian_variance(gray: np.ndarray) -> float:
+    """Variance of the 4-neighbour Laplacian over the interior pixels."""
+    lap = (
+        gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4.0 * gray[1:-1, 1:-1]
+    )
+    return float(lap.var())
+
+
+def assess(img: Image.Image, original_size: tuple[int, int], config: QualityConfig) -> dict:
+    """
+    Quality of a decoded, resized RGB image. Returns
+    {"passed": bool, "issues": [...], "metrics": {...}} (issues empty when passed).
+    """
+    gray = np.asarray(img, dtype=np.float32) @ _LUMA
+    brightness = float(gray.mean())
+    contrast = float(gray.std())
+    dark_fraction = float((gray <= 16).mean())
+    bright_fraction = float((gray >= 240).mean())
+    sharpness = _laplacian_variance(gray)
+
+    issues = []
+    if min(original_size) < config.min_side:
+        issues.append("too_small")
+    if brightness < config.min_brightness or dark_fraction > config.max_clipped_fraction:
+        issues.append("too_dark")
+    elif brightness > config.max_brightness or bright_fraction > config.max_clipped_fraction:
+        issues.append("too_bright")
+    if contrast < config.min_contrast:
+        issues.append("uniform")
+    elif sharpness < config.min_sharpness:
+        # A uniform frame is also "blurry"; report only the more specific issue
+        issues.append("blurry")
+
+    return {
+        "passed": not issues,
+        "issues": issues,
+        "metrics": {
+            "width": original_size[0],
+            "height": original_size[1],
+            "brightness": round(brightness, 1),
+            "contrast": round(contrast, 1),
+            "sharpness": round(sharpness, 1),
+            "dark_fraction": round(dark_fraction, 3),
+            "bright_fraction": round(bright_fraction, 3),
+        },
+    }
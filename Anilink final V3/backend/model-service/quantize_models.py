@@ -0,0 +1,272 @@
+"""
+INT8 quantization of the cattle / FMD models, with an accuracy + latency gate.
+
+quantize: writes <name>.int8.onnx next to the FP32 model (the path MODEL_VARIANT=int8 loads).
+  - static (default): QDQ, per-channel INT8 weights, activations calibrated on real images
+  - dynamic: weights only, activation ranges computed at run time (no calibration set needed).
+    Conv becomes ConvInteger, which is often slower than FP32 on CPU; check it with evaluate.
+evaluate: FP32 vs INT8 on a labelled class-folder dataset; reports accuracy, prediction
+  agreement and p50/p95 single-image latency, and exits non-zero if the gate fails.
+
+Datasets use the training scripts' layouts (FMDDataset / CattleDetectionDataset):
+  --model cattle: DIR/cattle/*, DIR/non_cattle/*   (label 0 = cattle, 1 = non_cattle)
+  --model fmd:    DIR/0/*, DIR/1/*                 (label 0 = healthy, 1 = infected)
+Images go through utils.load_and_preprocess, exactly as the service preprocesses uploads.
+
+Usage:
+    python quantize_models.py quantize --model cattle --fp32 ../models/cattle_detection.onnx \
+        --calib-dir "/data/cattle/Validation data"
+    python quantize_models.py evaluate --model cattle --fp32 ../models/cattle_detection.onnx \
+        --data-dir "/data/cattle/Test_Data" --max-accuracy-drop 0.5 --min-speedup 2
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+import numpy as np
+
+from inference import _softmax, variant_path
+from utils import load_and_preprocess
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+# Class folders per model, in label order (matches the training datasets)
+CLASS_DIRS = {
+    "cattle": ("cattle", "non_cattle"),
+    "fmd": ("0", "1"),
+}
+
+
+def dataset_images(data_dir: str, model: str) -> list[tuple[str, int]]:
+    """(path, label) pairs from a class-folder dataset."""
+    samples = []
+    for label, class_name in enumerate(CLASS_DIRS[model]):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        for name in sorted(os.listdir(class_dir)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                samples.append((os.path.join(class_dir, name), label))
+    return samples
+
+
+def _load_tensor(path: str) -> np.ndarray:
+    with open(path, "rb") as f:
+        return load_and_preprocess(f.read())
+
+
+def _session(path: str, intra_op_threads: int):
+    import onnxruntime as ort
+
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+
+def _class_balanced_sample(samples: list, size: int, seed: int = 0) -> list:
+    """Up to `size` samples with classes interleaved, so calibration sees both."""
+    rng = random.Random(seed)
+    by_label: dict[int, list] = {}
+    for sample in samples:
+        by_label.setdefault(sample[1], []).append(sample)
+    for group in by_label.values():
+        rng.shuffle(group)
+    picked = []
+    while len(picked) < size and any(by_label.values()):
+        for group in by_label.values():
+            if group and len(picked) < size:
+                picked.append(group.pop())
+    return picked
+
+
+def _calibration_reader(input_name: str, paths: list[str]):
+    from onnxruntime.quantization import CalibrationDataReader
+
+    class ImageFolderReader(CalibrationDataReader):
+        """Feeds preprocessed calibration images one at a time (the graphs have batch 1)."""
+
+        def __init__(self):
+            self._paths = iter(paths)
+
+        def get_next(self):
+            for path in self._paths:
+                try:
+                    return {input_name: _load_tensor(path)}
+                except Exception as e:
+                    print(f"  skipping unreadable calibration image {path}: {e}")
+            return None
+
+    return ImageFolderReader()
+
+
+def quantize(args) -> None:
+    from onnxruntime.quantization import (
+        CalibrationMethod,
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    out = args.out or variant_path(args.fp32, "int8")
+    source = args.fp32
+    if not args.skip_preprocess:
+        # Shape inference + graph cleanup first, as recommended for ORT quantization
+        source = out + ".prep.onnx"
+        quant_pre_process(args.fp32, source, skip_symbolic_shape=True)
+
+    t0 = time.perf_counter()
+    try:
+        if args.mode == "dynamic":
+            quantize_dynamic(source, out, weight_type=QuantType.QInt8, per_channel=True)
+        else:
+            if not args.calib_dir:
+                sys.exit("--calib-dir is required for static quantization")
+            samples = _class_balanced_sample(dataset_images(args.calib_dir, args.model), args.calib_size)
+            if not samples:
+                sys.exit(f"No {args.model} images found under {args.calib_dir}")
+            print(f"Calibrating on {len(samples)} images from {args.calib_dir}")
+            input_name = _session(source, 0).get_inputs()[0].name
+            quantize_static(
+                source,
+                out,
+                _calibration_reader(input_name, [path for path, _ in samples]),
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                calibrate_method=CalibrationMethod[args.calibrate_method],
+            )
+    finally:
+        if source != args.fp32 and os.path.exists(source):
+            os.remove(source)
+    elapsed = time.perf_counter() - t0
+    print(
+        f"Wrote {out} ({os.path.getsize(out) / 1e6:.1f}MB, "
+        f"fp32 {os.path.getsize(args.fp32) / 1e6:.1f}MB) in {elapsed:.0f}s"
+    )
+
+
+def _predict(session, tensors: list[np.ndarray]) -> np.ndarray:
+    input_name = session.get_inputs()[0].name
+    logits = np.concatenate([session.run(None, {input_name: x})[0] for x in tensors])
+    return _softmax(logits)
+
+
+def _latency_ms(session, tensor: np.ndarray, runs: int) -> list[float]:
+    input_name = session.get_inputs()[0].name
+    for _ in range(5):  # warm-up
+        session.run(None, {input_name: tensor})
+    samples = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        session.run(None, {input_name: tensor})
+        samples.append((time.perf_counter() - t0) * 1000)
+    return samples
+
+
+def _p95(samples: list[float]) -> float:
+    return sorted(samples)[max(0, int(round(0.95 * len(samples))) - 1)]
+
+
+def evaluate(args) -> None:
+    int8_path = args.int8 or variant_path(args.fp32, "int8")
+    samples = dataset_images(args.data_dir, args.model)
+    if args.limit:
+        samples = _class_balanced_sample(samples, args.limit)
+    if not samples:
+        sys.exit(f"No {args.model} images found under {args.data_dir}")
+
+    tensors, labels = [], []
+    for path, label in samples:
+        try:
+            tensors.append(_load_tensor(path))
+            labels.append(label)
+        except Exception as e:
+            print(f"  skipping unreadable image {path}: {e}")
+    labels = np.array(labels)
+
+    report = {"model": args.model, "images": len(labels), "data_dir": args.data_dir}
+    predictions = {}
+    for variant, path in (("fp32", args.fp32), ("int8", int8_path)):
+        session = _session(path, args.intra_op_threads)
+        probs = _predict(session, tensors)
+        predictions[variant] = probs.argmax(axis=1)
+        latency = _latency_ms(session, tensors[0], args.runs)
+        report[variant] = {
+            "path": path,
+            "accuracy": float((predictions[variant] == labels).mean()),
+            "latency_p50_ms": statistics.median(latency),
+            "latency_p95_ms": _p95(latency),
+            "size_mb": os.path.getsize(path) / 1e6,
+        }
+
+    fp32, int8 = report["fp32"], report["int8"]
+    report["accuracy_drop_pct"] = (fp32["accuracy"] - int8["accuracy"]) * 100
+    report["agreement"] = float((predictions["fp32"] == predictions["int8"]).mean())
+    report["speedup_p50"] = fp32["latency_p50_ms"] / int8["latency_p50_ms"]
+    report["passed"] = (
+        report["accuracy_drop_pct"] <= args.max_accuracy_drop and report["speedup_p50"] >= args.min_speedup
+    )
+
+    print(f"{args.model}: {len(labels)} images, intra_op_threads={args.intra_op_threads}")
+    for variant in ("fp32", "int8"):
+        r = report[variant]
+        print(
+            f"  {variant}: accuracy {r['accuracy'] * 100:6.2f}%  p50 {r['latency_p50_ms']:6.2f}ms  "
+            f"p95 {r['latency_p95_ms']:6.2f}ms  {r['size_mb']:.1f}MB"
+        )
+    print(
+        f"  accuracy drop {report['accuracy_drop_pct']:+.2f} pts (max {args.max_accuracy_drop}), "
+        f"agreement {report['agreement'] * 100:.2f}%, speedup x{report['speedup_p50']:.2f} "
+        f"(min {args.min_speedup}) -> {'PASS' if report['passed'] else 'FAIL'}"
+    )
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    if not report["passed"]:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Quantize and evaluate INT8 model variants")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    q = sub.add_parser("quantize", help="Write an INT8 variant of an FP32 model")
+    q.add_argument("--model", choices=sorted(CLASS_DIRS), required=True)
+    q.add_argument("--fp32", required=True, help="FP32 .onnx model")
+    q.add_argument("--out", help="Output path (default: <name>.int8.onnx next to the FP32 model)")
+    q.add_argument("--mode", choices=("static", "dynamic"), default="static")
+    q.add_argument("--calib-dir", help="Class-folder dataset for static calibration")
+    q.add_argument("--calib-size", type=int, default=300, help="Calibration images (class-balanced)")
+    q.add_argument(
+        "--calibrate-method", choices=("MinMax", "Entropy", "Percentile"), default="MinMax"
+    )
+    q.add_argument("--skip-preprocess", action="store_true", help="Skip ORT quant_pre_process")
+    q.set_defaults(func=quantize)
+
+    e = sub.add_parser("evaluate", help="Compare FP32 vs INT8 accuracy and latency")
+    e.add_argument("--model", choices=sorted(CLASS_DIRS), required=True)
+    e.add_argument("--fp32", required=True, help="FP32 .onnx model")
+    e.add_argument("--int8", help="INT8 model (default: <name>.int8.onnx next to the FP32 model)")
+    e.add_argument("--data-dir", required=True, help="Labelled class-folder dataset (held out)")
+    e.add_argument("--limit", type=int, default=0, help="Evaluate on at most N images (0 = all)")
+    e.add_argument("--runs", type=int, default=200, help="Timed single-image runs per variant")
+    e.add_argument("--intra-op-threads", type=int, default=int(os.getenv("ORT_INTRA_OP_THREADS", "2")))
+    e.add_argument("--max-accuracy-drop", type=float, default=0.5, help="Percentage points")
+    e.add_argument("--min-speedup", type=float, default=1.0, help="Required p50 FP32/INT8 ratio")
+    e.add_argument("--report", help="Write the report as JSON")
+    e.set_defaults(func=evaluate)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
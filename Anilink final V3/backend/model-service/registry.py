@@ -0,0 +1,311 @@
+"""
+Versioned model registry for hot-swapping models without a restart.
+
+Layout of MODEL_REGISTRY_DIR:
+    current                      text file with the version to serve (the file watch polls it)
+    <version>/manifest.json      checksums, input shape, class order and gate thresholds
+    <version>/cattle_detection.onnx, fmd_detection.onnx (+ .int8.onnx / fused_detection.onnx)
+
+manifest.json:
+    {
+      "version": "2026-10-17",
+      "created_at": "2026-10-17T09:30:00+00:00",
+      "models": {
+        "cattle": {"file": "cattle_detection.onnx", "input_shape": [1, 3, 224, 224]},
+        "fmd": {"file": "fmd_detection.onnx", "input_shape": [1, 3, 224, 224]},
+        "fused": {"file": "fused_detection.onnx", "input_shape": [1, 3, 224, 224]}   (optional)
+      },
+      "classes": {"cattle": ["cattle", "non_cattle"], "fmd": ["healthy", "infected"]},
+      "thresholds": {"cattle": 0.5, "non_cattle_max": 0.4, "strict_cattle_min": 0.8},
+      "checksums": {"cattle_detection.onnx": "<sha256>", ...}
+    }
+
+Without MODEL_REGISTRY_DIR the service builds a ModelSpec from MODEL_*_PATH as before.
+
+Usage:
+    python registry.py publish --registry /models/registry --version 2026-10-17 \
+        --cattle cattle_detection.onnx --fmd fmd_detection.onnx [--fused fused.onnx] [--activate]
+    python registry.py activate --registry /models/registry --version 2026-10-17
+    python registry.py list --registry /models/registry
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Optional
+
+MANIFEST = "manifest.json"
+CURRENT = "current"
+
+DEFAULT_CLASSES = {"cattle": ("cattle", "non_cattle"), "fmd": ("healthy", "infected")}
+DEFAULT_THRESHOLDS = {"cattle": 0.5, "non_cattle_max": 0.4, "strict_cattle_min": 0.8}
+
+
+class RegistryError(Exception):
+    """A version is missing, incomplete or does not match its manifest."""
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    One servable model set: file paths plus what the manifest says about them.
+    Frozen and picklable, so it can be passed to spawned workers.
+    """
+
+    version: str
+    cattle_path: str = ""
+    fmd_path: str = ""
+    fused_path: str = ""
+    cattle_classes: tuple = DEFAULT_CLASSES["cattle"]
+    fmd_classes: tuple = DEFAULT_CLASSES["fmd"]
+    default_threshold: float = DEFAULT_THRESHOLDS["cattle"]
+    non_cattle_max: float = DEFAULT_THRESHOLDS["non_cattle_max"]
+    strict_cattle_min: float = DEFAULT_THRESHOLDS["strict_cattle_min"]
+    input_shape: Optional[tuple] = None  # from the manifest; None = not checked
+    checksums: tuple = ()  # ((path, sha256), ...) verified before loading
+
+    def paths(self) -> list[str]:
+        return [self.fused_path] if self.fused_path else [self.cattle_path, self.fmd_path]
+
+    def missing(self) -> Optional[str]:
+        """Error message for the first model file that is not on disk, else None."""
+        if self.fused_path:
+            return None if os.path.exists(self.fused_path) else f"Fused model not found at {self.fused_path}"
+        if not os.path.exists(self.cattle_path):
+            return f"Cattle model not found at {self.cattle_path}"
+        if not os.path.exists(self.fmd_path):
+            return f"FMD model not found at {self.fmd_path}"
+        return None
+
+
+def sha256_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def verify_checksums(spec: ModelSpec) -> None:
+    """Raise RegistryError if a model file differs from the checksum recorded in its manifest."""
+    for path, expected in spec.checksums:
+        if not os.path.exists(path):
+            raise RegistryError(f"{spec.version}: {path} not found")
+        actual = sha256_file(path)
+        if actual != expected:
+            raise RegistryError(f"{spec.version}: checksum mismatch for {os.path.basename(path)}")
+
+
+def check_input_shape(spec: ModelSpec, session) -> None:
+    """Raise RegistryError if a session's input does not match the manifest's input_shape."""
+    if spec.input_shape is None:
+        return
+    actual = session.get_inputs()[0].shape
+    expected = list(spec.input_shape)
+    mismatch = len(actual) != len(expected) or any(
+        isinstance(a, int) and isinstance(e, int) and a != e for a, e in zip(actual, expected)
+    )
+    if mismatch:
+        raise RegistryError(f"{spec.version}: model input {actual} does not match manifest {expected}")
+
+
+class ModelRegistry:
+    """Read-only view of a registry directory (see module docstring)."""
+
+    def __init__(self, root: str, variant: str = "fp32"):
+        self.root = root
+        self.variant = variant
+
+    def versions(self) -> list[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(
+            name for name in os.listdir(self.root) if os.path.isfile(os.path.join(self.root, name, MANIFEST))
+        )
+
+    def current_version(self) -> Optional[str]:
+        """Version named by the `current` pointer (or the newest one if there is no pointer)."""
+        try:
+            with open(os.path.join(self.root, CURRENT)) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            versions = self.versions()
+            return versions[-1] if versions else None
+
+    def manifest(self, version: str) -> dict:
+        path = os.path.join(self.root, version, MANIFEST)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise RegistryError(f"Unknown model version {version} (no {path})") from None
+        except json.JSONDecodeError as e:
+            raise RegistryError(f"{version}: invalid manifest: {e}") from e
+
+    def resolve(self, version: Optional[str] = None) -> ModelSpec:
+        """ModelSpec for a version (default: current). MODEL_VARIANT picks <name>.int8.onnx files."""
+        from inference import variant_path
+
+        version = version or self.current_version()
+        if not version:
+            raise RegistryError(f"No model versions in {self.root}")
+        manifest = self.manifest(version)
+        base = os.path.join(self.root, version)
+        models = manifest.get("models", {})
+        checksums = manifest.get("checksums", {})
+
+        paths = {}
+        for role in ("cattle", "fmd", "fused"):
+            entry = models.get(role)
+            if entry:
+                paths[role] = variant_path(os.path.join(base, entry["file"]), self.variant)
+        if "fused" not in paths and not ("cattle" in paths and "fmd" in paths):
+            raise RegistryError(f"{version}: manifest needs models.cattle and models.fmd, or models.fused")
+        served = [paths["fused"]] if "fused" in paths else [paths["cattle"], paths["fmd"]]
+        for path in served:
+            if os.path.basename(path) not in checksums:
+                raise RegistryError(f"{version}: no checksum for {os.path.basename(path)}")
+
+        classes = {**DEFAULT_CLASSES, **manifest.get("classes", {})}
+        thresholds = {**DEFAULT_THRESHOLDS, **manifest.get("thresholds", {})}
+        shape = next((models[r].get("input_shape") for r in ("fused", "cattle") if r in models), None)
+        return ModelSpec(
+            version=manifest.get("version", version),
+            cattle_path=paths.get("cattle", ""),
+            fmd_path=paths.get("fmd", ""),
+            fused_path=paths.get("fused", ""),
+            cattle_classes=tuple(classes["cattle"]),
+            fmd_classes=tuple(classes["fmd"]),
+            default_threshold=float(thresholds["cattle"]),
+            non_cattle_max=float(thresholds["non_cattle_max"]),
+            strict_cattle_min=float(thresholds["strict_cattle_min"]),
+            input_shape=tuple(shape) if shape else None,
+            checksums=tuple((path, checksums[os.path.basename(path)]) for path in served),
+        )
+
+
+def spec_from_paths(cattle_path: str, fmd_path: str, fused_path: str = "") -> ModelSpec:
+    """ModelSpec for MODEL_*_PATH deployments without a registry; version = file fingerprints."""
+    from sessions import file_fingerprint
+
+    if fused_path:
+        version = f"fused:{file_fingerprint(fused_path)}" if os.path.exists(fused_path) else "unknown"
+    elif os.path.exists(cattle_path) and os.path.exists(fmd_path):
+        version = f"cattle:{file_fingerprint(cattle_path)}+fmd:{file_fingerprint(fmd_path)}"
+    else:
+        version = "unknown"
+    return ModelSpec(version=version, cattle_path=cattle_path, fmd_path=fmd_path, fused_path=fused_path)
+
+
+def _input_shape(path: str) -> Optional[list]:
+    import onnxruntime as ort
+
+    session = ort.InferenceSession(path, providers=["CPUExecutionProvider"])
+    return [d if isinstance(d, int) else None for d in session.get_inputs()[0].shape]
+
+
+def publish(args) -> None:
+    target = os.path.join(args.registry, args.version)
+    if os.path.exists(target):
+        sys.exit(f"Version {args.version} already exists in {args.registry}")
+    sources = {role: getattr(args, role) for role in ("cattle", "fmd", "fused") if getattr(args, role)}
+    if "fused" not in sources and not ("cattle" in sources and "fmd" in sources):
+        sys.exit("Pass --cattle and --fmd, or --fused")
+
+    # Stage in a temp dir and rename, so the watcher never sees a half-copied version
+    staging = target + ".tmp"
+    os.makedirs(staging)
+    models, checksums = {}, {}
+    for role, source in sources.items():
+        name = os.path.basename(source)
+        siblings = [source] + [p for p in (source + ".data",) if os.path.exists(p)]
+        # Copy INT8 siblings (quantize_models.py output) along with the FP32 file
+        root, ext = os.path.splitext(source)
+        siblings += [p for p in (f"{root}.int8{ext}",) if os.path.exists(p)]
+        for path in siblings:
+            shutil.copy2(path, os.path.join(staging, os.path.basename(path)))
+            checksums[os.path.basename(path)] = sha256_file(path)
+        models[role] = {"file": name, "input_shape": _input_shape(source)}
+
+    manifest = {
+        "version": args.version,
+        "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "models": models,
+        "classes": {k: list(v) for k, v in DEFAULT_CLASSES.items()},
+        "thresholds": {
+            "cattle": args.threshold,
+            "non_cattle_max": args.non_cattle_max,
+            "strict_cattle_min": args.strict_cattle_min,
+        },
+        "checksums": checksums,
+    }
+    if args.notes:
+        manifest["notes"] = args.notes
+    with open(os.path.join(staging, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(staging, target)
+    print(f"Published {args.version} to {target}")
+    if args.activate:
+        activate(args)
+
+
+def activate(args) -> None:
+    registry = ModelRegistry(args.registry)
+    registry.resolve(args.version)  # fail here rather than in the service
+    tmp = os.path.join(args.registry, f".{CURRENT}.tmp")
+    with open(tmp, "w") as f:
+        f.write(args.version + "\n")
+    os.replace(tmp, os.path.join(args.registry, CURRENT))
+    print(f"Current version is now {args.version}")
+
+
+def list_versions(args) -> None:
+    registry = ModelRegistry(args.registry)
+    current = registry.current_version()
+    for version in registry.versions():
+        manifest = registry.manifest(version)
+        marker = "*" if version == current else " "
+        roles = ",".join(sorted(manifest.get("models", {})))
+        print(f"{marker} {version:<24} {manifest.get('created_at', ''):<26} {roles}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the model-service model registry")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("publish", help="Copy models into a new version directory with a manifest")
+    p.add_argument("--registry", required=True)
+    p.add_argument("--version", required=True)
+    p.add_argument("--cattle", help="cattle_detection.onnx")
+    p.add_argument("--fmd", help="fmd_detection.onnx")
+    p.add_argument("--fused", help="fused_detection.onnx (fuse_models.py)")
+    p.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLDS["cattle"], help="Default cattle threshold")
+    p.add_argument("--non-cattle-max", type=float, default=DEFAULT_THRESHOLDS["non_cattle_max"])
+    p.add_argument("--strict-cattle-min", type=float, default=DEFAULT_THRESHOLDS["strict_cattle_min"])
+    p.add_argument("--notes", help="Free text stored in the manifest (e.g. training run)")
+    p.add_argument("--activate", action="store_true", help="Point `current` at the new version")
+    p.set_defaults(func=publish)
+
+    a = sub.add_parser("activate", help="Point `current` at a version (picked up by the file watch)")
+    a.add_argument("--registry", required=True)
+    a.add_argument("--version", required=True)
+    a.set_defaults(func=activate)
+
+    ls = sub.add_parser("list", help="List versions (* = current)")
+    ls.add_argument("--registry", required=True)
+    ls.set_defaults(func=list_versions)
+
+    args = parser.parse_args()
+    try:
+        args.func(args)
+    except RegistryError as e:
+        sys.exit(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""
+ONNX Runtime session construction for the model-service.
+- SessionConfig: thread counts, execution mode, graph optimization level, memory pattern/arena
+- Optimized-graph cache: the graph ORT produces after optimization is serialized to
+  ORT_OPTIMIZED_MODEL_DIR, keyed by model hash + ORT version + level + CPU arch, so later
+  cold starts load it with optimization disabled instead of re-running the optimizer.
+  Level "all" bakes in CPU-specific layouts, so keep the directory on each host's local disk.
+- Warm-up: a few runs on a zero tensor so the first real scan skips lazy initialization
+"""
+
+import hashlib
+import os
+import platform
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+GRAPH_OPTIMIZATION_LEVELS = ("disable", "basic", "extended", "all")
+EXECUTION_MODES = ("sequential", "parallel")
+
+
+@dataclass(frozen=True)
+class SessionConfig:
+    """ORT session settings (frozen and picklable, so it can be passed to spawned workers)."""
+
+    intra_op_threads: int = 0  # 0 = ORT default (one per physical core)
+    inter_op_threads: int = 0  # only used with execution_mode="parallel"
+    execution_mode: str = "sequential"
+    graph_optimization: str = "all"
+    enable_mem_pattern: bool = True
+    enable_cpu_mem_arena: bool = True
+    optimized_model_dir: str = ""  # "" disables the optimized-graph cache
+    warmup_runs: int = 2
+
+    def __post_init__(self):
+        if self.graph_optimization not in GRAPH_OPTIMIZATION_LEVELS:
+            raise ValueError(
+                f"Unknown ORT_GRAPH_OPTIMIZATION: {self.graph_optimization}. "
+                f"Choose one of {GRAPH_OPTIMIZATION_LEVELS}"
+            )
+        if self.execution_mode not in EXECUTION_MODES:
+            raise ValueError(
+                f"Unknown ORT_EXECUTION_MODE: {self.execution_mode}. Choose one of {EXECUTION_MODES}"
+            )
+
+
+def _session_options(config: SessionConfig, optimization: Optional[str] = None):
+    import onnxruntime as ort
+
+    levels = {
+        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = config.intra_op_threads
+    options.inter_op_num_threads = config.inter_op_threads
+    options.execution_mode = (
+        ort.ExecutionMode.ORT_PARALLEL
+        if config.execution_mode == "parallel"
+        else ort.ExecutionMode.ORT_SEQUENTIAL
+    )
+    options.graph_optimization_level = levels[optimization or config.graph_optimization]
+    options.enable_mem_pattern = config.enable_mem_pattern
+    options.enable_cpu_mem_arena = config.enable_cpu_mem_arena
+    return options
+
+
+def file_fingerprint(path: str, length: int = 12) -> str:
+    """Short sha256 of a model file (plus its external .data weights, if any)."""
+    sha = hashlib.sha256()
+    for part in (path, path + ".data"):
+        if not os.path.exists(part):
+            continue
+        with open(part, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+    return sha.hexdigest()[:length]
+
+
+def optimized_model_path(model_path: str, config: SessionConfig) -> str:
+    """Cache file for the optimized graph of model_path under config.optimized_model_dir."""
+    import onnxruntime as ort
+
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{file_fingerprint(model_path, 16)}-ort{ort.__version__}-{config.graph_optimization}-{platform.machine()}"
+    return os.path.join(config.optimized_model_dir, f"{name}-{key}.onnx")
+
+
+def _warmup(session, runs: int) -> None:
+    """Run the session on zeros (symbolic dims -> 1) so kernels and arenas are initialized."""
+    inp = session.get_inputs()[0]
+    shape = [d if isinstance(d, int) and d > 0 else 1 for d in inp.shape]
+    dummy = np.zeros(shape, dtype=np.float32)
+    for _ in range(runs):
+        session.run(None, {inp.name: dummy})
+
+
+def create_session(model_path: str, config: Optional[SessionConfig] = None):
+    """
+    Build a CPU InferenceSession for model_path.
+    Returns (session, stats) where stats has load_ms, warmup_ms and optimized_cache (off|hit|miss).
+    """
+    import onnxruntime as ort
+
+    config = config or SessionConfig()
+    providers = ["CPUExecutionProvider"]
+    cache_state = "off"
+
+    t0 = time.perf_counter()
+    if config.optimized_model_dir and config.graph_optimization != "disable":
+        cached = optimized_model_path(model_path, config)
+        if os.path.exists(cached):
+            cache_state = "hit"
+            # Already optimized offline: skip the optimizer on load
+            session = ort.InferenceSession(cached, _session_options(config, "disable"), providers=providers)
+        else:
+            cache_state = "miss"
+            os.makedirs(config.optimized_model_dir, exist_ok=True)
+            options = _session_options(config)
+            # Write under a per-process name, then rename: several workers may start at once
+            tmp = f"{cached}.{os.getpid()}.tmp"
+            options.optimized_model_filepath = tmp
+            session = ort.InferenceSession(model_path, options, providers=providers)
+            if os.path.exists(tmp):
+                os.replace(tmp, cached)
+    else:
+        session = ort.InferenceSession(model_path, _session_options(config), providers=providers)
+    load_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    _warmup(session, config.warmup_runs)
+    warmup_ms = (time.perf_counter() - t0) * 1000
+
+    return session, {
+        "load_ms": round(load_ms, 1),
+        "warmup_ms": round(warmup_ms, 1),
+        "optimized_cache": cache_state,
+    }
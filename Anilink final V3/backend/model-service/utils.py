@@ -1,5 +1,8 @@
 """Image loading and preprocessing for ONNX models. Matches app_onnx.py."""
 
+import io
+from typing import Optional
+
 import numpy as np
 from PIL import Image
 
@@ -7,18 +10,59 @@ IMAGE_SIZE = 224
 MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
 STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
 
+# Normalization folded into one multiply-add per pixel: (x / 255 - mean) / std == x * SCALE + BIAS
+SCALE = (1.0 / (255.0 * STD)).astype(np.float32).reshape(3, 1, 1)
+BIAS = (-MEAN / STD).astype(np.float32).reshape(3, 1, 1)
+
+# JPEG draft decoding target: the decoder downscales by 1/2, 1/4 or 1/8 in the DCT but never
+# below this size, so the final resize still sees at least 2x oversampling.
+DRAFT_SIZE = 2 * IMAGE_SIZE
+
+
+def decode(image_bytes: bytes, draft: bool = True) -> tuple[Image.Image, tuple[int, int]]:
+    """Decode to an RGB image of IMAGE_SIZE x IMAGE_SIZE; also returns the original (width, height)."""
+    img = Image.open(io.BytesIO(image_bytes))
+    original_size = img.size
+    if draft:
+        # Only JPEGs support draft mode; other formats ignore it and decode at full size
+        img.draft("RGB", (DRAFT_SIZE, DRAFT_SIZE))
+    img = img.convert("RGB")
+    return img.resize((IMAGE_SIZE, IMAGE_SIZE), Image.Resampling.BICUBIC), original_size
+
+
+def decode_resized(image_bytes: bytes, draft: bool = True) -> Image.Image:
+    """Decode to an RGB image of IMAGE_SIZE x IMAGE_SIZE (bicubic, the PIL default used before)."""
+    return decode(image_bytes, draft)[0]
+
+
+def normalize_into(img: Image.Image, out: np.ndarray) -> np.ndarray:
+    """Normalize a decoded 224x224 RGB image into `out`, a float32 [3, 224, 224] buffer."""
+    pixels = np.asarray(img)  # HWC uint8
+    chw = pixels.transpose(2, 0, 1)
+    np.multiply(chw, SCALE, out=out)
+    np.add(out, BIAS, out=out)
+    return out
+
+
+def preprocess_into(image_bytes: bytes, out: np.ndarray, draft: bool = True) -> np.ndarray:
+    """
+    Decode + normalize one image straight into `out`, a float32 [3, 224, 224] buffer
+    (e.g. one slot of a batch tensor: batch[i]). No intermediate float arrays are allocated.
+    """
+    return normalize_into(decode_resized(image_bytes, draft), out)
+
 
-def load_and_preprocess(image_bytes: bytes) -> np.ndarray:
+def load_and_preprocess(
+    image_bytes: bytes, out: Optional[np.ndarray] = None, draft: bool = True
+) -> np.ndarray:
     """
     Load image from bytes and preprocess for ONNX.
     - Resize to 224x224
     - ImageNet mean/std normalization
     - CHW format [1, 3, 224, 224]
+    Pass `out` (float32 [1, 3, 224, 224]) to reuse a buffer instead of allocating one.
     """
-    img = Image.open(__import__("io").BytesIO(image_bytes)).convert("RGB")
-    img = img.resize((IMAGE_SIZE, IMAGE_SIZE))
-    img_array = np.array(img).astype(np.float32) / 255.0
-    img_array = (img_array - MEAN) / STD
-    img_array = np.transpose(img_array, (2, 0, 1))
-    img_array = np.expand_dims(img_array, axis=0)
-    return img_array.astype(np.float32)
+    if out is None:
+        out = np.empty((1, 3, IMAGE_SIZE, IMAGE_SIZE), dtype=np.float32)
+    preprocess_into(image_bytes, out[0], draft)
+    return out
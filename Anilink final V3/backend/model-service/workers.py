@@ -0,0 +1,66 @@
+"""
+Executor layer for ONNX inference, so decode + session runs never block the event loop.
+- thread: one shared pair of sessions (InferenceSession.run is thread-safe)
+- process: each worker process loads its own sessions once via _load_sessions
+"""
+
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from registry import ModelSpec
+from sessions import SessionConfig
+
+EXECUTOR_KINDS = ("thread", "process")
+
+
+def default_worker_count(intra_op_threads: int) -> int:
+    """Enough workers that workers * intra-op threads covers every core."""
+    cores = os.cpu_count() or 1
+    return max(1, cores // max(1, intra_op_threads))
+
+
+def _init_process_worker(spec: ModelSpec, session_config: SessionConfig) -> None:
+    """Load sessions once per worker process (skipped if models are missing; /infer returns 503)."""
+    from inference import _load_sessions
+
+    if spec.missing() is None:
+        _load_sessions(spec, session_config)
+
+
+def create_executor(
+    kind: str,
+    max_workers: int,
+    spec: ModelSpec,
+    session_config: SessionConfig,
+) -> Executor:
+    """
+    Build the inference executor for INFERENCE_EXECUTOR. Process workers are bound to spec;
+    a model swap builds a new executor for the new spec (see main._activate).
+    """
+    if kind == "thread":
+        return ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="inference")
+    if kind == "process":
+        # spawn: never fork a parent that may already hold ORT thread pools
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_process_worker,
+            initargs=(spec, session_config),
+        )
+    raise ValueError(f"Unknown INFERENCE_EXECUTOR: {kind}. Choose one of {EXECUTOR_KINDS}")
+
+
+def _worker_session_stats() -> dict:
+    from inference import session_stats
+
+    return {"pid": os.getpid(), **session_stats()}
+
+
+def prime_executor(executor: Executor, max_workers: int) -> list[dict]:
+    """
+    Start every process worker now, so model load + warm-up happen before the first request
+    (ProcessPoolExecutor otherwise spawns workers lazily). Returns each worker's session stats.
+    """
+    futures = [executor.submit(_worker_session_stats) for _ in range(max_workers)]
+    return [future.result() for future in futures]
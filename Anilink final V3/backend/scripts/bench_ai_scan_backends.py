@@ -0,0 +1,178 @@
+"""
+Benchmark: end-to-end POST /v1/ai-scan/analyze latency with the http and in_process
+inference backends (AI_SCAN_INFERENCE_BACKEND).
+
+Each mode runs in its own subprocess: the ai_scan router is mounted on a bare FastAPI app
+(auth stubbed; no animal_id is sent, so nothing is persisted) and driven over ASGI by
+--concurrency clients. The result cache is disabled so every request reaches the models.
+The http mode needs a model-service at MODEL_SERVICE_URL serving the same models as
+MODEL_CATTLE_PATH / MODEL_FMD_PATH.
+
+Run from backend/:
+  python scripts/bench_ai_scan_backends.py --images <dir of photos> --requests 200 --concurrency 4
+  python scripts/bench_ai_scan_backends.py --synthetic 16 --modes in_process --report bench.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+def _load_images(args) -> list[tuple[str, bytes]]:
+    if args.images:
+        paths = sorted(p for p in Path(args.images).rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+        if not paths:
+            sys.exit(f"No images found under {args.images}")
+        return [(p.name, p.read_bytes()) for p in paths[: args.max_images]]
+
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(0)
+    images = []
+    for i in range(args.synthetic):
+        # Smooth random texture at phone-camera size, so decode cost is realistic
+        small = Image.fromarray(rng.integers(0, 256, (24, 32, 3), dtype=np.uint8))
+        buf = io.BytesIO()
+        small.resize((1600, 1200), Image.Resampling.BICUBIC).save(buf, format="JPEG", quality=90)
+        images.append((f"synthetic_{i}.jpg", buf.getvalue()))
+    return images
+
+
+def _percentile(values: list[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+
+async def _run_mode(args) -> dict:
+    """Child process: drive /analyze with the backend selected by the environment."""
+    sys.path.insert(0, str(BACKEND_DIR))
+    import httpx
+    from fastapi import FastAPI
+
+    from app.core.config import settings
+    from app.core.db import get_db
+    from app.core.security import get_current_active_user
+    from app.modules.ai_scan.router import router
+    from app.modules.ai_scan.service import inference_client
+
+    app = FastAPI()
+    app.include_router(router, prefix="/v1/ai-scan")
+    app.dependency_overrides[get_current_active_user] = lambda: SimpleNamespace(id=uuid.uuid4())
+    app.dependency_overrides[get_db] = lambda: None
+
+    images = _load_images(args)
+    t0 = time.perf_counter()
+    await inference_client.start()
+    startup_ms = (time.perf_counter() - t0) * 1000
+
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(args.warmup + args.requests))
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=60
+    ) as client:
+
+        async def worker() -> None:
+            nonlocal errors
+            for i in counter:
+                name, contents = images[i % len(images)]
+                start = time.perf_counter()
+                resp = await client.post(
+                    "/v1/ai-scan/analyze",
+                    files={"image": (name, contents, "image/jpeg")},
+                    data={"threshold": "0.5"},
+                )
+                if i < args.warmup:
+                    continue
+                if resp.status_code == 200:
+                    latencies.append((time.perf_counter() - start) * 1000)
+                else:
+                    errors += 1
+                    if args.verbose:
+                        print(f"  {resp.status_code}: {resp.text[:200]}", file=sys.stderr)
+
+        wall = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        wall = time.perf_counter() - wall
+    await inference_client.close()
+
+    report = {
+        "mode": settings.AI_SCAN_INFERENCE_BACKEND,
+        "requests": len(latencies),
+        "errors": errors,
+        "concurrency": args.concurrency,
+        "startup_ms": round(startup_ms, 1),
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+    }
+    if latencies:
+        report.update(
+            mean_ms=round(statistics.fmean(latencies), 2),
+            p50_ms=round(_percentile(latencies, 50), 2),
+            p95_ms=round(_percentile(latencies, 95), 2),
+            p99_ms=round(_percentile(latencies, 99), 2),
+        )
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--images", help="Directory of images to upload (searched recursively)")
+    source.add_argument("--synthetic", type=int, default=16, help="Generate N 1600x1200 JPEGs (default)")
+    parser.add_argument("--max-images", type=int, default=64)
+    parser.add_argument("--modes", default="http,in_process", help="Comma-separated backends to compare")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per mode")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--report", help="Write the per-mode results as JSON")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(_run_mode(args))))
+        return
+
+    child_args = [a for a in sys.argv[1:] if a != "--child"]
+    reports = []
+    for mode in [m.strip() for m in args.modes.split(",") if m.strip()]:
+        env = dict(os.environ, AI_SCAN_INFERENCE_BACKEND=mode, AI_SCAN_CACHE_ENABLED="false")
+        proc = subprocess.run(
+            [sys.executable, __file__, *child_args, "--child"],
+            env=env,
+            cwd=BACKEND_DIR,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        if proc.returncode != 0:
+            print(f"{mode}: benchmark failed (exit {proc.returncode})", file=sys.stderr)
+            continue
+        # The last stdout line is the report; model loading may print above it
+        reports.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    print(f"{'mode':<12}{'reqs':>6}{'err':>5}{'rps':>9}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}  (ms)")
+    for r in reports:
+        print(
+            f"{r['mode']:<12}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>9}"
+            f"{r.get('mean_ms', '-'):>9}{r.get('p50_ms', '-'):>9}{r.get('p95_ms', '-'):>9}{r.get('p99_ms', '-'):>9}"
+        )
+    if args.report:
+        Path(args.report).write_text(json.dumps(reports, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -21,7 +21,7 @@ warnings.filterwarnings('ignore')
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import Dataset, DataLoader, random_split
+from torch.utils.data import Dataset
 import torchvision.transforms as transforms
 from torchvision.models import mobilenet_v3_small, MobileNet_V3_Small_Weights
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
@@ -30,6 +30,12 @@ from PIL import Image
 import albumentations as A
 from albumentations.pytorch import ToTensorV2
 
+# Shared DataLoader factory of the training scripts (AniLink_Models/Retrained_models/data_loading.py)
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / 'AniLink_Models' / 'Retrained_models'))
+from data_loading import TimedLoader, make_loader
+from dataset_cache import source_fingerprint
+from dataset_manifest import DatasetManifest
+
 # ============================================
 # CONFIGURATION
 # ============================================
@@ -44,6 +50,10 @@ class Config:
     MODELS_DIR = OUTPUT_DIR / 'models'
     RESULTS_DIR = OUTPUT_DIR / 'results'
     LOGS_DIR = OUTPUT_DIR / 'logs'
+    # Per-image size/mtime, validity and hashes; only new or changed files are inspected
+    MANIFEST_PATH = OUTPUT_DIR / 'dataset_manifest.sqlite'
+    # Phase 1 backbone embeddings (Config.PHASE1_CACHE_FEATURES)
+    FEATURE_CACHE_DIR = OUTPUT_DIR / 'feature_cache'
     
     # Data
     IMAGE_SIZE = 224
@@ -56,6 +66,11 @@ class Config:
     PHASE1_EPOCHS = 20
     PHASE1_LR = 0.001
     PHASE1_BATCH_SIZE = 32
+    # Train the heads on backbone embeddings computed once and kept in a memory-mapped array
+    # instead of running the frozen backbone on every image every epoch
+    PHASE1_CACHE_FEATURES = True
+    # 0: one non-augmented view per training image; N: N augmented views, one drawn per epoch
+    PHASE1_AUGMENTED_VIEWS = 0
     
     # Training - Phase 2
     PHASE2_EPOCHS = 15
@@ -63,7 +78,7 @@ class Config:
     PHASE2_BATCH_SIZE = 32
     
     # General
-    NUM_WORKERS = 4
+    NUM_WORKERS = None  # None = one per available core, minus one for the training loop
     DEVICE = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     SAVE_BEST_ONLY = True
     PATIENCE = 5  # Early stopping patience
@@ -160,58 +175,75 @@ def get_augmentation_transforms(stage='train'):
             ToTensorV2()
         ])
 
+# Manifest class of each source folder -> (id_label, diag_label)
+# id: 0 = Cattle, 1 = Not-Cattle; diag: 0 = Healthy, 1 = FMD (no diagnosis for non-cattle)
+CLASS_LABELS = {
+    0: (0, 0),  # Healthy cattle
+    1: (0, 1),  # Infected cattle
+    2: (1, 0),  # Non-cattle animals
+}
+
 def prepare_dataset():
-    """Prepare dataset from directory structure"""
+    """Prepare dataset from directory structure (via the incremental dataset manifest)"""
     logger.info("Preparing dataset...")
     
-    image_paths = []
-    id_labels = []      # 0 = Cattle, 1 = Not-Cattle
-    diag_labels = []    # 0 = Healthy, 1 = FMD
-    
-    # Healthy cattle (Cattle + Healthy)
-    if Config.CATTLE_HEALTHY_DIR.exists():
-        for img_path in Config.CATTLE_HEALTHY_DIR.glob('*.jpg') + Config.CATTLE_HEALTHY_DIR.glob('*.png'):
-            image_paths.append(img_path)
-            id_labels.append(0)      # Cattle
-            diag_labels.append(0)    # Healthy
-    
-    # Infected cattle (Cattle + FMD)
-    if Config.CATTLE_INFECTED_DIR.exists():
-        for img_path in Config.CATTLE_INFECTED_DIR.glob('*.jpg') + Config.CATTLE_INFECTED_DIR.glob('*.png'):
-            image_paths.append(img_path)
-            id_labels.append(0)      # Cattle
-            diag_labels.append(1)    # FMD
-    
-    # Non-cattle animals
-    if Config.NON_CATTLE_DIR.exists():
-        for img_path in Config.NON_CATTLE_DIR.glob('*.jpg') + Config.NON_CATTLE_DIR.glob('*.png'):
-            image_paths.append(img_path)
-            id_labels.append(1)      # Not-Cattle
-            diag_labels.append(0)    # No diagnosis for non-cattle
+    manifest = DatasetManifest(Config.MANIFEST_PATH)
+    records = manifest.scan({
+        Config.CATTLE_HEALTHY_DIR: 0,
+        Config.CATTLE_INFECTED_DIR: 1,
+        Config.NON_CATTLE_DIR: 2,
+    })
+    manifest.close()
+    
+    unreadable = [record['path'] for record in records if not record['valid']]
+    if unreadable:
+        logger.warning(f"Skipping {len(unreadable)} unreadable images, e.g. {unreadable[:3]}")
+    records = [record for record in records if record['valid']]
+    
+    image_paths = [Path(record['path']) for record in records]
+    id_labels = [CLASS_LABELS[record['label']][0] for record in records]
+    diag_labels = [CLASS_LABELS[record['label']][1] for record in records]
+    content_hashes = [record['md5'] for record in records]
     
     logger.info(f"Found {len(image_paths)} images")
-    logger.info(f"  Healthy cattle: {sum((id_labels[i] == 0 and diag_labels[i] == 0) for i in range(len(image_paths)))}")
-    logger.info(f"  Infected cattle: {sum((id_labels[i] == 0 and diag_labels[i] == 1) for i in range(len(image_paths)))}")
-    logger.info(f"  Non-cattle: {sum(id_labels[i] == 1 for i in range(len(image_paths)))}")
+    logger.info(f"  Healthy cattle: {sum(record['label'] == 0 for record in records)}")
+    logger.info(f"  Infected cattle: {sum(record['label'] == 1 for record in records)}")
+    logger.info(f"  Non-cattle: {sum(record['label'] == 2 for record in records)}")
     
-    return image_paths, id_labels, diag_labels
+    return image_paths, id_labels, diag_labels, content_hashes
 
-def split_dataset(image_paths, id_labels, diag_labels):
-    """Split dataset into train/val/test"""
+def split_dataset(image_paths, id_labels, diag_labels, content_hashes=None):
+    """
+    Split dataset into train/val/test. Images with the same content hash (copies of one
+    photo) are kept in the same split, so a copy of a training image is never validated on.
+    """
     logger.info("Splitting dataset...")
     
     total = len(image_paths)
     train_size = int(total * Config.TRAIN_SPLIT)
     val_size = int(total * Config.VAL_SPLIT)
     
-    # Indices
-    indices = np.arange(total)
-    np.random.seed(Config.RANDOM_SEED)
-    np.random.shuffle(indices)
+    # Groups of identical images, in order of first appearance (one per image without hashes)
+    groups = {}
+    for i, key in enumerate(content_hashes if content_hashes is not None else range(total)):
+        groups.setdefault(key, []).append(i)
+    groups = list(groups.values())
     
-    train_indices = indices[:train_size]
-    val_indices = indices[train_size:train_size + val_size]
-    test_indices = indices[train_size + val_size:]
+    # Shuffle groups; without duplicates this is the same permutation as shuffling indices
+    order = np.arange(len(groups))
+    np.random.seed(Config.RANDOM_SEED)
+    np.random.shuffle(order)
+    
+    train_indices, val_indices, test_indices = [], [], []
+    for g in order:
+        if len(train_indices) < train_size:
+            train_indices.extend(groups[g])
+        elif len(val_indices) < val_size:
+            val_indices.extend(groups[g])
+        else:
+            test_indices.extend(groups[g])
+    if total - len(groups):
+        logger.info(f"Kept {total - len(groups)} duplicate images in the split of their original")
     
     # Split
     train_paths = [image_paths[i] for i in train_indices]
@@ -238,8 +270,8 @@ def create_dataloaders():
     """Create train/val/test dataloaders"""
     logger.info("Creating dataloaders...")
     
-    image_paths, id_labels, diag_labels = prepare_dataset()
-    train_data, val_data, test_data = split_dataset(image_paths, id_labels, diag_labels)
+    image_paths, id_labels, diag_labels, content_hashes = prepare_dataset()
+    train_data, val_data, test_data = split_dataset(image_paths, id_labels, diag_labels, content_hashes)
     
     # Create datasets
     train_transform = get_augmentation_transforms('train')
@@ -250,31 +282,30 @@ def create_dataloaders():
     test_dataset = CattleDataset(test_data[0], test_data[1], transform=val_transform)
     
     # Create dataloaders
-    train_loader = DataLoader(
+    train_loader = make_loader(
         train_dataset,
         batch_size=Config.PHASE1_BATCH_SIZE,
         shuffle=True,
         num_workers=Config.NUM_WORKERS,
-        pin_memory=True
+        seed=Config.RANDOM_SEED
     )
     
-    val_loader = DataLoader(
+    val_loader = make_loader(
         val_dataset,
         batch_size=Config.PHASE1_BATCH_SIZE,
         shuffle=False,
-        num_workers=Config.NUM_WORKERS,
-        pin_memory=True
+        num_workers=Config.NUM_WORKERS
     )
     
-    test_loader = DataLoader(
+    test_loader = make_loader(
         test_dataset,
         batch_size=Config.PHASE1_BATCH_SIZE,
         shuffle=False,
         num_workers=Config.NUM_WORKERS,
-        pin_memory=True
+        persistent=False
     )
     
-    logger.info("Dataloaders created successfully")
+    logger.info(f"Dataloaders created successfully ({train_loader.num_workers} workers)")
     
     return train_loader, val_loader, test_loader
 
@@ -329,7 +360,10 @@ class CattleMultiTaskModel(nn.Module):
         # Extract features
         features = self.backbone(x)
         
-        # Dual head outputs
+        return self.forward_heads(features)
+    
+    def forward_heads(self, features):
+        """Dual head outputs for backbone features (also used on cached features)"""
         id_output = self.id_head(features)
         diag_output = self.diag_head(features)
         
@@ -345,6 +379,96 @@ class CattleMultiTaskModel(nn.Module):
         for param in self.backbone.parameters():
             param.requires_grad = True
 
+# ============================================
+# FEATURE CACHE (PHASE 1)
+# ============================================
+def extract_features(model, dataset, name, views, device):
+    """
+    Backbone embeddings of every image in `dataset` as a memory-mapped float32 array of shape
+    (views, N, feature_dim), computed once with the backbone in eval mode and reused by later
+    runs while the images and view settings are unchanged. views=0 is one view through the
+    validation transform, otherwise `views` passes through the dataset's own (augmenting) one.
+    """
+    Config.FEATURE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    array_path = Config.FEATURE_CACHE_DIR / f'{name}.npy'
+    meta_path = Config.FEATURE_CACHE_DIR / f'{name}.json'
+    fingerprint = source_fingerprint(
+        [str(path) for path in dataset.image_paths], dataset.labels, Config.IMAGE_SIZE
+    ) + f'|views={views}|backbone={MobileNet_V3_Small_Weights.IMAGENET1K_V1}'
+    
+    if array_path.exists() and meta_path.exists():
+        with open(meta_path) as f:
+            if json.load(f).get('fingerprint') == fingerprint:
+                logger.info(f"Using cached {name} features from {array_path}")
+                return np.load(array_path, mmap_mode='r')
+    
+    if views == 0:
+        dataset = CattleDataset(dataset.image_paths, dataset.labels, transform=get_augmentation_transforms('val'))
+    passes = max(views, 1)
+    logger.info(f"Extracting {name} features: {len(dataset)} images x {passes} view(s)...")
+    
+    tmp_path = Config.FEATURE_CACHE_DIR / f'{name}.partial.npy'
+    features = np.lib.format.open_memmap(
+        tmp_path, mode='w+', dtype=np.float32, shape=(passes, len(dataset), model.feature_dim)
+    )
+    loader = make_loader(dataset, batch_size=Config.PHASE1_BATCH_SIZE * 2, shuffle=False,
+                         num_workers=Config.NUM_WORKERS, persistent=False)
+    model.backbone.eval()
+    with torch.no_grad():
+        for view in range(passes):
+            offset = 0
+            for batch in tqdm(loader, desc=f'Features {name} ({view + 1}/{passes})'):
+                embeddings = model.backbone(batch['image'].to(device)).cpu().numpy()
+                features[view, offset:offset + len(embeddings)] = embeddings
+                offset += len(embeddings)
+    features.flush()
+    del features
+    os.replace(tmp_path, array_path)
+    with open(meta_path, 'w') as f:
+        json.dump({'fingerprint': fingerprint, 'images': len(dataset), 'views': passes}, f)
+    
+    return np.load(array_path, mmap_mode='r')
+
+class FeatureLoader:
+    """
+    Batches of cached features in the same dict form as the image loaders (with 'features'
+    instead of 'image'); with several views, each pass draws one view per sample.
+    """
+    num_workers = 0
+    
+    def __init__(self, features, labels, batch_size, shuffle=False, seed=None):
+        self.features = features
+        self.id_labels = torch.tensor([label[0] for label in labels], dtype=torch.long)
+        self.diag_labels = torch.tensor([label[1] for label in labels], dtype=torch.long)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.default_rng(seed)
+    
+    def __len__(self):
+        return (len(self.id_labels) + self.batch_size - 1) // self.batch_size
+    
+    def __iter__(self):
+        total = len(self.id_labels)
+        order = self.rng.permutation(total) if self.shuffle else np.arange(total)
+        views = self.rng.integers(0, self.features.shape[0], size=total)
+        for start in range(0, total, self.batch_size):
+            indices = order[start:start + self.batch_size]
+            yield {
+                'features': torch.from_numpy(np.asarray(self.features[views[indices], indices])),
+                'id_label': self.id_labels[indices],
+                'diag_label': self.diag_labels[indices],
+            }
+
+def cached_feature_loaders(model, train_loader, val_loader, device):
+    """Phase 1 loaders over cached backbone features of the train and validation images"""
+    train_features = extract_features(model, train_loader.dataset, 'train', Config.PHASE1_AUGMENTED_VIEWS, device)
+    val_features = extract_features(model, val_loader.dataset, 'val', 0, device)
+    return (
+        FeatureLoader(train_features, train_loader.dataset.labels, Config.PHASE1_BATCH_SIZE,
+                      shuffle=True, seed=Config.RANDOM_SEED),
+        FeatureLoader(val_features, val_loader.dataset.labels, Config.PHASE1_BATCH_SIZE),
+    )
+
 # ============================================
 # TRAINING FUNCTIONS
 # ============================================
@@ -401,6 +525,12 @@ class MetricsMeter:
         self.diag_preds = []
         self.diag_targets = []
 
+def forward_batch(model, batch, device):
+    """Model outputs for a batch of images, or of cached backbone features (phase 1)"""
+    if 'features' in batch:
+        return model.forward_heads(batch['features'].to(device))
+    return model(batch['image'].to(device))
+
 def train_epoch(model, train_loader, criterion_id, criterion_diag, optimizer, device):
     """Train for one epoch"""
     model.train()
@@ -410,12 +540,11 @@ def train_epoch(model, train_loader, criterion_id, criterion_diag, optimizer, de
     pbar = tqdm(train_loader, desc='Training')
     
     for batch in pbar:
-        images = batch['image'].to(device)
         id_labels = batch['id_label'].to(device)
         diag_labels = batch['diag_label'].to(device)
         
         # Forward pass
-        id_logits, diag_logits = model(images)
+        id_logits, diag_logits = forward_batch(model, batch, device)
         
         # Loss
         id_loss = criterion_id(id_logits, id_labels)
@@ -460,12 +589,11 @@ def validate(model, val_loader, criterion_id, criterion_diag, device):
         pbar = tqdm(val_loader, desc='Validation')
         
         for batch in pbar:
-            images = batch['image'].to(device)
             id_labels = batch['id_label'].to(device)
             diag_labels = batch['diag_label'].to(device)
             
             # Forward pass
-            id_logits, diag_logits = model(images)
+            id_logits, diag_logits = forward_batch(model, batch, device)
             
             # Loss
             id_loss = criterion_id(id_logits, id_labels)
@@ -535,6 +663,10 @@ def train_phase1(model, train_loader, val_loader, device):
     
     model.freeze_backbone()
     
+    if Config.PHASE1_CACHE_FEATURES:
+        # The backbone is frozen: run it once per image (and view) instead of every epoch
+        train_loader, val_loader = cached_feature_loaders(model, train_loader, val_loader, device)
+    
     # Optimizer - only optimize heads
     optimizer = optim.Adam(
         [p for p in model.parameters() if p.requires_grad],
@@ -549,12 +681,14 @@ def train_phase1(model, train_loader, val_loader, device):
     best_val_acc = 0
     patience_counter = 0
     history = {'train': [], 'val': []}
+    timed_train_loader = TimedLoader(train_loader)
     
     for epoch in range(Config.PHASE1_EPOCHS):
         logger.info(f"\nEpoch {epoch+1}/{Config.PHASE1_EPOCHS}")
         
         # Train
-        train_metrics = train_epoch(model, train_loader, criterion_id, criterion_diag, optimizer, device)
+        train_metrics = train_epoch(model, timed_train_loader, criterion_id, criterion_diag, optimizer, device)
+        train_metrics['data_wait_ratio'] = timed_train_loader.wait_ratio
         
         # Validate
         val_metrics = validate(model, val_loader, criterion_id, criterion_diag, device)
@@ -562,6 +696,7 @@ def train_phase1(model, train_loader, val_loader, device):
         # Log
         logger.info(f"Train - ID Acc: {train_metrics['id_accuracy']:.4f}, Diag Acc: {train_metrics['diag_accuracy']:.4f}")
         logger.info(f"Val   - ID Acc: {val_metrics['id_accuracy']:.4f}, Diag Acc: {val_metrics['diag_accuracy']:.4f}")
+        logger.info(timed_train_loader.report())
         
         history['train'].append(train_metrics)
         history['val'].append(val_metrics)
@@ -611,12 +746,14 @@ def train_phase2(model, train_loader, val_loader, device):
     best_val_acc = 0
     patience_counter = 0
     history = {'train': [], 'val': []}
+    timed_train_loader = TimedLoader(train_loader)
     
     for epoch in range(Config.PHASE2_EPOCHS):
         logger.info(f"\nEpoch {epoch+1}/{Config.PHASE2_EPOCHS}")
         
         # Train
-        train_metrics = train_epoch(model, train_loader, criterion_id, criterion_diag, optimizer, device)
+        train_metrics = train_epoch(model, timed_train_loader, criterion_id, criterion_diag, optimizer, device)
+        train_metrics['data_wait_ratio'] = timed_train_loader.wait_ratio
         
         # Validate
         val_metrics = validate(model, val_loader, criterion_id, criterion_diag, device)
@@ -624,6 +761,7 @@ def train_phase2(model, train_loader, val_loader, device):
         # Log
         logger.info(f"Train - ID Acc: {train_metrics['id_accuracy']:.4f}, Diag Acc: {train_metrics['diag_accuracy']:.4f}")
         logger.info(f"Val   - ID Acc: {val_metrics['id_accuracy']:.4f}, Diag Acc: {val_metrics['diag_accuracy']:.4f}")
+        logger.info(timed_train_loader.report())
         
         history['train'].append(train_metrics)
         history['val'].append(val_metrics)